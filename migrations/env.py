@@ -77,6 +77,15 @@ def run_migrations_online():
                 directives[:] = []
                 logger.info('No changes in schema detected.')
 
+    # the search index objects (src/search.py) are created by hand in
+    # migration c7f2e5a1b9d3, keep autogenerate from trying to drop them
+    def include_object(object, name, type_, reflected, compare_to):
+        if type_ == 'table' and name.startswith('catalog_search'):
+            return False
+        if type_ == 'index' and name in ('ix_characters_search', 'ix_planets_search'):
+            return False
+        return True
+
     connectable = current_app.extensions['migrate'].db.get_engine()
 
     with connectable.connect() as connection:
@@ -84,6 +93,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
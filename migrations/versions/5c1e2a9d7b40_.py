@@ -0,0 +1,32 @@
+"""collection version counters for ETags
+
+Revision ID: 5c1e2a9d7b40
+Revises: 2148b986e2f1
+Create Date: 2026-10-18 09:12:40.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e2a9d7b40'
+down_revision = '2148b986e2f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    collection_version = op.create_table('collection_version',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(collection_version, [
+        {'name': name, 'version': 1}
+        for name in ('user', 'planets', 'characters', 'favPlanets', 'favCharacters')
+    ])
+
+
+def downgrade():
+    op.drop_table('collection_version')
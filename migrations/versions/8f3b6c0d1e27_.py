@@ -0,0 +1,37 @@
+"""unique (user, item) indexes on favorites
+
+Revision ID: 8f3b6c0d1e27
+Revises: 5c1e2a9d7b40
+Create Date: 2026-10-18 10:41:07.552930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3b6c0d1e27'
+down_revision = '5c1e2a9d7b40'
+branch_labels = None
+depends_on = None
+
+
+FAVORITES = (
+    ('favPlanets', 'planets_id', 'ix_favPlanets_user_id_planets_id'),
+    ('favCharacters', 'characters_id', 'ix_favCharacters_user_id_characters_id'),
+)
+
+
+def upgrade():
+    for table_name, item_column, index_name in FAVORITES:
+        # Keep the oldest row of every duplicated (user, item) pair so the unique index can be built
+        fav = sa.table(table_name, sa.column('id'), sa.column('user_id'), sa.column(item_column))
+        keep = sa.select(sa.func.min(fav.c.id).label('id')).group_by(
+            fav.c.user_id, fav.c[item_column]).subquery('keep')
+        op.execute(fav.delete().where(fav.c.id.notin_(sa.select(keep.c.id))))
+        op.create_index(index_name, table_name, ['user_id', item_column], unique=True)
+
+
+def downgrade():
+    for table_name, item_column, index_name in FAVORITES:
+        op.drop_index(index_name, table_name=table_name)
@@ -0,0 +1,96 @@
+"""numeric shadow columns and filter indexes for planets and characters
+
+Revision ID: a41d7e93c5f8
+Revises: 8f3b6c0d1e27
+Create Date: 2026-10-18 12:03:55.904411
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41d7e93c5f8'
+down_revision = '8f3b6c0d1e27'
+branch_labels = None
+depends_on = None
+
+
+# table -> {shadow column: (text column, type)}; mirrors src/numeric.py
+SHADOWS = {
+    'planets': {
+        'population_num': ('populations', sa.BigInteger()),
+        'rotation_period_num': ('rotation_period', sa.Float()),
+        'orbital_period_num': ('orbital_period', sa.Float()),
+        'diameter_num': ('diameter', sa.Float()),
+        'gravity_num': ('gravity', sa.Float()),
+        'surface_water_num': ('surface_water', sa.Float()),
+    },
+    'characters': {
+        'height_num': ('height', sa.Float()),
+        'mass_num': ('mass', sa.Float()),
+    },
+}
+
+TEXT_INDEXES = {
+    'planets': ('terrain', 'climate'),
+    'characters': ('species', 'gender', 'homeworld'),
+}
+
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+BATCH_SIZE = 5000
+
+
+def parse_number(value, integer):
+    match = NUMBER.search(str(value).replace(',', '')) if value is not None else None
+    if match is None:
+        return None
+    number = float(match.group())
+    return int(number) if integer else number
+
+
+def backfill(table_name, shadows):
+    connection = op.get_bind()
+    table = sa.table(table_name, sa.column('id'),
+                     *[sa.column(source) for source, _ in shadows.values()],
+                     *[sa.column(shadow) for shadow in shadows])
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(table).where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)).mappings().all()
+        if not rows:
+            return
+        connection.execute(
+            table.update().where(table.c.id == sa.bindparam('row_id')),
+            [dict({'row_id': row['id']}, **{
+                shadow: parse_number(row[source], isinstance(type_, sa.BigInteger))
+                for shadow, (source, type_) in shadows.items()
+            }) for row in rows])
+        last_id = rows[-1]['id']
+
+
+def upgrade():
+    for table_name, shadows in SHADOWS.items():
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            for shadow, (_, type_) in shadows.items():
+                batch_op.add_column(sa.Column(shadow, type_, nullable=True))
+        backfill(table_name, shadows)
+        for shadow in shadows:
+            op.create_index(op.f('ix_%s_%s' % (table_name, shadow)), table_name, [shadow], unique=False)
+    for table_name, columns in TEXT_INDEXES.items():
+        for column in columns:
+            op.create_index(op.f('ix_%s_%s' % (table_name, column)), table_name, [column], unique=False)
+
+
+def downgrade():
+    for table_name, columns in TEXT_INDEXES.items():
+        for column in columns:
+            op.drop_index(op.f('ix_%s_%s' % (table_name, column)), table_name=table_name)
+    for table_name, shadows in SHADOWS.items():
+        for shadow in shadows:
+            op.drop_index(op.f('ix_%s_%s' % (table_name, shadow)), table_name=table_name)
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            for shadow in shadows:
+                batch_op.drop_column(shadow)
@@ -0,0 +1,90 @@
+"""search indexes: GIN tsvector (PostgreSQL) / FTS5 table (SQLite)
+
+Revision ID: c7f2e5a1b9d3
+Revises: a41d7e93c5f8
+Create Date: 2026-10-18 13:27:12.640158
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7f2e5a1b9d3'
+down_revision = 'a41d7e93c5f8'
+branch_labels = None
+depends_on = None
+
+
+# Frozen copies of the DDL in src/search.py as of this revision (`flask search-reindex` uses the live one)
+
+# index name -> (table, document expression)
+POSTGRES_INDEXES = {
+    'ix_characters_search': ('characters', "full_name || ' ' || species || ' ' || homeworld"),
+    'ix_planets_search': ('planets', "name || ' ' || terrain || ' ' || climate"),
+}
+
+# rowid = id * 2 + (0 people, 1 planets)
+SQLITE_FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS catalog_search USING fts5(
+        name, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS characters_search_ai AFTER INSERT ON characters BEGIN
+        INSERT INTO catalog_search (rowid, name, body)
+        VALUES (new.id * 2, new.full_name, new.species || ' ' || new.homeworld);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS characters_search_au AFTER UPDATE OF full_name, species, homeworld ON characters BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id * 2;
+        INSERT INTO catalog_search (rowid, name, body)
+        VALUES (new.id * 2, new.full_name, new.species || ' ' || new.homeworld);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS characters_search_ad AFTER DELETE ON characters BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS planets_search_ai AFTER INSERT ON planets BEGIN
+        INSERT INTO catalog_search (rowid, name, body)
+        VALUES (new.id * 2 + 1, new.name, new.terrain || ' ' || new.climate);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS planets_search_au AFTER UPDATE OF name, terrain, climate ON planets BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id * 2 + 1;
+        INSERT INTO catalog_search (rowid, name, body)
+        VALUES (new.id * 2 + 1, new.name, new.terrain || ' ' || new.climate);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS planets_search_ad AFTER DELETE ON planets BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id * 2 + 1;
+    END""",
+)
+
+SQLITE_FTS_TRIGGERS = (
+    'characters_search_ai', 'characters_search_au', 'characters_search_ad',
+    'planets_search_ai', 'planets_search_au', 'planets_search_ad',
+)
+
+SQLITE_FTS_REBUILD = (
+    'DELETE FROM catalog_search',
+    """INSERT INTO catalog_search (rowid, name, body)
+        SELECT id * 2, full_name, species || ' ' || homeworld FROM characters""",
+    """INSERT INTO catalog_search (rowid, name, body)
+        SELECT id * 2 + 1, name, terrain || ' ' || climate FROM planets""",
+    "INSERT INTO catalog_search (catalog_search) VALUES ('optimize')",
+)
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for name, (table, document) in POSTGRES_INDEXES.items():
+            op.execute("CREATE INDEX %s ON %s USING gin (to_tsvector('simple'::regconfig, %s))"
+                       % (name, table, document))
+    elif dialect == 'sqlite':
+        for statement in SQLITE_FTS_DDL + SQLITE_FTS_REBUILD:
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for name in POSTGRES_INDEXES:
+            op.execute('DROP INDEX %s' % name)
+    elif dialect == 'sqlite':
+        for trigger in SQLITE_FTS_TRIGGERS:
+            op.execute('DROP TRIGGER IF EXISTS %s' % trigger)
+        op.execute('DROP TABLE IF EXISTS catalog_search')
@@ -0,0 +1,48 @@
+"""favorite_count on planets and characters
+
+Revision ID: d3a9b51f6e08
+Revises: c7f2e5a1b9d3
+Create Date: 2026-10-18 18:05:12.318274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a9b51f6e08'
+down_revision = 'c7f2e5a1b9d3'
+branch_labels = None
+depends_on = None
+
+
+# catalog table -> (favorites table, foreign key)
+COUNTED = {
+    'planets': ('favPlanets', 'planets_id'),
+    'characters': ('favCharacters', 'characters_id'),
+}
+
+# Plain ALTER TABLE (no batch mode): on SQLite a batch rebuild of planets and
+# characters would drop the catalog_search triggers.
+
+
+def upgrade():
+    for table_name, (fav_table, fk) in COUNTED.items():
+        op.add_column(table_name, sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+        op.create_index(op.f('ix_%s_%s' % (fav_table, fk)), fav_table, [fk], unique=False)
+
+        table = sa.table(table_name, sa.column('id'), sa.column('favorite_count'))
+        favorites = sa.table(fav_table, sa.column(fk))
+        op.get_bind().execute(table.update().values(favorite_count=(
+            sa.select(sa.func.count()).select_from(favorites)
+            .where(favorites.c[fk] == table.c.id).scalar_subquery())))
+
+        op.create_index(op.f('ix_%s_favorite_count_id' % table_name), table_name, ['favorite_count', 'id'],
+                        unique=False)
+
+
+def downgrade():
+    for table_name, (fav_table, fk) in COUNTED.items():
+        op.drop_index(op.f('ix_%s_favorite_count_id' % table_name), table_name=table_name)
+        op.drop_column(table_name, 'favorite_count')
+        op.drop_index(op.f('ix_%s_%s' % (fav_table, fk)), table_name=fav_table)
@@ -0,0 +1,30 @@
+"""user.password holds encoded hashes: String(80) -> String(255)
+
+Revision ID: e6b48c1f2a95
+Revises: d3a9b51f6e08
+Create Date: 2026-10-18 21:14:37.502816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b48c1f2a95'
+down_revision = 'd3a9b51f6e08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # batch mode rebuilds the table on SQLite; user has no triggers to lose
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=80), type_=sa.String(length=255),
+                              existing_nullable=False)
+
+
+def downgrade():
+    # Hashes do not fit in 80 characters: only downgrade a database without them
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.alter_column('password', existing_type=sa.String(length=255), type_=sa.String(length=80),
+                              existing_nullable=False)
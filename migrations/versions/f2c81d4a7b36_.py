@@ -0,0 +1,25 @@
+"""lower(user.email) index for case-insensitive email lookups
+
+Revision ID: f2c81d4a7b36
+Revises: e6b48c1f2a95
+Create Date: 2026-10-19 09:41:06.284117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c81d4a7b36'
+down_revision = 'e6b48c1f2a95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Not unique: rows from before emails were lowercased may differ only in case
+    op.create_index('ix_user_email_lower', 'user', [sa.text('lower(email)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_email_lower', table_name='user')
@@ -0,0 +1,143 @@
+"""
+User registration and bulk user import.
+
+Emails are stored lowercased. Both paths look the email up with
+``lower(user.email)`` (index ``ix_user_email_lower``, so mixed-case rows
+from before are found too) before hashing, so a duplicate costs one index
+lookup instead of a password hash.
+The unique index still settles races: a concurrent registration that wins
+turns the commit into a 409, and the bulk import inserts with "ignore
+conflicts".
+
+``register_user`` hashes in the bounded pool of ``passwords.hash_in_pool``.
+``import_users`` reads the same formats as ``flask ingest`` (json, jsonl,
+csv with ``name``, ``email`` and ``password``) in chunks, hashes each chunk
+over a process pool and inserts it in its own transaction.
+"""
+import time
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from models import db, User
+from ingest import chunked, read_records
+from passwords import hash_in_pool, hash_many, process_pool, default_scheme, default_cost
+from versioning import bump
+from utils import APIException
+
+DEFAULT_BATCH_SIZE = 1000
+MIN_PASSWORD_LENGTH = 8
+NAME_LENGTH = User.__table__.c.name.type.length
+EMAIL_LENGTH = User.__table__.c.email.type.length
+
+
+def clean_user(record):
+    """``(name, email, password)`` from a request body or import record, or the reason it is invalid."""
+    if not isinstance(record, dict):
+        return None, "Expected an object with name, email and password"
+    name = str(record.get("name") or "").strip()
+    email = str(record.get("email") or "").strip().lower()
+    password = record.get("password")
+    if not name or len(name) > NAME_LENGTH:
+        return None, "name is required (at most %d characters)" % NAME_LENGTH
+    if "@" not in email or len(email) > EMAIL_LENGTH:
+        return None, "A valid email is required (at most %d characters)" % EMAIL_LENGTH
+    if not isinstance(password, str) or len(password) < MIN_PASSWORD_LENGTH:
+        return None, "password must have at least %d characters" % MIN_PASSWORD_LENGTH
+    return (name, email, password), None
+
+
+def email_taken(email):
+    # Case-insensitive: rows created before emails were lowercased may hold mixed case (ix_user_email_lower)
+    return db.session.execute(select(User.id).where(func.lower(User.email) == email).limit(1)).first() is not None
+
+
+def register_user(body):
+    """Create an active user from ``body``; 400 when invalid, 409 when the email exists."""
+    fields, error = clean_user(body)
+    if error:
+        raise APIException(error, status_code=400)
+    name, email, password = fields
+    if email_taken(email):
+        raise APIException("Email already registered", status_code=409)
+    # The hash runs outside any transaction: no connection is held while it does
+    db.session.rollback()
+    user = User(name=name, email=email, password=hash_in_pool(password), is_active=True)
+    db.session.add(user)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise APIException("Email already registered", status_code=409)
+    return user
+
+
+def _insert_ignore(connection, rows):
+    """Insert user rows, skipping emails that already exist. Returns the rowcount."""
+    table = User.__table__
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(table).on_conflict_do_nothing(index_elements=["email"])
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(table).on_conflict_do_nothing(index_elements=["email"])
+    elif dialect == "mysql":
+        stmt = mysql.insert(table).prefix_with("IGNORE")
+    else:
+        stmt = insert(table)
+    return connection.execute(stmt, rows).rowcount
+
+
+def import_users(engine, path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, processes=None, cost=None,
+                 progress=None):
+    """Load the users in ``path`` and return a summary dict.
+
+    Invalid records and emails seen earlier in the file or already in the
+    database are skipped (and counted) before any hashing.
+    """
+    scheme = default_scheme()
+    cost = cost or default_cost(scheme)
+    summary = {"scheme": scheme, "cost": cost, "records": 0, "invalid": 0, "duplicates": 0, "existing": 0,
+               "inserted": 0}
+    seen = set()
+    hashing = 0.0
+    started = time.perf_counter()
+    executor = process_pool(processes)
+    try:
+        for chunk in chunked(read_records(path, fmt), batch_size):
+            summary["records"] += len(chunk)
+            users = {}
+            for record in chunk:
+                fields, error = clean_user(record)
+                if error:
+                    summary["invalid"] += 1
+                elif fields[1] in seen:
+                    summary["duplicates"] += 1
+                else:
+                    seen.add(fields[1])
+                    users[fields[1]] = fields
+            if users:
+                with engine.connect() as connection:
+                    existing = set(connection.execute(
+                        select(func.lower(User.email)).where(func.lower(User.email).in_(list(users)))).scalars())
+                summary["existing"] += len(existing)
+                users = [fields for email, fields in users.items() if email not in existing]
+            if not users:
+                continue
+            hash_started = time.perf_counter()
+            hashed = hash_many([password for _, _, password in users], scheme, cost, executor)
+            hashing += time.perf_counter() - hash_started
+            with engine.begin() as connection:
+                inserted = _insert_ignore(connection, [
+                    {"name": name, "email": email, "password": encoded, "is_active": True}
+                    for (name, email, _), encoded in zip(users, hashed)])
+                bump(connection, [User.__tablename__])
+            summary["existing"] += len(users) - inserted
+            summary["inserted"] += inserted
+            if progress is not None:
+                progress(summary["inserted"], summary["inserted"] / (time.perf_counter() - started))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    elapsed = time.perf_counter() - started
+    summary.update(seconds=round(elapsed, 3), hash_seconds=round(hashing, 3),
+                   users_per_sec=round(summary["inserted"] / elapsed, 1) if elapsed else None)
+    return summary
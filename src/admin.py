@@ -1,7 +1,36 @@
 import os
-from flask_admin import Admin
+from flask import abort, redirect, url_for
+from flask_admin import Admin, BaseView, expose
 from models import db, User, Planets, Characters, FavPlanets, FavCharacters
 from flask_admin.contrib.sqla import ModelView
+from profiling import profile_store
+
+# favorite_count lo mantienen los favoritos (popularity.py), no se edita a mano
+class CatalogView(ModelView):
+    form_excluded_columns = ("favorite_count",)
+
+# Perfiles de peticiones capturados con PROFILING (ver profiling.py), los mas recientes primero
+class ProfileView(BaseView):
+    @expose('/')
+    def index(self):
+        store = profile_store()
+        return self.render('admin/profiles.html', enabled=store is not None,
+                           profiles=store.recent() if store is not None else [])
+
+    @expose('/<profile_id>')
+    def detail(self, profile_id):
+        store = profile_store()
+        profile = store.get(profile_id) if store is not None else None
+        if profile is None:
+            abort(404)
+        return self.render('admin/profile.html', profile=profile)
+
+    @expose('/clear', methods=('POST',))
+    def clear(self):
+        store = profile_store()
+        if store is not None:
+            store.clear()
+        return redirect(url_for('.index'))
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
@@ -11,10 +40,11 @@ def setup_admin(app):
     
     # Add your models here, for example this is how we add a the User model to the admin
     admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Planets, db.session))
-    admin.add_view(ModelView(Characters, db.session))
+    admin.add_view(CatalogView(Planets, db.session))
+    admin.add_view(CatalogView(Characters, db.session))
     admin.add_view(ModelView(FavPlanets, db.session))
     admin.add_view(ModelView(FavCharacters, db.session))
+    admin.add_view(ProfileView(name='Profiles', endpoint='profiles'))
 
     # You can duplicate that line to add mew models
     # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""
+Swagger (OpenAPI 2) spec of the API at ``/swagger.json``, built from the
+view docstrings by flask_swagger. Only registered for ``APP_ROLE`` admin/all,
+and flask_swagger is imported then, not by API-only workers.
+"""
+from flask import jsonify
+
+
+def setup_swagger(app):
+    from flask_swagger import swagger
+
+    spec = {}
+
+    @app.route('/swagger.json', methods=['GET'])
+    def swagger_spec():
+        if not spec:
+            spec.update(swagger(app))
+            spec["info"] = {"title": "StarWars API", "version": "1.0"}
+        return jsonify(spec)
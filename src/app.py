@@ -2,41 +2,105 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
+import click
 from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
 from flask_cors import CORS
-from utils import APIException, generate_sitemap
-from admin import setup_admin
+from sqlalchemy.orm import selectinload
+from utils import APIException
+from commands import setup_commands
+from pagination import list_response, expand_args
+from filters import query_filters
+from numeric import setup_numeric
+from search import search_response
+from settings import app_role, database_uri, engine_options, setup_engine_events, pool_stats
+from cache import detail_response, cache_stats
+from versioning import conditional
+from serializers import FastJSONProvider
+from popularity import popular_response
+from favorites import parse_batch, add_favorite, add_favorites, remove_favorites, embed_favorites, EMBED_TABLES
+from replicas import read_only, mark_write, setup_replicas, replica_stats
+from metrics import setup_metrics, metrics_response, pool_gauges
+from profiling import setup_profiling
+from negotiation import setup_compression
+from snapshot import from_snapshot, setup_snapshot
+from ratelimit import setup_rate_limit
+from sitemap import route_document, setup_route_index
+from accounts import register_user
+from writebehind import (setup_write_behind, write_behind_enabled, queue_add, queue_remove, flush_pending,
+                         write_behind_gauges)
 from models import db, User, Planets, Characters, FavPlanets, FavCharacters
 #from models import Person
 
+# api | admin | all (por defecto): que sirve este worker, ver settings.py
+APP_ROLE = app_role()
+
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+# jsonify usa orjson cuando esta instalado
+app.json = FastJSONProvider(app)
 
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+app.config['SQLALCHEMY_DATABASE_URI'] = database_uri()
+# Pool, timeouts y PgBouncer se configuran con variables de entorno (ver settings.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Cache-Control por endpoint, sobreescribe el valor por defecto de @conditional
+app.config['CACHE_CONTROL'] = {}
+# Replicas de solo lectura separadas por comas (vacio = todo va a la base principal)
+app.config['DATABASE_REPLICA_URLS'] = os.environ.get('DATABASE_REPLICA_URLS', '')
+# Snapshot del catalogo generado con `flask export-snapshot` (vacio = se lee de la base de datos)
+app.config['SNAPSHOT_PATH'] = os.environ.get('SNAPSHOT_PATH', '')
+app.config['SNAPSHOT_CHECK_INTERVAL'] = float(os.environ.get('SNAPSHOT_CHECK_INTERVAL', 1))
 
-MIGRATE = Migrate(app, db)
 db.init_app(app)
+if APP_ROLE != "api" or click.get_current_context(silent=True) is not None:
+    # Flask-Migrate (alembic) solo lo usa `flask db`; los workers de la API no lo importan
+    from flask_migrate import Migrate
+    MIGRATE = Migrate(app, db)
+with app.app_context():
+    setup_engine_events(db.engine)
+# Columnas *_num al dia en cada escritura del ORM (API y Flask-Admin), ver numeric.py
+setup_numeric()
+setup_replicas(app)
+if APP_ROLE != "admin":
+    # Los workers de admin leen siempre la base de datos: sin snapshot ni limite de peticiones
+    setup_snapshot(app)
+# Perfilado de peticiones (PROFILING, ver profiling.py); antes de las metricas para que EXPLAIN no cuente en ellas
+setup_profiling(app)
+setup_metrics(app)
+# Se registra despues de las metricas para que estas midan el cuerpo comprimido
+setup_compression(app)
+if APP_ROLE != "admin":
+    # Limite de peticiones por cliente y endpoint (RATELIMIT_RATE, ver ratelimit.py)
+    setup_rate_limit(app)
+# Escritura diferida de favoritos (FAVORITES_WRITE_BEHIND, ver writebehind.py)
+setup_write_behind(app)
 CORS(app)
-setup_admin(app)
+if APP_ROLE in ("admin", "all"):
+    # Flask-Admin y flask_swagger solo se importan en los workers que los sirven
+    from admin import setup_admin
+    from apidocs import setup_swagger
+    setup_admin(app)
+    setup_swagger(app)
+setup_commands(app)
 
 # Handle/serialize errors like a JSON object
 @app.errorhandler(APIException)
 def handle_invalid_usage(error):
-    return jsonify(error.to_dict()), error.status_code
+    return jsonify(error.to_dict()), error.status_code, error.headers or {}
 
 # generate sitemap with all your endpoints
+# Se genera una sola vez al arrancar (setup_route_index, al final del archivo) y se sirve con ETag
 @app.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return route_document("sitemap")
+
+#Metodo Get Indice de rutas en JSON: metodos, parametros y cache de cada endpoint (ver sitemap.py)
+@app.route('/routes', methods=['GET'])
+def route_index():
+    return route_document("routes")
 
 @app.route('/user', methods=['GET'])
+@conditional(cache_control="public, max-age=300")
 def handle_hello():
 
     response_body = {
@@ -47,51 +111,76 @@ def handle_hello():
 
 #Desde aqui creamos los Endpoints del Proyecto de StarWars
 #Metodo Get Listar todos los registros de people en la base de datos
+#Paginado por cursor: ?after_id=<ultimo id>&limit=<n>, o ?stream=1 para recibir la tabla completa
+#Filtros en SQL: ?mass_gt=80&height_lte=200&gender=female&sort=-mass (ver filters.py)
+#?fields=id,full_name devuelve solo esas columnas (tambien en /people/<id>, /planets y /users)
+#Con SNAPSHOT_PATH, sin filtros ni fields, se responde desde el snapshot en memoria (ver snapshot.py)
 @app.route('/people', methods=['GET'])
+@from_snapshot(Characters)
+@read_only()
+@conditional("characters")
 def all_character():
-    character = Characters.query.all()
-    arr_character = list(map(lambda people: people.serialize(), character))
-    print(arr_character)
-    return jsonify(arr_character), 200
+    criteria, sort = query_filters(Characters)
+    return list_response(Characters, criteria, sort), 200
+
+#Metodo Get Ranking de las people con mas favoritos: ?limit=<1..100> (10 por defecto)
+#Se lee del indice (favorite_count, id); el contador lo mantienen los endpoints de favoritos
+@app.route('/people/popular', methods=['GET'])
+@read_only()
+@conditional("characters", "favCharacters", cache_control="public, max-age=30")
+def popular_characters():
+    return jsonify(popular_response(Characters, FavCharacters)), 200
 
 #Metodo Get Listar la información de una sola people
 @app.route('/people/<int:people_id>', methods=['GET'])
+@from_snapshot(Characters, id_arg="people_id", cache_control="public, max-age=60")
+@read_only()
+@conditional("characters", cache_control="public, max-age=60")
 def one_character(people_id):
-    one_people = Characters.query.get(people_id)
-    print(one_people)
-    return jsonify(one_people.serialize()), 200
+    return detail_response(Characters, people_id), 200
 
 #Metodo Get Listar todos los registros de planetas en la base de datos
+#Filtros en SQL: ?population_gt=1000000&terrain=desert&sort=-population (ver filters.py)
 @app.route('/planets', methods=['GET'])
+@from_snapshot(Planets)
+@read_only()
+@conditional("planets")
 def all_planets():
-    planets = Planets.query.all()
-    arr_planets = list(map(lambda planets: planets.serialize(), planets))
-    print(arr_planets)
-    return jsonify(arr_planets), 200
+    criteria, sort = query_filters(Planets)
+    return list_response(Planets, criteria, sort), 200
+
+#Metodo Get Ranking de los planetas con mas favoritos: ?limit=<1..100> (10 por defecto)
+@app.route('/planets/popular', methods=['GET'])
+@read_only()
+@conditional("planets", "favPlanets", cache_control="public, max-age=30")
+def popular_planets():
+    return jsonify(popular_response(Planets, FavPlanets)), 200
 
 #Metodo Get Listar la información de un solo planeta
 @app.route('/planets/<int:planet_id>', methods=['GET'])
+@from_snapshot(Planets, id_arg="planet_id", cache_control="public, max-age=60")
+@read_only()
+@conditional("planets", cache_control="public, max-age=60")
 def one_planet(planet_id):
-    one_world = Planets.query.get(planet_id)
-    print(one_world)
-    return jsonify(one_world.serialize()), 200
+    return detail_response(Planets, planet_id), 200
+
+#Metodo GET Buscar personajes y planetas por nombre/especie/planeta natal/terreno/clima
+#?q=luk sky (cada palabra es un prefijo), &type=people|planets, &page=, &limit=
+@app.route('/search', methods=['GET'])
+@read_only()
+@conditional("characters", "planets")
+def search_catalog():
+    return jsonify(search_response()), 200
 
 #Metodo POST para crear los usuarios del blog
+#El email se comprueba antes de calcular el hash de la contraseña (409 si ya existe), ver accounts.py
 @app.route('/create/user', methods=['POST'])
 def create_user():
-    body = request.json
-    name = body.get("name")
-    email = body.get("email")
-    password = body.get("password")
-
-    user = User(
-        name = name,
-        email = email,
-        password = password
-    )
+    body = request.get_json(silent=True)
     try:
-        db.session.add(user)
-        db.session.commit()
+        register_user(body)
+    except APIException:
+        raise
     except Exception as error:
         db.session.rollback()
         return jsonify({
@@ -101,115 +190,195 @@ def create_user():
     return jsonify({}), 201
 
 #Metodo GET Listar todos los usuarios del blog
+#?expand=favorites incluye los planetas y personajes favoritos de cada usuario (una consulta por tipo y pagina)
 @app.route('/users', methods=['GET'])
+@flush_pending(expand="favorites")
+@read_only()
+@conditional("user", cache_control="private, no-cache", expand={"favorites": EMBED_TABLES})
 def all_users():
-    user = User.query.all()
-    arr_user = list(map(lambda person: person.serialize(), user))
-    
-    return jsonify(arr_user), 200
+    expand = embed_favorites if "favorites" in expand_args(("favorites",)) else None
+    return list_response(User, expand=expand), 200
 
 #Metodo GET Listar todos los favoritos que pertenecen al usuario actual
+#Se cargan el usuario, sus favoritos y los planetas/personajes en un numero fijo de consultas
+#Con escritura diferida se aplican antes los favoritos pendientes del usuario
 @app.route('/users/favorites/<int:users_id>', methods=['GET'])
+@flush_pending(user_arg="users_id")
+@read_only(user_arg="users_id")
+@conditional("user", "favPlanets", "favCharacters", "planets", "characters",
+             cache_control="private, no-cache")
 def user_favotites(users_id):
 
-    # Localizar el usuario sus favoritos
-
-    # PLANET FAVORITO
-    planet_favorite = FavPlanets.query.filter_by(user_id = users_id)
-    planet = [planets.serialize() for planets in planet_favorite]
-
-    # CHARACTERS FAVORITO
-    character_favorite = FavCharacters.query.filter_by(user_id = users_id)
-    character = [character.serialize() for character in character_favorite]
+    # Localizar el usuario con sus favoritos (selectinload) y el planeta/personaje de cada uno (joinedload)
+    actual_user = db.session.get(User, users_id, options=[
+        selectinload(User.favPlanets).joinedload(FavPlanets.planets),
+        selectinload(User.favCharacters).joinedload(FavCharacters.characters),
+    ])
+    if actual_user is None:
+        raise APIException("User not found", status_code=404)
 
-    return jsonify("Favorites", planet, character), 200
+    return jsonify({
+        "user_id": actual_user.id,
+        "planets": [favorite.serialize() for favorite in actual_user.favPlanets],
+        "characters": [favorite.serialize() for favorite in actual_user.favCharacters],
+    }), 200
 
 
 
 #Metodo POST Añade un nuevo planet favorito al usuario actual con el planet id = planet_id
+#Es idempotente: si el favorito ya existe no se duplica (indice unico user_id + planets_id)
 
 @app.route('/favorite/planet/<int:planet_id>', methods=['POST'])
 def add_fav_planet(planet_id):
-    select_planet= Planets.query.get(planet_id)
-    body =  request.json
+    body = request.get_json(silent=True) or {}
     id_user = body.get("id_user")
-    actual_user = User.query.get(id_user)
-
-    favorite_planet = FavPlanets(
-        user = actual_user,
-        planets = select_planet
-    )
+    #Con FAVORITES_WRITE_BEHIND se valida, se encola y se responde 202 sin esperar el commit
+    if write_behind_enabled():
+        return queue_add(id_user, "planets", planet_id)
 
     try:
-        db.session.add(favorite_planet)
+        created = add_favorite(id_user, "planets", planet_id)
         db.session.commit()
+        mark_write(id_user)
+    except APIException:
+        db.session.rollback()
+        raise
     except Exception as error:
         db.session.rollback()
         return jsonify({
             "message": "ERROR INTERNO",
             "error": error.args
-        })
-    return jsonify({}), 200
+        }), 500
+    return jsonify({"status": "created" if created else "exists"}), 200
 
 #Metodo POST Añade una nueva people favorita al usuario actual con el people.id = people_id
+#Es idempotente: si el favorito ya existe no se duplica (indice unico user_id + characters_id)
 
 @app.route('/favorite/people/<int:people_id>', methods=['POST'])
-def add_fav_character(characters_id):
-    select_character = Characters.query.get(characters_id)
-    body = request.json
+def add_fav_character(people_id):
+    body = request.get_json(silent=True) or {}
     id_user = body.get("id_user")
-    actual_user = User. query.get(id_user)
+    #Con FAVORITES_WRITE_BEHIND se valida, se encola y se responde 202 sin esperar el commit
+    if write_behind_enabled():
+        return queue_add(id_user, "characters", people_id)
 
-    fav_character = FavCharacters(
-        user = actual_user,
-        characters = select_character
-    )
-    
     try:
-        db.session.add(fav_character)
+        created = add_favorite(id_user, "characters", people_id)
         db.session.commit()
+        mark_write(id_user)
+    except APIException:
+        db.session.rollback()
+        raise
     except Exception as error:
         db.session.rollback()
         return jsonify({
             "message": "ERROR INTERNO",
             "error": error.args
-        })
-    return jsonify({}), 200
+        }), 500
+    return jsonify({"status": "created" if created else "exists"}), 200
 
 
-#Metodo DELETE Elimina un planet favorito con el id = planet_id
+#Metodo DELETE Elimina un planet favorito con el id = planet_id (404 si no existe)
 
 @app.route('/favorite/planet/<int:planet_id>', methods=['DELETE'])
 def delete_fav_planet(planet_id):
-    delete_planet = FavPlanets.query.get(planet_id)
+    delete_planet = db.session.get(FavPlanets, planet_id)
+    if delete_planet is None:
+        raise APIException("Favorite not found", status_code=404)
+    user_id = delete_planet.user_id
+    if write_behind_enabled():
+        return queue_remove(user_id, "planets", delete_planet.planets_id)
 
     try:
         db.session.delete(delete_planet)
         db.session.commit()
+        mark_write(user_id)
     except Exception as error:
         db.session.rollback()
         return jsonify({
             "message": "ERROR INTERNO",
             "error": error.args
-        })
+        }), 500
     return jsonify({}), 200
 
-#Metodo DELETE  Elimina una people favorita con el id = people_id
+#Metodo DELETE  Elimina una people favorita con el id = people_id (404 si no existe)
 
 @app.route('/favorite/people/<int:people_id>', methods=['DELETE'])
-def delete_fav_character(characters_id):
-    delete_character = FavCharacters.query.get(characters_id)
+def delete_fav_character(people_id):
+    delete_character = db.session.get(FavCharacters, people_id)
+    if delete_character is None:
+        raise APIException("Favorite not found", status_code=404)
+    user_id = delete_character.user_id
+    if write_behind_enabled():
+        return queue_remove(user_id, "characters", delete_character.characters_id)
 
     try:
         db.session.delete(delete_character)
         db.session.commit()
+        mark_write(user_id)
     except Exception as error:
         db.session.rollback()
         return jsonify({
             "message": "ERROR INTERNO",
             "error": error.args
-        })
+        }), 500
     return jsonify({}), 200
+
+#Metodo POST / DELETE Añade o elimina varios favoritos del usuario en una sola transaccion
+#Body: {"planets": [ids], "characters": [ids]}, responde el estado de cada id
+
+@app.route('/users/<int:users_id>/favorites:batch', methods=['POST', 'DELETE'])
+@flush_pending(user_arg="users_id")
+def batch_favorites(users_id):
+    if db.session.get(User, users_id) is None:
+        raise APIException("User not found", status_code=404)
+    batch = parse_batch(request.get_json(silent=True))
+
+    try:
+        if request.method == 'POST':
+            result = add_favorites(users_id, batch)
+        else:
+            result = remove_favorites(users_id, batch)
+        db.session.commit()
+        mark_write(users_id)
+    except Exception as error:
+        db.session.rollback()
+        return jsonify({
+            "message": "ERROR INTERNO",
+            "error": error.args
+        }), 500
+    return jsonify(result), 200
+
+#Si INTERNAL_TOKEN esta definido hay que enviarlo en el header X-Internal-Token
+def check_internal_token():
+    token = os.environ.get('INTERNAL_TOKEN')
+    if token and request.headers.get('X-Internal-Token') != token:
+        raise APIException("Forbidden", status_code=403)
+
+#Metodo Get Contadores de la cache de detalle (hits/misses/evictions) para dimensionarla
+#Protegido con INTERNAL_TOKEN igual que /internal/pool
+@app.route('/cache/stats', methods=['GET'])
+def catalog_cache_stats():
+    check_internal_token()
+    return jsonify(cache_stats()), 200
+
+#Metodo Get Estado del pool de conexiones de este worker (conexiones en uso, overflow, tiempo de espera)
+#Incluye el estado de cada replica de lectura
+
+@app.route('/internal/pool', methods=['GET'])
+def connection_pool_stats():
+    check_internal_token()
+    return jsonify(dict(pool_stats(db.engine), replicas=replica_stats())), 200
+
+#Metodo Get Metricas en formato Prometheus: latencia, tamaño de respuesta y SQL por ruta, y el pool de conexiones
+#Protegido con INTERNAL_TOKEN igual que /internal/pool
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    check_internal_token()
+    pools = {"primary": pool_stats(db.engine)}
+    pools.update(("replica%d" % i, stats) for i, stats in enumerate(replica_stats()))
+    return metrics_response(pool_gauges(pools) + write_behind_gauges())
+
 """
 @app.route('/todos', methods=['POST'])
 def add_new_todo():
@@ -224,6 +393,9 @@ def delete_todo(position):
     json_todos = jsonify(todos)
     return json_todos
 """
+# Con todas las rutas registradas: sitemap e indice de rutas precalculados
+setup_route_index(app)
+
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
@@ -0,0 +1,288 @@
+"""
+ASGI entry point serving the read endpoints with an async SQLAlchemy engine.
+
+This is an alternative to ``wsgi.py`` for read-heavy deployments: every
+request awaits the database instead of pinning a worker, so one process can
+hold thousands of keep-alive clients. It shares the models, serializers,
+filters, keyset pagination and ETag versioning with the Flask app, and
+answers the same URLs with the same bytes (compressed the same way) and
+the same ETags:
+
+    GET /people  /people/<id>  /planets  /planets/<id>  /users  /users/favorites/<id>
+
+Writes, /admin and everything else stay on the Flask app; route them there
+at the load balancer. Run it with, for example:
+
+    uvicorn asgi:app --app-dir src --workers 4
+    gunicorn asgi:app --chdir ./src/ -k uvicorn.workers.UvicornWorker
+
+Requires an async driver: asyncpg (PostgreSQL), aiosqlite (SQLite) or
+aiomysql (MySQL).
+"""
+import re
+from urllib.parse import parse_qsl, urlencode
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_accept_header
+from models import User, Planets, Characters, FavPlanets, FavCharacters
+from filters import query_filters
+from favorites import EMBED_TABLES, FAVORITE_KINDS, attach_favorites, favorites_select
+from pagination import (STREAM_CHUNK_SIZE, base_select, expand_args, next_page_args, page_args,
+                        page_result, page_select, wants_stream)
+from serializers import dumps, serializer_for, sparse_fields
+from settings import database_uri, engine_options, setup_engine_events
+from utils import APIException
+from negotiation import COMPRESS_MIN_SIZE, chunk_compressor, compress, pick_encoding
+from versioning import make_etag, representation_key, versions_from_rows, versions_select
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def async_database_url(url):
+    """Swap the sync driver of ``DATABASE_URL`` for its async counterpart."""
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + sep + rest
+
+
+_url = async_database_url(database_uri())
+engine = create_async_engine(_url, **engine_options(_url, is_async=True))
+setup_engine_events(engine.sync_engine)
+
+
+class Route:
+    def __init__(self, pattern, handler, tables, cache_control, expand=None):
+        self.pattern = re.compile("^%s/?$" % pattern)
+        self.handler = handler
+        self.tables = tables
+        self.cache_control = cache_control
+        self.expand = expand or {}
+
+    def tables_for(self, args):
+        """``tables`` plus those read by the requested ``?expand=`` names (same as @conditional)."""
+        extra = tuple(table for name in args.get("expand", "").split(",")
+                      for table in self.expand.get(name.strip(), ()))
+        return tuple(dict.fromkeys(self.tables + extra))
+
+
+# --- Handlers -----------------------------------------------------------------
+
+async def _list(request, model, filterable=True, expand=None):
+    criteria, sort = query_filters(model, request.args) if filterable else ((), None)
+    fields = sparse_fields(model, request.args)
+    dialect_name = request.connection.dialect.name
+    if wants_stream(request.args):
+        return 200, _stream(request, model, criteria, sort, dialect_name, fields, expand), {}
+
+    after_id, after_value, limit = page_args(request.args)
+    stmt = page_select(model, after_id, limit, criteria, sort, after_value, dialect_name, fields)
+    rows = (await request.connection.execute(stmt)).all()
+    items, cursor = page_result(model, rows, limit, sort, fields)
+    if expand is not None:
+        await expand(request.connection, items)
+    headers = {}
+    if cursor is not None:
+        next_url = "%s%s?%s" % (request.base_url, request.path,
+                                urlencode(next_page_args(request.args, cursor, limit, sort)))
+        headers["link"] = '<%s>; rel="next"' % next_url
+        headers["x-next-cursor"] = str(cursor[0])
+    return 200, dumps(items), headers
+
+
+async def _stream(request, model, criteria, sort, dialect_name, fields=None, expand=None):
+    serializer = serializer_for(model, fields)
+    stmt = base_select(model, criteria, sort, dialect_name, fields)
+    result = await request.connection.stream(stmt.execution_options(yield_per=STREAM_CHUNK_SIZE))
+    yield b"["
+    first = True
+    async for rows in result.partitions():
+        items = [serializer.from_row(row) for row in rows]
+        if expand is not None:
+            await expand(request.connection, items)
+        chunk = dumps(items)[1:-1]
+        yield chunk if first else b"," + chunk
+        first = False
+    yield b"]"
+
+
+async def _detail(request, model, entity_id):
+    serializer = serializer_for(model, sparse_fields(model, request.args))
+    row = (await request.connection.execute(
+        select(*serializer.columns).where(model.id == int(entity_id)))).first()
+    if row is None:
+        raise APIException("%s not found" % model.__name__, status_code=404)
+    return 200, dumps(serializer.from_row(row)), {}
+
+
+async def all_character(request):
+    return await _list(request, Characters)
+
+
+async def one_character(request, people_id):
+    return await _detail(request, Characters, people_id)
+
+
+async def all_planets(request):
+    return await _list(request, Planets)
+
+
+async def one_planet(request, planet_id):
+    return await _detail(request, Planets, planet_id)
+
+
+async def _embed_favorites(connection, users):
+    for user in users:
+        user["favorites"] = {kind: [] for kind in FAVORITE_KINDS}
+    user_ids = [user["id"] for user in users]
+    if user_ids:
+        for kind in FAVORITE_KINDS:
+            attach_favorites(users, kind, await connection.execute(favorites_select(kind, user_ids)))
+
+
+async def all_users(request):
+    expand = _embed_favorites if "favorites" in expand_args(("favorites",), request.args) else None
+    return await _list(request, User, filterable=False, expand=expand)
+
+
+async def user_favotites(request, users_id):
+    users_id = int(users_id)
+    connection = request.connection
+    if (await connection.execute(select(User.id).where(User.id == users_id))).first() is None:
+        raise APIException("User not found", status_code=404)
+    favorites = {}
+    for key, model, fav_model, fk in (("planets", Planets, FavPlanets, FavPlanets.planets_id),
+                                      ("characters", Characters, FavCharacters, FavCharacters.characters_id)):
+        serializer = serializer_for(model)
+        rows = await connection.execute(
+            select(*serializer.columns).join(fav_model, fk == model.id)
+            .where(fav_model.user_id == users_id).order_by(fav_model.id))
+        favorites[key] = [{key: serializer.from_row(row)} for row in rows]
+    return 200, dumps(dict(user_id=users_id, **favorites)), {}
+
+
+ROUTES = [
+    Route(r"/people", all_character, ("characters",), "no-cache"),
+    Route(r"/people/(?P<people_id>\d+)", one_character, ("characters",), "public, max-age=60"),
+    Route(r"/planets", all_planets, ("planets",), "no-cache"),
+    Route(r"/planets/(?P<planet_id>\d+)", one_planet, ("planets",), "public, max-age=60"),
+    Route(r"/users", all_users, ("user",), "private, no-cache", expand={"favorites": EMBED_TABLES}),
+    Route(r"/users/favorites/(?P<users_id>\d+)", user_favotites,
+          ("user", "favPlanets", "favCharacters", "planets", "characters"), "private, no-cache"),
+]
+
+
+# --- ASGI plumbing ------------------------------------------------------------
+
+class Request:
+    def __init__(self, scope, connection):
+        self.path = scope["path"]
+        self.query_string = scope.get("query_string", b"").decode("latin-1")
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        host = self.headers.get("host") or "%s:%s" % tuple(scope.get("server") or ("localhost", 80))
+        self.base_url = "%s://%s" % (scope.get("scheme", "http"), host)
+        self.connection = connection
+        # Negotiated as in negotiation.py; the ETag's representation key depends on it
+        self.encoding = pick_encoding(parse_accept_header(self.headers.get("accept-encoding")))
+
+    @property
+    def full_path(self):
+        # Same shape as Flask's request.full_path, which goes into the ETag
+        return "%s?%s" % (self.path, self.query_string)
+
+    def if_none_match(self):
+        header = self.headers.get("if-none-match", "")
+        return {tag.strip().strip('"') for tag in header.split(",") if tag.strip()}
+
+
+async def _send(send, status, body, headers, head_only=False):
+    header_list = [(k.encode("latin-1"), str(v).encode("latin-1")) for k, v in headers.items()]
+    if isinstance(body, (bytes, bytearray)):
+        header_list.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": header_list})
+        await send({"type": "http.response.body", "body": b"" if head_only else bytes(body)})
+        return
+    await send({"type": "http.response.start", "status": status, "headers": header_list})
+    if not head_only:
+        async for chunk in body:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _compress_chunks(chunks, encoding):
+    feed, flush, finish = chunk_compressor(encoding)
+    async for chunk in chunks:
+        yield feed(chunk) + flush()
+    yield finish()
+
+
+def _encode_body(body, encoding, headers):
+    """Compress a 200 body the way the Flask app does (negotiation.py), so both serve the same bytes."""
+    headers["vary"] = "Accept, Accept-Encoding"
+    if encoding is None:
+        return body
+    if isinstance(body, (bytes, bytearray)):
+        if len(body) < COMPRESS_MIN_SIZE:
+            return body
+        body = compress(bytes(body), encoding)
+    else:
+        body = _compress_chunks(body, encoding)
+    headers["content-encoding"] = encoding
+    return body
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    json_headers = {"content-type": "application/json"}
+    for route in ROUTES:
+        match = route.pattern.match(scope["path"])
+        if match:
+            break
+    else:
+        return await _send(send, 404, dumps({"message": "Not found"}), json_headers)
+    if scope["method"] not in ("GET", "HEAD"):
+        return await _send(send, 405, dumps({"message": "Method not allowed"}),
+                           dict(json_headers, allow="GET, HEAD"))
+
+    head_only = scope["method"] == "HEAD"
+    headers = dict(json_headers, **{"cache-control": route.cache_control})
+    async with engine.connect() as connection:
+        request = Request(scope, connection)
+        try:
+            tables = route.tables_for(request.args)
+            versions = versions_from_rows(
+                tables, (await connection.execute(versions_select(tables))).all())
+            # Only JSON is served here: the same key as Flask's for JSON, so ETags match across stacks
+            etag = make_etag(request.full_path, representation_key("json", request.encoding), versions)
+            headers["etag"] = '"%s"' % etag
+            if etag in request.if_none_match():
+                return await _send(send, 304, b"", {"etag": headers["etag"],
+                                                    "cache-control": route.cache_control})
+            status, body, extra = await route.handler(request, **match.groupdict())
+        except APIException as error:
+            headers.pop("etag", None)
+            return await _send(send, error.status_code, dumps(error.to_dict()), headers, head_only)
+        headers.update(extra)
+        if status == 200:
+            body = _encode_body(body, request.encoding, headers)
+        await _send(send, status, body, headers, head_only)
@@ -0,0 +1,19 @@
+"""
+Micro-benchmarks for the data access and serialization paths.
+
+Each benchmark builds its own throwaway SQLite database so it can be run
+anywhere without touching the application's configured database.
+``bench_routes`` can also seed an empty database given by URL (e.g. a local
+PostgreSQL) to measure every route against the real backend.
+
+One module per feature; the ``bench_*`` entry points used by the
+``flask bench-*`` commands are re-exported here.
+"""
+from benchmarks.common import percentiles
+from benchmarks.serialization import bench_serialization
+from benchmarks.favorites import bench_favorites_lookup
+from benchmarks.text_search import bench_search
+from benchmarks.stacks import bench_stacks
+from benchmarks.routes import bench_routes
+from benchmarks.boot import bench_boot
+from benchmarks.hashing import bench_hashing
@@ -0,0 +1,10 @@
+"""
+Used by ``bench_routes`` to run the test client in a fresh process.
+"""
+import json
+import sys
+from benchmarks.routes import run_test_client
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["test-client"]:
+        json.dump(run_test_client(json.load(sys.stdin)), sys.stdout)
@@ -0,0 +1,63 @@
+"""
+Worker boot: import time and memory per APP_ROLE.
+"""
+import json
+import os
+import statistics
+import tempfile
+import time
+from benchmarks.common import SRC_DIR
+
+# Runs in a fresh interpreter, as a gunicorn worker would import the app
+_BOOT_SCRIPT = """
+import json, resource, sys, time
+started = time.perf_counter()
+import wsgi
+imported = time.perf_counter() - started
+rss = None
+try:
+    with open("/proc/self/status") as handle:
+        rss = next(int(line.split()[1]) / 1024 for line in handle if line.startswith("VmRSS:"))
+except OSError:
+    pass
+json.dump({"import_seconds": imported, "modules": len(sys.modules), "rss_mb": rss,
+           "routes": len(list(wsgi.application.url_map.iter_rules()))}, sys.stdout)
+"""
+
+
+def _boot(role, env, importtime=False):
+    import subprocess
+    import sys
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", _BOOT_SCRIPT]
+    started = time.perf_counter()
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True,
+                            cwd=SRC_DIR, env=dict(os.environ, APP_ROLE=role, **env))
+    return dict(json.loads(result.stdout), process_seconds=time.perf_counter() - started), result.stderr
+
+
+def _import_costs(importtime_log, top=10):
+    """Milliseconds of ``-X importtime`` self time per top-level package, largest first."""
+    costs = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        costs[package] = costs.get(package, 0) + int(self_us)
+    return {package: round(us / 1000, 1) for package, us in sorted(costs.items(), key=lambda item: -item[1])[:top]}
+
+
+def bench_boot(roles=("api", "admin", "all"), samples=5):
+    """Cold import time, process time, modules and RSS of a worker for each ``APP_ROLE`` (medians)."""
+    env = {"DATABASE_URL": "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench-boot.db"),
+           "DATABASE_REPLICA_URLS": "", "SNAPSHOT_PATH": "", "LOG_LEVEL": "ERROR"}
+    _boot(roles[0], env)  # warm the OS file cache so the first role is not penalized
+    report = {"samples": samples}
+    for role in roles:
+        runs = [_boot(role, env)[0] for _ in range(samples)]
+        summary = {key: round(statistics.median(run[key] for run in runs), 4 if key.endswith("seconds") else 1)
+                   for key in ("import_seconds", "process_seconds", "rss_mb") if runs[0][key] is not None}
+        summary.update(modules=runs[0]["modules"], routes=runs[0]["routes"],
+                       top_imports_ms=_import_costs(_boot(role, env, importtime=True)[1]))
+        report[role] = summary
+    return report
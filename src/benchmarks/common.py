@@ -0,0 +1,118 @@
+"""
+Scratch databases, seeders and timing helpers shared by the benchmarks.
+"""
+import os
+import statistics
+import tempfile
+import time
+from sqlalchemy import create_engine, insert
+from models import db, User, Planets, Characters, FavPlanets, FavCharacters
+from numeric import fill_shadows
+
+# src/, where the app modules are imported from by the benchmark subprocesses
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def scratch_engine(path=None):
+    """Create an empty SQLite database with the application schema."""
+    if path is None:
+        handle, path = tempfile.mkstemp(suffix=".db", prefix="starwars-bench-")
+        os.close(handle)
+    engine = create_engine("sqlite:///" + path)
+    db.metadata.create_all(engine)
+    return engine, path
+
+
+def seed_characters(engine, rows, batch_size=10000):
+    with engine.begin() as connection:
+        for start in range(0, rows, batch_size):
+            connection.execute(insert(Characters), [fill_shadows("characters", {
+                "full_name": "Character %d" % i,
+                "birth_year": "%dBBY" % (i % 900),
+                "species": "Human",
+                "height": str(150 + i % 60),
+                "mass": str(50 + i % 80),
+                "gender": "female" if i % 2 else "male",
+                "hair_color": "brown",
+                "skin_color": "fair",
+                "homeworld": "Tatooine",
+            }) for i in range(start, min(start + batch_size, rows))])
+
+
+def seed_planets(engine, rows, batch_size=10000):
+    with engine.begin() as connection:
+        for start in range(0, rows, batch_size):
+            connection.execute(insert(Planets), [fill_shadows("planets", {
+                "name": "Planet %d" % i,
+                "populations": str(1000 * i),
+                "rotation_period": str(10 + i % 30),
+                "orbital_period": str(200 + i % 400),
+                "diameter": str(5000 + i % 10000),
+                "gravity": "1 standard",
+                "terrain": ("desert", "grasslands", "jungle", "ocean", "tundra")[i % 5],
+                "surface_water": str(i % 100),
+                "climate": ("arid", "temperate", "tropical", "frozen")[i % 4],
+            }) for i in range(start, min(start + batch_size, rows))])
+
+
+def seed_users(engine, rows, batch_size=10000):
+    with engine.begin() as connection:
+        for start in range(0, rows, batch_size):
+            connection.execute(insert(User), [{
+                "name": "User %d" % i,
+                "email": "user%d@example.com" % i,
+                "password": "not-a-real-password",
+                "is_active": True,
+            } for i in range(start, min(start + batch_size, rows))])
+
+
+def _seed_favorites(engine, fav_model, fk, rows, users, items, batch_size):
+    """Insert ``rows`` distinct (user, item) favorites, spread evenly over users."""
+    per_user = max(1, -(-rows // users))
+    with engine.begin() as connection:
+        batch = []
+        for n in range(rows):
+            user_id = n // per_user % users + 1
+            batch.append({"user_id": user_id, fk: (n % per_user * 7919 + user_id) % items + 1})
+            if len(batch) >= batch_size:
+                connection.execute(insert(fav_model), batch)
+                batch = []
+        if batch:
+            connection.execute(insert(fav_model), batch)
+
+
+def seed_fav_planets(engine, rows, users, planets, batch_size=50000):
+    _seed_favorites(engine, FavPlanets, "planets_id", rows, users, planets, batch_size)
+
+
+def seed_fav_characters(engine, rows, users, characters, batch_size=50000):
+    _seed_favorites(engine, FavCharacters, "characters_id", rows, users, characters, batch_size)
+
+
+def latencies(fn, samples):
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def percentiles(timings_ms):
+    ordered = sorted(timings_ms)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3)
+
+    return {
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+    }
+
+
+def timed(fn):
+    started = time.perf_counter()
+    size = fn()
+    return time.perf_counter() - started, size
@@ -0,0 +1,38 @@
+"""
+Favorites lookup by user, with and without the composite index.
+"""
+import os
+import random
+from sqlalchemy import select
+from models import FavPlanets
+from benchmarks.common import latencies, percentiles, scratch_engine, seed_fav_planets, seed_planets, seed_users
+
+
+def bench_favorites_lookup(rows=2000000, users=100000, planets=10000, lookups=200):
+    """Latency of a user's favorites lookup before and after the (user_id, planets_id) index."""
+    engine, path = scratch_engine()
+    index = next(i for i in FavPlanets.__table__.indexes if i.name == "ix_favPlanets_user_id_planets_id")
+    try:
+        with engine.begin() as connection:
+            index.drop(connection)
+        seed_users(engine, users)
+        seed_planets(engine, planets)
+        seed_fav_planets(engine, rows, users, planets)
+        user_ids = [random.randint(1, users) for _ in range(lookups)]
+
+        def measure():
+            with engine.connect() as connection:
+                picks = iter(user_ids)
+                return percentiles(latencies(
+                    lambda: connection.execute(select(FavPlanets.planets_id).where(
+                        FavPlanets.user_id == next(picks))).all(), lookups))
+
+        report = {"rows": rows, "users": users, "lookups": lookups}
+        report["before"] = measure()
+        with engine.begin() as connection:
+            index.create(connection)
+        report["after"] = measure()
+        return report
+    finally:
+        engine.dispose()
+        os.remove(path)
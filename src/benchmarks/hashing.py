@@ -0,0 +1,43 @@
+"""
+Password hashing throughput per cost: one thread, the request pool and the import pool.
+"""
+import os
+import statistics
+from benchmarks.common import latencies, percentiles, timed
+
+
+def bench_hashing(costs=None, samples=20, workers=None, scheme=None):
+    """Password hashes/sec of the default scheme per cost: one thread, the request pool and the import pool."""
+    from concurrent.futures import ThreadPoolExecutor
+    from passwords import DEFAULT_COSTS, default_scheme, hash_password, hash_many, process_pool, verify_password
+
+    scheme = scheme or default_scheme()
+    workers = workers or os.cpu_count() or 1
+    base = DEFAULT_COSTS[scheme]
+    report = {"scheme": scheme, "samples": samples, "workers": workers, "costs": {}}
+    for cost in costs or (base - 1, base, base + 1):
+        passwords = ["bench-password-%d" % i for i in range(samples)]
+        timings = latencies(lambda: hash_password(passwords[0], scheme, cost), samples)
+        encoded = hash_password(passwords[0], scheme, cost)
+        verify = latencies(lambda: verify_password(passwords[0], encoded), samples)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            elapsed, _ = timed(lambda: list(executor.map(lambda p: hash_password(p, scheme, cost), passwords)))
+        threads = samples / elapsed
+        executor = process_pool(workers)
+        try:
+            # One warm-up round so process start-up is not counted
+            hash_many(passwords[:workers], scheme, cost, executor, chunk_size=1)
+            elapsed, _ = timed(lambda: hash_many(passwords, scheme, cost, executor, chunk_size=1))
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        report["costs"][str(cost)] = {
+            "hash": percentiles(timings),
+            "verify": percentiles(verify),
+            "single_thread_per_sec": round(1000 / statistics.median(timings), 1),
+            "thread_pool_per_sec": round(threads, 1),
+            "process_pool_per_sec": round(samples / elapsed, 1),
+            "encoded_length": len(encoded),
+        }
+    return report
@@ -0,0 +1,227 @@
+"""
+Every route: Flask test client and a real gunicorn process.
+
+``bench_routes`` runs the test client in a fresh process through
+``python -m benchmarks test-client`` (from src/).
+"""
+import json
+import os
+import random
+import time
+from urllib.parse import quote
+from sqlalchemy import create_engine, select
+from models import db, Characters
+from popularity import reconcile
+import search
+from benchmarks.common import (SRC_DIR, percentiles, scratch_engine, seed_characters, seed_fav_characters,
+                               seed_fav_planets, seed_planets, seed_users)
+
+# Streaming the whole table is skipped above this many characters
+MAX_STREAM_ROWS = 100000
+# Not part of the API: static files and the Flask-Admin UI
+IGNORED_ENDPOINTS = ("static",)
+IGNORED_PREFIXES = ("/admin",)
+
+
+def bench_database(url=None):
+    """Scratch SQLite file, or the empty database at ``url`` (e.g. a local PostgreSQL)."""
+    if url is None:
+        engine, path = scratch_engine()
+        return engine, "sqlite:///" + path, path
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    with engine.connect() as connection:
+        if connection.execute(select(Characters.id).limit(1)).first() is not None:
+            raise ValueError("The benchmark database must be empty: %s" % engine.url)
+    return engine, url, None
+
+
+def seed_catalog(engine, characters, planets, users, favorites):
+    """Seed every table; ``favorites`` rows each of planets and characters."""
+    seed_characters(engine, characters)
+    seed_planets(engine, planets)
+    seed_users(engine, users)
+    seed_fav_planets(engine, favorites, users, planets)
+    seed_fav_characters(engine, favorites, users, characters)
+    with engine.begin() as connection:
+        reconcile(connection)
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as connection:
+            search.ensure_sqlite_index(connection, rebuild=True)
+
+
+def route_plan(characters, planets, users, favorites, samples, phase=0):
+    """``samples`` concrete requests for every route.
+
+    Each entry is ``{"name", "method", "rule", "requests": [[path, body], ...]}``
+    where ``rule`` is the Flask URL rule, so coverage can be checked against
+    ``app.url_map``. Writes in phase ``n`` touch their own rows (deleted
+    favorite ids, new emails), so the phases can share one database.
+    """
+    rng = random.Random(phase)
+    first_fav = phase * samples + 1
+
+    def user():
+        return rng.randint(1, users)
+
+    routes = [
+        ("sitemap", "GET", "/", lambda i: ("/", None)),
+        ("route_index", "GET", "/routes", lambda i: ("/routes", None)),
+        ("hello", "GET", "/user", lambda i: ("/user", None)),
+        ("swagger", "GET", "/swagger.json", lambda i: ("/swagger.json", None)),
+        ("people_page", "GET", "/people",
+         lambda i: ("/people?limit=50&after_id=%d" % rng.randint(0, characters), None)),
+        ("people_filtered", "GET", "/people",
+         lambda i: ("/people?height_gte=%d&sort=-height&limit=50" % rng.randint(150, 209), None)),
+        ("people_detail", "GET", "/people/<int:people_id>",
+         lambda i: ("/people/%d" % rng.randint(1, characters), None)),
+        ("planets_page", "GET", "/planets",
+         lambda i: ("/planets?limit=50&sort=-population", None)),
+        ("people_popular", "GET", "/people/popular", lambda i: ("/people/popular?limit=20", None)),
+        ("planets_popular", "GET", "/planets/popular", lambda i: ("/planets/popular?limit=20", None)),
+        ("planets_detail", "GET", "/planets/<int:planet_id>",
+         lambda i: ("/planets/%d" % rng.randint(1, planets), None)),
+        ("search", "GET", "/search",
+         lambda i: ("/search?q=%s" % quote(rng.choice(
+             ("charac %d" % rng.randint(1, characters), "planet", "tat", "des"))), None)),
+        ("users_page", "GET", "/users",
+         lambda i: ("/users?limit=50&after_id=%d" % rng.randint(0, users), None)),
+        ("user_favorites", "GET", "/users/favorites/<int:users_id>",
+         lambda i: ("/users/favorites/%d" % user(), None)),
+        ("create_user", "POST", "/create/user",
+         lambda i: ("/create/user", {"name": "Bench %d" % i, "email": "bench-%d-%d@example.com" % (phase, i),
+                                     "password": "bench-password"})),
+        ("add_fav_planet", "POST", "/favorite/planet/<int:planet_id>",
+         lambda i: ("/favorite/planet/%d" % rng.randint(1, planets), {"id_user": user()})),
+        ("add_fav_character", "POST", "/favorite/people/<int:people_id>",
+         lambda i: ("/favorite/people/%d" % rng.randint(1, characters), {"id_user": user()})),
+        ("delete_fav_planet", "DELETE", "/favorite/planet/<int:planet_id>",
+         lambda i: ("/favorite/planet/%d" % (first_fav + i), None)),
+        ("delete_fav_character", "DELETE", "/favorite/people/<int:people_id>",
+         lambda i: ("/favorite/people/%d" % (first_fav + i), None)),
+        ("batch_add", "POST", "/users/<int:users_id>/favorites:batch",
+         lambda i: ("/users/%d/favorites:batch" % user(),
+                    {"planets": rng.sample(range(1, planets + 1), min(20, planets)),
+                     "characters": rng.sample(range(1, characters + 1), min(20, characters))})),
+        ("batch_remove", "DELETE", "/users/<int:users_id>/favorites:batch",
+         lambda i: ("/users/%d/favorites:batch" % user(),
+                    {"planets": rng.sample(range(1, planets + 1), min(20, planets))})),
+        ("cache_stats", "GET", "/cache/stats", lambda i: ("/cache/stats", None)),
+        ("pool_stats", "GET", "/internal/pool", lambda i: ("/internal/pool", None)),
+        ("metrics", "GET", "/metrics", lambda i: ("/metrics", None)),
+    ]
+    if characters <= MAX_STREAM_ROWS:
+        routes.append(("people_stream", "GET", "/people", lambda i: ("/people?stream=1", None)))
+
+    plan = []
+    for name, method, rule, build in routes:
+        count = samples
+        if name.startswith("delete_fav"):
+            count = max(0, min(samples, favorites - first_fav + 1))
+        plan.append({"name": name, "method": method, "rule": rule,
+                     "requests": [list(build(i)) for i in range(count)]})
+    return plan
+
+
+def _route_report(timings, statuses, size, elapsed):
+    report = {
+        "requests": len(timings),
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+        "throughput_rps": round(len(timings) / elapsed, 1) if elapsed else None,
+        "bytes": size,
+    }
+    if timings:
+        report.update(percentiles(timings))
+    return report
+
+
+def run_test_client(plan):
+    """Drive ``plan`` through the Flask test client in this process (DATABASE_URL must be set)."""
+    import resource
+    from app import app
+    client = app.test_client()
+    routes = {}
+    for route in plan:
+        if route["method"] == "GET" and route["requests"]:
+            client.get(route["requests"][0][0]).close()  # warm up
+        timings, statuses, size = [], {}, 0
+        started = time.perf_counter()
+        for path, body in route["requests"]:
+            request_started = time.perf_counter()
+            response = client.open(path, method=route["method"], json=body)
+            size += len(response.get_data())
+            response.close()
+            timings.append((time.perf_counter() - request_started) * 1000)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        routes[route["name"]] = _route_report(timings, statuses, size, time.perf_counter() - started)
+
+    planned = {(route["method"], route["rule"]) for route in plan}
+    not_covered = sorted("%s %s" % (method, rule.rule) for rule in app.url_map.iter_rules()
+                         if rule.endpoint not in IGNORED_ENDPOINTS and not rule.rule.startswith(IGNORED_PREFIXES)
+                         for method in rule.methods - {"HEAD", "OPTIONS"}
+                         if (method, rule.rule) not in planned)
+    # ru_maxrss is in KB on Linux
+    return {"routes": routes, "not_covered": not_covered,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def run_gunicorn(plan, database_url, workers, connections, duration, env):
+    """Drive ``plan`` against gunicorn: reads under concurrent load, writes one at a time."""
+    from loadtest import peak_rss, request_once, run_load, serve
+    routes = {}
+    with serve("wsgi", database_url, workers, env) as (port, process):
+        for route in plan:
+            if not route["requests"]:
+                continue
+            if route["method"] == "GET":
+                paths = [path for path, _ in route["requests"]]
+                run_load("127.0.0.1", port, paths[:10], connections=2, duration=0.5)  # warm up
+                routes[route["name"]] = run_load("127.0.0.1", port, paths, connections, duration)
+                continue
+            timings, statuses, size = [], {}, 0
+            started = time.perf_counter()
+            for path, body in route["requests"]:
+                status, length, latency = request_once("127.0.0.1", port, route["method"], path, body)
+                timings.append(latency)
+                statuses[status] = statuses.get(status, 0) + 1
+                size += length
+            routes[route["name"]] = _route_report(timings, statuses, size, time.perf_counter() - started)
+        memory = peak_rss(process.pid)
+    return {"workers": workers, "routes": routes, "peak_rss": memory}
+
+
+def bench_routes(characters=10000, planets=10000, users=10000, favorites=50000, samples=200,
+                 connections=16, duration=2.0, workers=2, database_url=None,
+                 stacks=("test_client", "gunicorn")):
+    """Latency, throughput and peak RSS of every route in app.py, as a JSON-ready dict."""
+    engine, url, path = bench_database(database_url)
+    # Keep the app's own settings out of the way: every route, no replicas, snapshot,
+    # rate limit, write-behind or token, quiet logs
+    env = {"DATABASE_URL": url, "APP_ROLE": "all", "DATABASE_REPLICA_URLS": "", "SNAPSHOT_PATH": "",
+           "RATELIMIT_RATE": "", "FAVORITES_WRITE_BEHIND": "", "INTERNAL_TOKEN": "", "LOG_LEVEL": "ERROR"}
+    try:
+        started = time.perf_counter()
+        seed_catalog(engine, characters, planets, users, favorites)
+        report = {
+            "database": engine.dialect.name,
+            "scale": {"characters": characters, "planets": planets, "users": users,
+                      "favorites": favorites, "samples": samples},
+            "seed_seconds": round(time.perf_counter() - started, 2),
+        }
+        engine.dispose()
+        if "test_client" in stacks:
+            import subprocess
+            import sys
+            plan = route_plan(characters, planets, users, favorites, samples, phase=0)
+            output = subprocess.run([sys.executable, "-m", "benchmarks", "test-client"],
+                                    input=json.dumps(plan), stdout=subprocess.PIPE, text=True, check=True,
+                                    cwd=SRC_DIR, env=dict(os.environ, **env)).stdout
+            report["test_client"] = json.loads(output)
+        if "gunicorn" in stacks:
+            plan = route_plan(characters, planets, users, favorites, samples, phase=1)
+            report["gunicorn"] = run_gunicorn(plan, url, workers, connections, duration, env)
+        return report
+    finally:
+        engine.dispose()
+        if path is not None:
+            os.remove(path)
@@ -0,0 +1,57 @@
+"""
+Serialization: ORM + hand-written dict + stdlib json against Core + registry + fast encoder.
+"""
+import json
+import os
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from models import Characters
+from serializers import dumps, serializer_for
+from benchmarks.common import scratch_engine, seed_characters, timed
+
+
+def _legacy_serialize(character):
+    return {
+        "id": character.id,
+        "full_name": character.full_name,
+        "birth_year": character.birth_year,
+        "species": character.species,
+        "height": character.height,
+        "mass": character.mass,
+        "gender": character.gender,
+        "hair_color": character.hair_color,
+        "skin_color": character.skin_color,
+        "homeworld": character.homeworld,
+    }
+
+
+def bench_serialization(rows=100000):
+    """Compare the ORM + hand-written dict + stdlib json path with Core + registry + fast encoder."""
+    engine, path = scratch_engine()
+    try:
+        seed_characters(engine, rows)
+
+        def legacy():
+            with Session(engine) as session:
+                characters = session.query(Characters).all()
+                return len(json.dumps([_legacy_serialize(c) for c in characters]))
+
+        def fast():
+            serializer = serializer_for(Characters)
+            with engine.connect() as connection:
+                result = connection.execute(select(*serializer.columns).order_by(Characters.id))
+                return len(dumps([serializer.from_row(row) for row in result]))
+
+        report = {"rows": rows}
+        for name, fn in (("before", legacy), ("after", fast)):
+            elapsed, size = timed(fn)
+            report[name] = {
+                "seconds": round(elapsed, 4),
+                "rows_per_sec": int(rows / elapsed),
+                "bytes": size,
+            }
+        report["speedup"] = round(report["before"]["seconds"] / report["after"]["seconds"], 2)
+        return report
+    finally:
+        engine.dispose()
+        os.remove(path)
@@ -0,0 +1,45 @@
+"""
+Sync WSGI (gunicorn) against async ASGI (uvicorn) under the same load.
+"""
+import os
+import random
+from benchmarks.common import scratch_engine, seed_characters, seed_fav_planets, seed_planets, seed_users
+
+
+def sample_paths(characters, planets, users):
+    """A mix of the read endpoints spread over the seeded ids."""
+    rng = random.Random(42)
+    paths = []
+    for _ in range(50):
+        paths += [
+            "/people?limit=50",
+            "/people/%d" % rng.randint(1, characters),
+            "/planets?limit=50&sort=-population",
+            "/planets/%d" % rng.randint(1, planets),
+            "/users?limit=50",
+            "/users/favorites/%d" % rng.randint(1, users),
+        ]
+    return paths
+
+
+def bench_stacks(rows=10000, connections=100, duration=10.0, workers=2, stacks=("wsgi", "asgi")):
+    """Same load against gunicorn (sync WSGI) and uvicorn (async ASGI) on one seeded SQLite file."""
+    from loadtest import run_load, serve
+    engine, path = scratch_engine()
+    try:
+        users = max(1, rows // 10)
+        planets = max(1, rows // 10)
+        seed_characters(engine, rows)
+        seed_planets(engine, planets)
+        seed_users(engine, users)
+        seed_fav_planets(engine, users * 5, users, planets)
+        paths = sample_paths(rows, planets, users)
+        report = {"rows": rows, "workers": workers}
+        for stack in stacks:
+            with serve(stack, "sqlite:///" + path, workers) as (port, _):
+                run_load("127.0.0.1", port, paths[:20], connections=4, duration=1.0)  # warm up
+                report[stack] = run_load("127.0.0.1", port, paths, connections, duration)
+        return report
+    finally:
+        engine.dispose()
+        os.remove(path)
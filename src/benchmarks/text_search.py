@@ -0,0 +1,35 @@
+"""
+Prefix search: FTS5 index against the LIKE fallback.
+"""
+import os
+import random
+import search
+from benchmarks.common import latencies, percentiles, scratch_engine, seed_characters, seed_planets
+
+
+def bench_search(rows=1000000, queries=200):
+    """Latency of prefix search through the FTS5 index and through the LIKE fallback."""
+    engine, path = scratch_engine()
+    try:
+        with engine.begin() as connection:
+            search.ensure_sqlite_index(connection)
+        seed_characters(engine, rows)
+        seed_planets(engine, max(1, rows // 100))
+        terms = ["charac %d" % random.randint(1, rows) for _ in range(queries // 2)]
+        terms += ["%s" % random.choice(("tat", "hum", "des", "jung", "fair")) for _ in range(queries - len(terms))]
+
+        def measure(backend):
+            picks = iter(terms)
+            with engine.connect() as connection:
+                return percentiles(latencies(
+                    lambda: backend(connection, search.tokens(next(picks)), search.KINDS, 20, 0), queries))
+
+        return {
+            "rows": rows,
+            "queries": queries,
+            "fts5": measure(search._fts5_hits),
+            "like": measure(search._like_hits),
+        }
+    finally:
+        engine.dispose()
+        os.remove(path)
@@ -0,0 +1,228 @@
+"""
+In-process LRU + TTL cache for read-mostly catalog entities.
+
+Entries hold a row's serialized payload and its encoded/compressed bodies
+(``negotiation.Representations``) keyed by primary key, so a hit costs
+neither a database round trip nor a serializer or compressor call. Entries are
+dropped by SQLAlchemy mapper events whenever a row is inserted, updated or
+deleted through the ORM, which covers the API handlers and the Flask-Admin
+views alike. Those events only reach the cache of the process that made the
+write.
+
+Each entry also records the table version (versioning.py) it was loaded
+under, and a hit read under another version is a miss. Writes made by
+other workers or processes (``flask ingest``, a second gunicorn worker)
+bump that version, so they reach every worker's cache on its next read
+instead of after the TTL. Only writes that bump no version (raw SQL) wait
+for the TTL.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session, load_only, object_session
+from models import db
+from negotiation import Representations, payload_response
+from replicas import on_primary
+from serializers import serializer_for, sparse_fields
+from utils import APIException
+from versioning import table_version
+
+log = logging.getLogger("starwars.cache")
+
+# Seconds a request waits for another request's load of the same key before loading it itself
+FLIGHT_TIMEOUT = float(os.environ.get("CACHE_FLIGHT_TIMEOUT", 5))
+
+
+class _Flight:
+    __slots__ = ("version", "done", "value", "error")
+
+    def __init__(self, version=None):
+        self.version = version
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class LRUTTLCache:
+    def __init__(self, name, maxsize=1024, ttl=300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.coalesced = 0
+
+    def get(self, key, version=None):
+        """The cached value, or None if missing, expired or stored under another ``version``."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, stored_version = entry
+            if expires_at < time.monotonic() or stored_version != version:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, version=None):
+        with self._lock:
+            self._store(key, value, version)
+
+    def _store(self, key, value, version):
+        self._data[key] = (value, time.monotonic() + self.ttl, version)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_load(self, key, load, version=None, timeout=FLIGHT_TIMEOUT):
+        """``get(key, version)``, calling ``load()`` on a miss and caching what it returns (unless None).
+
+        Concurrent misses of the same key and version in this process share
+        a single ``load()`` call (single flight): the first caller loads, the
+        others wait up to ``timeout`` seconds for its result or exception.
+        """
+        value = self.get(key, version)
+        if value is not None:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or flight.version != version
+            if leader:
+                flight = self._flights[key] = _Flight(version)
+            else:
+                self.coalesced += 1
+        if not leader:
+            if not flight.done.wait(timeout):
+                return load()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = load()
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                # An invalidation while loading drops the flight: do not cache what may be stale
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                    if flight.value is not None:
+                        self._store(key, flight.value, version)
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, key):
+        with self._lock:
+            self._flights.pop(key, None)
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "coalesced": self.coalesced,
+            }
+
+
+_caches = {}
+
+
+def cache_for(model):
+    """Return the cache attached to ``model``, creating it on first use."""
+    cache = _caches.get(model.__tablename__)
+    if cache is None:
+        cache = LRUTTLCache(
+            model.__tablename__,
+            maxsize=int(os.environ.get("CATALOG_CACHE_SIZE", 1024)),
+            ttl=float(os.environ.get("CATALOG_CACHE_TTL", 300)),
+        )
+        _caches[model.__tablename__] = cache
+        _listen_for_changes(model, cache)
+    return cache
+
+
+def _listen_for_changes(model, cache):
+    # Invalidate right away and once more after commit: a concurrent reader
+    # may re-populate the entry with the old row while the transaction is open.
+    def invalidate(mapper, connection, target):
+        cache.invalidate(target.id)
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault("cache_invalidations", set()).add((cache, target.id))
+
+    for name in ("after_insert", "after_update", "after_delete"):
+        event.listen(model, name, invalidate)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    for cache, key in session.info.pop("cache_invalidations", ()):
+        cache.invalidate(key)
+
+
+def cache_stats():
+    return [cache.stats() for cache in _caches.values()]
+
+
+def detail_response(model, entity_id):
+    """Serve one row, from the cache when possible.
+
+    The cache holds the row's ``Representations``, so each format and
+    encoding is built once per cached row rather than on every hit. Misses
+    are coalesced: simultaneous requests for the same row (threaded or
+    gevent workers) wait for one database fetch instead of each running it.
+
+    Misses are loaded from the primary even under ``read_only``, since a
+    replica may still hold the row as it was before the write that emptied
+    the entry. Hits must carry the table version the ETag was computed
+    from, so a body is never served under the ETag of a later write.
+
+    With ``?fields=`` only those columns are loaded (``load_only``) and the
+    cache, which holds whole rows, is bypassed.
+    """
+    fields = sparse_fields(model)
+    if fields:
+        serializer = serializer_for(model, fields)
+        row = db.session.get(model, entity_id,
+                             options=[load_only(*[getattr(model, key) for key in serializer.keys])])
+        if row is None:
+            raise APIException("%s not found" % model.__name__, status_code=404)
+        return payload_response(serializer.from_object(row))
+
+    def load():
+        log.debug("%s %s: cache miss", model.__name__, entity_id)
+        # The entry is shared by every client for up to the TTL: never fill it from a lagging replica
+        with on_primary():
+            row = db.session.get(model, entity_id, populate_existing=True)
+        return Representations(row.serialize()) if row is not None else None
+
+    representations = cache_for(model).get_or_load(entity_id, load, table_version(model.__tablename__))
+    if representations is None:
+        raise APIException("%s not found" % model.__name__, status_code=404)
+    return payload_response(representations)
@@ -0,0 +1,188 @@
+"""
+In this file, you can add as many commands as you want using the @app.cli.command decorator
+Flask commands are useful to run cronjobs or tasks outside of the API but still in integration
+with your database, for example: run a benchmark with `flask bench-serialize`
+"""
+import json
+import click
+
+def setup_commands(app):
+
+    @app.cli.command("ingest")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--kind", type=click.Choice(["planets", "people"]), required=True)
+    @click.option("--format", "fmt", type=click.Choice(["json", "jsonl", "ndjson", "csv"]),
+                  help="Defaults to the file extension.")
+    @click.option("--chunk-size", default=5000, show_default=True)
+    @click.option("--checkpoint", type=click.Path(dir_okay=False),
+                  help="File recording how many records were committed.")
+    @click.option("--resume", is_flag=True, help="Continue from --checkpoint.")
+    def ingest_command(path, kind, fmt, chunk_size, checkpoint, resume):
+        """Bulk upsert a SWAPI-format dump of planets or people."""
+        from models import db
+        from ingest import ingest, IngestError
+
+        def progress(rows, rate):
+            click.echo("%d rows, %.0f rows/sec" % (rows, rate), err=True)
+
+        try:
+            summary = ingest(db.engine, path, kind, fmt=fmt, chunk_size=chunk_size,
+                             checkpoint=checkpoint, resume=resume, progress=progress)
+        except IngestError as error:
+            raise click.ClickException(str(error))
+        click.echo(json.dumps(summary, indent=2))
+
+    @app.cli.command("bench-serialize")
+    @click.option("--rows", default=100000, show_default=True, help="Characters to seed.")
+    def bench_serialize(rows):
+        """Rows/sec of the list serialization path, before and after."""
+        from benchmarks import bench_serialization
+        click.echo(json.dumps(bench_serialization(rows), indent=2))
+
+    @app.cli.command("bench-favorites")
+    @click.option("--rows", default=2000000, show_default=True, help="Favorite planets to seed.")
+    @click.option("--users", default=100000, show_default=True)
+    @click.option("--lookups", default=200, show_default=True)
+    def bench_favorites(rows, users, lookups):
+        """Favorites lookup latency without and with the (user_id, item) index."""
+        from benchmarks import bench_favorites_lookup
+        click.echo(json.dumps(bench_favorites_lookup(rows, users, lookups=lookups), indent=2))
+
+    @app.cli.command("search-reindex")
+    def search_reindex():
+        """Create (SQLite) the FTS5 search index and rebuild it from the catalog tables."""
+        from models import db
+        from search import ensure_sqlite_index
+        if db.engine.dialect.name != "sqlite":
+            raise click.ClickException("Only SQLite keeps a separate index; PostgreSQL uses GIN expression indexes")
+        with db.engine.begin() as connection:
+            ensure_sqlite_index(connection, rebuild=True)
+        click.echo("catalog_search rebuilt")
+
+    @app.cli.command("bench-search")
+    @click.option("--rows", default=1000000, show_default=True, help="Characters to seed.")
+    @click.option("--queries", default=200, show_default=True)
+    def bench_search_command(rows, queries):
+        """Search latency on SQLite: FTS5 prefix queries against a LIKE '%q%' scan."""
+        from benchmarks import bench_search
+        click.echo(json.dumps(bench_search(rows, queries), indent=2))
+
+    @app.cli.command("bench-asgi")
+    @click.option("--rows", default=10000, show_default=True, help="Characters to seed.")
+    @click.option("--connections", default=100, show_default=True, help="Concurrent keep-alive clients.")
+    @click.option("--duration", default=10.0, show_default=True, help="Seconds per stack.")
+    @click.option("--workers", default=2, show_default=True, help="Server processes per stack.")
+    def bench_asgi(rows, connections, duration, workers):
+        """Load-test the sync gunicorn stack against the async uvicorn stack."""
+        from benchmarks import bench_stacks
+        click.echo(json.dumps(bench_stacks(rows, connections, duration, workers), indent=2))
+
+    @app.cli.command("bench-routes")
+    @click.option("--characters", default=10000, show_default=True)
+    @click.option("--planets", default=10000, show_default=True)
+    @click.option("--users", default=10000, show_default=True)
+    @click.option("--favorites", default=50000, show_default=True,
+                  help="Favorite planets to seed, and as many favorite characters.")
+    @click.option("--samples", default=200, show_default=True, help="Requests per route (test client, writes).")
+    @click.option("--connections", default=16, show_default=True, help="Concurrent clients for reads on gunicorn.")
+    @click.option("--duration", default=2.0, show_default=True, help="Seconds of load per read route on gunicorn.")
+    @click.option("--workers", default=2, show_default=True, help="gunicorn workers.")
+    @click.option("--database-url", help="Empty database to seed instead of a scratch SQLite file.")
+    @click.option("--stack", "stacks", multiple=True, type=click.Choice(["test_client", "gunicorn"]),
+                  default=("test_client", "gunicorn"), show_default=True)
+    @click.option("--output", type=click.Path(dir_okay=False), help="Also write the JSON report here.")
+    def bench_routes_command(characters, planets, users, favorites, samples, connections, duration,
+                             workers, database_url, stacks, output):
+        """p50/p95/p99, throughput and peak RSS of every route, via the test client and gunicorn."""
+        from benchmarks import bench_routes
+        report = json.dumps(bench_routes(characters, planets, users, favorites, samples, connections,
+                                         duration, workers, database_url, stacks), indent=2)
+        if output:
+            with open(output, "w") as handle:
+                handle.write(report + "\n")
+        click.echo(report)
+
+    @app.cli.command("export-snapshot")
+    @click.option("--output", type=click.Path(dir_okay=False),
+                  help="Defaults to SNAPSHOT_PATH, then catalog.snapshot.")
+    def export_snapshot_command(output):
+        """Write planets and characters to the memory-mapped snapshot file.
+
+        The file is replaced atomically; workers serving it (SNAPSHOT_PATH)
+        switch to the new version within SNAPSHOT_CHECK_INTERVAL seconds.
+        """
+        import os
+        from models import db
+        from snapshot import export_snapshot
+
+        path = output or app.config.get("SNAPSHOT_PATH") or "catalog.snapshot"
+        with db.engine.connect() as connection:
+            header = export_snapshot(connection, path)
+        click.echo(json.dumps({"path": path, "version": header["version"], "bytes": os.path.getsize(path),
+                               "rows": {name: table["rows"] for name, table in header["tables"].items()}},
+                              indent=2))
+
+    @app.cli.command("bench-boot")
+    @click.option("--role", "roles", multiple=True, type=click.Choice(["api", "admin", "all"]),
+                  default=("api", "admin", "all"), show_default=True)
+    @click.option("--samples", default=5, show_default=True, help="Fresh interpreters per role.")
+    def bench_boot_command(roles, samples):
+        """Worker cold start per APP_ROLE: import time, modules loaded and RSS."""
+        from benchmarks import bench_boot
+        click.echo(json.dumps(bench_boot(roles, samples), indent=2))
+
+    @app.cli.command("users-import")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "fmt", type=click.Choice(["json", "jsonl", "ndjson", "csv"]),
+                  help="Defaults to the file extension.")
+    @click.option("--batch-size", default=1000, show_default=True, help="Users hashed and inserted per transaction.")
+    @click.option("--workers", type=int, help="Hashing processes (default: one per core, 1 hashes inline).")
+    @click.option("--cost", type=int, help="Defaults to PASSWORD_HASH_COST, then the scheme default.")
+    def users_import(path, fmt, batch_size, workers, cost):
+        """Bulk create users (name, email, password) with their passwords hashed on every core."""
+        from models import db
+        from accounts import import_users
+        from ingest import IngestError
+
+        def progress(rows, rate):
+            click.echo("%d users, %.0f users/sec" % (rows, rate), err=True)
+
+        try:
+            summary = import_users(db.engine, path, fmt=fmt, batch_size=batch_size, processes=workers,
+                                   cost=cost, progress=progress)
+        except IngestError as error:
+            raise click.ClickException(str(error))
+        click.echo(json.dumps(summary, indent=2))
+
+    @app.cli.command("bench-hashing")
+    @click.option("--cost", "costs", multiple=True, type=int,
+                  help="Repeatable; defaults to the scheme default and one step either side.")
+    @click.option("--samples", default=20, show_default=True, help="Hashes per measurement.")
+    @click.option("--workers", type=int, help="Pool size (default: one per core).")
+    @click.option("--scheme", type=click.Choice(["argon2", "bcrypt", "scrypt"]),
+                  help="Defaults to PASSWORD_HASHER, then the first installed.")
+    def bench_hashing_command(costs, samples, workers, scheme):
+        """Password hash latency and throughput per cost: one thread, a thread pool and a process pool."""
+        from benchmarks import bench_hashing
+        click.echo(json.dumps(bench_hashing(costs, samples, workers, scheme), indent=2))
+
+    @app.cli.command("favorites-reconcile")
+    @click.option("--batch-size", default=10000, show_default=True, help="Ids per UPDATE statement.")
+    @click.option("--interval", type=float, help="Keep running, reconciling every INTERVAL seconds.")
+    def favorites_reconcile(batch_size, interval):
+        """Recompute favorite_count of planets and characters from the favorites tables.
+
+        The API keeps the counters current; this repairs drift from writes
+        made outside it (SQL consoles, restores). Schedule it (cron, Heroku
+        Scheduler) or run it as a worker with --interval.
+        """
+        import time
+        from models import db
+        from popularity import reconcile
+
+        while True:
+            with db.engine.begin() as connection:
+                click.echo(json.dumps(reconcile(connection, batch_size)))
+            if interval is None:
+                return
+            time.sleep(interval)
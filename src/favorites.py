@@ -0,0 +1,205 @@
+"""
+Batch add/remove of a user's favorite planets and characters.
+
+Each batch validates all ids with a single ``IN`` query per table, writes
+with one bulk statement per table and commits once, returning a status for
+every requested id.
+
+Inserts rely on the unique ``(user_id, item)`` indexes and ignore conflicts
+(``ON CONFLICT DO NOTHING`` / ``INSERT IGNORE``), so adding a favorite that
+already exists is a no-op even when two requests race. A batch reports
+``created`` only for the rows its insert returned (``RETURNING``), and the
+favorite_count of those planets/characters is updated in the same
+transaction (see popularity.py).
+
+``apply_pairs`` writes (user, item) pairs of many users at once for the
+write-behind queue (writebehind.py). ``embed_favorites`` serves
+``/users?expand=favorites``.
+"""
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from models import db, User, Planets, Characters, FavPlanets, FavCharacters
+from popularity import adjust, apply_change, recount
+from serializers import serializer_for
+from utils import APIException
+from versioning import bump
+
+MAX_BATCH_SIZE = 500
+
+# body key -> (catalog model, favorites model, favorites foreign key)
+FAVORITE_KINDS = {
+    "planets": (Planets, FavPlanets, "planets_id"),
+    "characters": (Characters, FavCharacters, "characters_id"),
+}
+
+
+def parse_batch(body):
+    """Return ``{kind: [ids]}`` from a ``{"planets": [...], "characters": [...]}`` body."""
+    if not isinstance(body, dict):
+        raise APIException("Request body must be a JSON object", status_code=400)
+    batch = {}
+    total = 0
+    for kind in FAVORITE_KINDS:
+        ids = body.get(kind, [])
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise APIException("'%s' must be a list of integer ids" % kind, status_code=400)
+        batch[kind] = list(dict.fromkeys(ids))
+        total += len(batch[kind])
+    if total == 0:
+        raise APIException("Nothing to do: send 'planets' and/or 'characters' ids", status_code=400)
+    if total > MAX_BATCH_SIZE:
+        raise APIException("A batch accepts at most %d ids" % MAX_BATCH_SIZE, status_code=400)
+    return batch
+
+
+def _insert_ignore_stmt(connection, fav_model, fk):
+    table = fav_model.__table__
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=["user_id", fk])
+    if dialect == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=["user_id", fk])
+    if dialect == "mysql":
+        return mysql.insert(table).prefix_with("IGNORE")
+    return insert(table)
+
+
+def _insert_ignore(fav_model, fk, rows):
+    """Insert favorites rows, skipping those that already exist. Returns the rowcount."""
+    connection = db.session.connection()
+    return connection.execute(_insert_ignore_stmt(connection, fav_model, fk), rows).rowcount
+
+
+def _insert_new(fav_model, fk, user_id, ids):
+    """Insert ``user_id``'s favorite ``ids``, skipping existing ones. Returns the ids actually inserted."""
+    connection = db.session.connection()
+    stmt = _insert_ignore_stmt(connection, fav_model, fk)
+    rows = [{"user_id": user_id, fk: i} for i in ids]
+    if connection.dialect.insert_executemany_returning:
+        return set(connection.execute(stmt.returning(fav_model.__table__.c[fk]), rows).scalars())
+    # No RETURNING (MySQL): one statement per row, so each rowcount tells whether that row went in
+    return {row[fk] for row in rows if connection.execute(stmt, row).rowcount}
+
+
+def _existing(column, ids, *criteria):
+    if not ids:
+        return set()
+    return set(db.session.execute(select(column).where(column.in_(ids), *criteria)).scalars())
+
+
+def add_favorites(user_id, batch):
+    result = {}
+    touched = []
+    for kind, ids in batch.items():
+        model, fav_model, fk = FAVORITE_KINDS[kind]
+        fav_column = getattr(fav_model, fk)
+        known = _existing(model.id, ids)
+        already = _existing(fav_column, ids, fav_model.user_id == user_id)
+        new_ids = [i for i in ids if i in known and i not in already]
+        inserted = set()
+        if new_ids:
+            # A concurrent request may insert some of new_ids first: only count what this insert wrote
+            inserted = _insert_new(fav_model, fk, user_id, new_ids)
+        if inserted:
+            adjust(model, list(inserted), 1)
+            touched.append(fav_model.__tablename__)
+        result[kind] = [{
+            "id": i,
+            "status": "not_found" if i not in known else "created" if i in inserted else "exists",
+        } for i in ids]
+    if touched:
+        bump(db.session.connection(), touched)
+    return result
+
+
+def add_favorite(user_id, kind, item_id):
+    """Add one favorite with upsert semantics. Returns True if a row was created."""
+    model, fav_model, fk = FAVORITE_KINDS[kind]
+    if user_id is None or db.session.get(User, user_id) is None:
+        raise APIException("User not found", status_code=404)
+    if db.session.get(model, item_id) is None:
+        raise APIException("%s not found" % model.__name__, status_code=404)
+    created = _insert_ignore(fav_model, fk, [{"user_id": user_id, fk: item_id}]) > 0
+    if created:
+        adjust(model, [item_id], 1)
+        bump(db.session.connection(), [fav_model.__tablename__])
+    return created
+
+
+def remove_favorites(user_id, batch):
+    result = {}
+    touched = []
+    for kind, ids in batch.items():
+        model, fav_model, fk = FAVORITE_KINDS[kind]
+        fav_column = getattr(fav_model, fk)
+        present = _existing(fav_column, ids, fav_model.user_id == user_id)
+        if present:
+            deleted = db.session.execute(delete(fav_model).where(
+                fav_model.user_id == user_id, fav_column.in_(present))).rowcount
+            apply_change(fav_model, list(present), deleted, -1)
+            touched.append(fav_model.__tablename__)
+        result[kind] = [{"id": i, "status": "deleted" if i in present else "not_found"} for i in ids]
+    if touched:
+        bump(db.session.connection(), touched)
+    return result
+
+
+def apply_pairs(kind, added, removed):
+    """Insert ``added`` and delete ``removed`` ``(user_id, item_id)`` pairs, any users.
+
+    Pairs whose user or item no longer exists are skipped. favorite_count is recounted for
+    every item touched, since one item may gain or lose several users here.
+    Returns the number of rows inserted and deleted.
+    """
+    model, fav_model, fk = FAVORITE_KINDS[kind]
+    fav_column = getattr(fav_model, fk)
+    inserted = deleted = 0
+    if added:
+        known = _existing(model.id, list({item_id for _, item_id in added}))
+        users = _existing(User.id, list({user_id for user_id, _ in added}))
+        rows = [{"user_id": user_id, fk: item_id} for user_id, item_id in added
+                if item_id in known and user_id in users]
+        if rows:
+            inserted = _insert_ignore(fav_model, fk, rows)
+    if removed:
+        deleted = db.session.execute(delete(fav_model).where(
+            tuple_(fav_model.user_id, fav_column).in_(removed))).rowcount
+    if inserted or deleted:
+        recount(fav_model, list({item_id for _, item_id in added + removed}))
+        bump(db.session.connection(), [fav_model.__tablename__])
+    return inserted, deleted
+
+
+# Tables read when favorites are embedded in /users (for the ETag)
+EMBED_TABLES = ("favPlanets", "favCharacters", "planets", "characters")
+
+
+def favorites_select(kind, user_ids):
+    """``(user_id, *item columns)`` of every ``kind`` favorite of ``user_ids``."""
+    model, fav_model, fk = FAVORITE_KINDS[kind]
+    serializer = serializer_for(model)
+    return (select(fav_model.user_id, *serializer.columns)
+            .join(fav_model, getattr(fav_model, fk) == model.id)
+            .where(fav_model.user_id.in_(user_ids))
+            .order_by(fav_model.user_id, fav_model.id))
+
+
+def attach_favorites(users, kind, rows):
+    serializer = serializer_for(FAVORITE_KINDS[kind][0])
+    by_id = {user["id"]: user for user in users}
+    for row in rows:
+        by_id[row[0]]["favorites"][kind].append(serializer.from_row(row[1:]))
+
+
+def embed_favorites(users):
+    """Add ``favorites: {"planets": [...], "characters": [...]}`` to serialized users.
+
+    One ``IN`` query per kind for the whole page instead of one per user.
+    """
+    for user in users:
+        user["favorites"] = {kind: [] for kind in FAVORITE_KINDS}
+    user_ids = [user["id"] for user in users]
+    if user_ids:
+        for kind in FAVORITE_KINDS:
+            attach_favorites(users, kind, db.session.execute(favorites_select(kind, user_ids)))
+    return users
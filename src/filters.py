@@ -0,0 +1,118 @@
+"""
+Query-string filters and sorting for the catalog list endpoints.
+
+``?mass_gt=80&height_lte=200`` compare against the indexed numeric shadow
+columns, ``?species=human`` (or ``?species=human,droid``) matches indexed
+text columns, and ``?sort=-population`` orders by a numeric column with
+unknown values last.
+
+``terrain`` and ``climate`` hold SWAPI comma lists ("ice, rock"), so
+``?terrain=ice`` (or ``?terrain=ice,desert``) matches any element of the
+list, ignoring case and spaces. That is a ``LIKE`` on the delimited list,
+which the column index cannot serve. Everything becomes SQL criteria, nothing is filtered in
+Python.
+"""
+from flask import request
+from sqlalchemy import String, func, literal, or_, type_coerce
+from models import Planets, Characters
+from utils import APIException
+
+# model -> {"numeric": {param: column}, "exact": {param: column}, "list": {param: column}}
+FILTERABLE = {
+    Planets: {
+        "numeric": {
+            "population": Planets.population_num,
+            "rotation_period": Planets.rotation_period_num,
+            "orbital_period": Planets.orbital_period_num,
+            "diameter": Planets.diameter_num,
+            "gravity": Planets.gravity_num,
+            "surface_water": Planets.surface_water_num,
+        },
+        "exact": {
+            "name": Planets.name,
+        },
+        "list": {
+            "terrain": Planets.terrain,
+            "climate": Planets.climate,
+        },
+    },
+    Characters: {
+        "numeric": {
+            "height": Characters.height_num,
+            "mass": Characters.mass_num,
+        },
+        "exact": {
+            "full_name": Characters.full_name,
+            "species": Characters.species,
+            "gender": Characters.gender,
+            "homeworld": Characters.homeworld,
+        },
+        "list": {},
+    },
+}
+
+_COMPARISONS = {
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+}
+
+
+def _number(name, raw):
+    try:
+        return float(raw)
+    except ValueError:
+        raise APIException("'%s' must be a number" % name, status_code=400)
+
+
+def _list_token(value):
+    return value.replace(" ", "").lower()
+
+
+def _any_element(column, values):
+    """Whether the comma list in ``column`` has one of ``values`` as an element."""
+    # "ice, rock" -> ",ice,rock," so each element is matched whole
+    delimited = type_coerce(literal(",") + func.replace(func.lower(column), " ", "") + literal(","), String)
+    matches = [delimited.contains(",%s," % _list_token(value), autoescape=True) for value in values]
+    return matches[0] if len(matches) == 1 else or_(*matches)
+
+
+def query_filters(model, args=None):
+    """Return ``(criteria, sort)`` for ``model`` from the request query string.
+
+    ``sort`` is ``(column, descending)`` or None for the default id order.
+    Unrecognised parameters are left to other handlers (pagination etc.).
+    ``args`` defaults to the current Flask request's ``args``.
+    """
+    args = request.args if args is None else args
+    spec = FILTERABLE[model]
+    criteria = []
+    for name, raw in args.items(multi=True):
+        field, _, op = name.rpartition("_")
+        if op in _COMPARISONS and field in spec["numeric"]:
+            criteria.append(_COMPARISONS[op](spec["numeric"][field], _number(name, raw)))
+        elif name in spec["exact"]:
+            values = [v for v in raw.split(",") if v]
+            if not values:
+                continue
+            column = spec["exact"][name]
+            criteria.append(column == values[0] if len(values) == 1 else column.in_(values))
+        elif name in spec["list"]:
+            values = [v for v in raw.split(",") if _list_token(v)]
+            if values:
+                criteria.append(_any_element(spec["list"][name], values))
+
+    sort = None
+    raw_sort = args.get("sort")
+    if raw_sort:
+        field = raw_sort.lstrip("-")
+        descending = raw_sort.startswith("-")
+        if field == "id":
+            sort = (model.id, True) if descending else None
+        elif field in spec["numeric"]:
+            sort = (spec["numeric"][field], descending)
+        else:
+            raise APIException("Cannot sort by '%s' (use one of: id, %s)"
+                               % (field, ", ".join(spec["numeric"])), status_code=400)
+    return criteria, sort
@@ -0,0 +1,276 @@
+"""
+Bulk ingestion of SWAPI-format dumps into Planets and Characters.
+
+The pipeline is a chain of generators (read -> normalize -> chunk), and
+normalize also fills the numeric shadow columns, so memory
+stays constant regardless of file size. Each chunk is upserted in its own
+transaction keyed on the unique ``Planets.name`` / ``Characters.full_name``:
+PostgreSQL loads the chunk with ``COPY`` into a temporary table and merges it
+with ``INSERT ... ON CONFLICT``, other databases use an ``executemany``
+upsert. After every committed chunk the number of records consumed is written
+to a checkpoint file, so an interrupted run can be resumed.
+"""
+import csv
+import io
+import json
+import os
+import time
+from itertools import islice
+from sqlalchemy import insert, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from models import Planets, Characters
+from numeric import fill_shadows
+from versioning import bump
+
+DEFAULT_CHUNK_SIZE = 5000
+READ_SIZE = 1 << 16
+
+# SWAPI field -> column, for each kind of record
+FIELD_MAPS = {
+    "planets": {
+        "name": "name",
+        "population": "populations",
+        "populations": "populations",
+        "rotation_period": "rotation_period",
+        "orbital_period": "orbital_period",
+        "diameter": "diameter",
+        "gravity": "gravity",
+        "terrain": "terrain",
+        "surface_water": "surface_water",
+        "climate": "climate",
+    },
+    "people": {
+        "name": "full_name",
+        "full_name": "full_name",
+        "birth_year": "birth_year",
+        "species": "species",
+        "height": "height",
+        "mass": "mass",
+        "gender": "gender",
+        "hair_color": "hair_color",
+        "skin_color": "skin_color",
+        "homeworld": "homeworld",
+    },
+}
+
+# kind -> (model, unique key column)
+TARGETS = {
+    "planets": (Planets, "name"),
+    "people": (Characters, "full_name"),
+}
+
+
+class IngestError(Exception):
+    pass
+
+
+# --- Readers ------------------------------------------------------------------
+
+def _iter_json_array(fh):
+    """Yield the elements of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    buf = ""
+    while not buf:
+        chunk = fh.read(READ_SIZE)
+        if not chunk:
+            return
+        buf = chunk.lstrip()
+    if buf[0] == "{":
+        # A single SWAPI page ({"results": [...]}), small enough to parse at once
+        document = json.loads(buf + fh.read())
+        yield from document.get("results", [document])
+        return
+    if buf[0] != "[":
+        raise IngestError("Expected a JSON array or a SWAPI page object")
+    buf = buf[1:]
+    while True:
+        buf = buf.lstrip()
+        if buf.startswith(","):
+            buf = buf[1:].lstrip()
+        if buf.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buf)
+        except ValueError:
+            chunk = fh.read(READ_SIZE)
+            if not chunk:
+                raise IngestError("Truncated JSON array")
+            buf += chunk
+            continue
+        yield item
+        buf = buf[end:]
+
+
+def _iter_jsonl(fh):
+    for line in fh:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def read_records(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    with open(path, newline="" if fmt == "csv" else None, encoding="utf-8") as fh:
+        if fmt == "csv":
+            yield from csv.DictReader(fh)
+        elif fmt in ("jsonl", "ndjson"):
+            yield from _iter_jsonl(fh)
+        elif fmt == "json":
+            yield from _iter_json_array(fh)
+        else:
+            raise IngestError("Unsupported format %r (use json, jsonl or csv)" % fmt)
+
+
+# --- Transform ----------------------------------------------------------------
+
+def _clean(value, length):
+    if isinstance(value, list):
+        value = ", ".join(str(v) for v in value)
+    if value is None or value == "":
+        value = "unknown"
+    return str(value).strip()[:length]
+
+
+def normalize(kind, records):
+    """Map SWAPI records to column dicts; records without a name are skipped."""
+    model, key = TARGETS[kind]
+    field_map = FIELD_MAPS[kind]
+    columns = [c for c in model.__table__.columns if c.key in field_map.values()]
+    for record in records:
+        row = {}
+        for field, column in field_map.items():
+            if field in record and column not in row:
+                row[column] = record[field]
+        if not row.get(key):
+            continue
+        yield fill_shadows(model.__tablename__,
+                           {c.key: _clean(row.get(c.key), c.type.length) for c in columns})
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# --- Writers ------------------------------------------------------------------
+
+def _dedupe(rows, key):
+    # ON CONFLICT cannot touch the same row twice in one statement: keep the last one
+    return list({row[key]: row for row in rows}.values())
+
+
+def _copy_upsert(connection, table, key, columns, rows):
+    quote = connection.dialect.identifier_preparer.quote
+    column_list = ", ".join(quote(c) for c in columns)
+    updates = ", ".join("%s = EXCLUDED.%s" % (quote(c), quote(c)) for c in columns if c != key)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[c] for c in columns])
+    buffer.seek(0)
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute("CREATE TEMP TABLE ingest_stage ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA"
+                       % (column_list, quote(table.name)))
+        cursor.copy_expert("COPY ingest_stage (%s) FROM STDIN WITH (FORMAT csv)" % column_list, buffer)
+    finally:
+        cursor.close()
+    connection.execute(text("INSERT INTO %s (%s) SELECT %s FROM ingest_stage ON CONFLICT (%s) DO UPDATE SET %s"
+                            % (quote(table.name), column_list, column_list, quote(key), updates)))
+
+
+def _executemany_upsert(connection, table, key, columns, rows):
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        stmt = sqlite.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key], set_={c: stmt.excluded[c] for c in columns if c != key})
+    elif dialect == "postgresql":
+        stmt = postgresql.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key], set_={c: stmt.excluded[c] for c in columns if c != key})
+    elif dialect == "mysql":
+        stmt = mysql.insert(table)
+        stmt = stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in columns if c != key})
+    else:
+        stmt = insert(table)
+    connection.execute(stmt, rows)
+
+
+def upsert_chunk(connection, kind, rows):
+    model, key = TARGETS[kind]
+    table = model.__table__
+    rows = _dedupe(rows, key)
+    columns = list(rows[0])
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2":
+        _copy_upsert(connection, table, key, columns, rows)
+    else:
+        _executemany_upsert(connection, table, key, columns, rows)
+    bump(connection, [table.name])
+
+
+# --- Checkpoint ---------------------------------------------------------------
+
+def load_checkpoint(path):
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as fh:
+            return json.load(fh)
+    return None
+
+
+def save_checkpoint(path, state):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+# --- Driver -------------------------------------------------------------------
+
+def ingest(engine, path, kind, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE,
+           checkpoint=None, resume=False, progress=None):
+    """Load ``path`` into the ``kind`` table and return a summary dict."""
+    if kind not in TARGETS:
+        raise IngestError("Unknown kind %r (use %s)" % (kind, ", ".join(TARGETS)))
+    skip = 0
+    state = load_checkpoint(checkpoint) if resume else None
+    if state is not None:
+        if state.get("path") != os.path.abspath(path) or state.get("kind") != kind:
+            raise IngestError("Checkpoint %s belongs to a different file or kind" % checkpoint)
+        skip = state["records"]
+
+    records = islice(read_records(path, fmt), skip, None)
+    consumed = skip
+    rows_written = 0
+    started = time.perf_counter()
+
+    # Count raw records (not normalized rows) so resuming skips exactly what was committed
+    def counted(source):
+        nonlocal consumed
+        for record in source:
+            consumed += 1
+            yield record
+
+    for chunk in chunked(normalize(kind, counted(records)), chunk_size):
+        with engine.begin() as connection:
+            upsert_chunk(connection, kind, chunk)
+        rows_written += len(chunk)
+        if checkpoint:
+            save_checkpoint(checkpoint, {"path": os.path.abspath(path), "kind": kind, "records": consumed})
+        if progress is not None:
+            elapsed = time.perf_counter() - started
+            progress(rows_written, rows_written / elapsed if elapsed else 0.0)
+
+    elapsed = time.perf_counter() - started
+    return {
+        "kind": kind,
+        "skipped_from_checkpoint": skip,
+        "records_read": consumed,
+        "rows_upserted": rows_written,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": int(rows_written / elapsed) if elapsed else None,
+    }
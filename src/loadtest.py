@@ -0,0 +1,193 @@
+"""
+Minimal HTTP/1.1 load generator and server launcher for benchmarking.
+
+``run_load`` opens ``connections`` keep-alive connections with asyncio and
+cycles through a list of paths for a fixed duration, reconnecting whenever
+the server closes the connection (gunicorn sync workers do after every
+response). ``serve`` starts the WSGI (gunicorn) or ASGI (uvicorn) stack as a
+subprocess so both can be measured with the same client; ``request_once``
+sends single writes and ``peak_rss`` reads the server's memory high-water
+mark. Only the standard library is needed on the client side.
+"""
+import asyncio
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from itertools import cycle
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    size = 0
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            length = int((await reader.readuntil(b"\r\n")).strip().split(b";")[0], 16)
+            await reader.readexactly(length + 2)
+            size += length
+            if length == 0:
+                break
+    elif "content-length" in headers:
+        size = int(headers["content-length"])
+        await reader.readexactly(size)
+    else:
+        size = len(await reader.read())
+        headers["connection"] = "close"
+    return status, size, headers.get("connection", "").lower() == "close"
+
+
+async def _client(host, port, paths, deadline, stats):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        path = next(paths)
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            started = time.perf_counter()
+            writer.write(("GET %s HTTP/1.1\r\nHost: %s:%d\r\nAccept: application/json\r\n\r\n"
+                          % (path, host, port)).encode("latin-1"))
+            status, size, closed = await _read_response(reader)
+            stats["latencies"].append((time.perf_counter() - started) * 1000)
+            stats["bytes"] += size
+            stats["status"][status] = stats["status"].get(status, 0) + 1
+            if closed:
+                writer.close()
+                reader = writer = None
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            stats["errors"] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _run(host, port, paths, connections, duration):
+    stats = {"latencies": [], "bytes": 0, "errors": 0, "status": {}}
+    deadline = time.perf_counter() + duration
+    paths = cycle(paths)
+    started = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, paths, deadline, stats) for _ in range(connections)])
+    stats["elapsed"] = time.perf_counter() - started
+    return stats
+
+
+def run_load(host, port, paths, connections=50, duration=10.0):
+    """Drive ``paths`` for ``duration`` seconds and return latency/throughput stats."""
+    from benchmarks import percentiles
+    stats = asyncio.run(_run(host, port, list(paths), connections, duration))
+    report = {
+        "connections": connections,
+        "requests": len(stats["latencies"]),
+        "errors": stats["errors"],
+        "status": {str(k): v for k, v in sorted(stats["status"].items())},
+        "throughput_rps": round(len(stats["latencies"]) / stats["elapsed"], 1),
+        "bytes": stats["bytes"],
+    }
+    if stats["latencies"]:
+        report.update(percentiles(stats["latencies"]))
+    return report
+
+
+def request_once(host, port, method, path, body=None):
+    """One request on a fresh connection; returns ``(status, size, latency_ms)``."""
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        headers = {"Accept": "application/json"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        started = time.perf_counter()
+        connection.request(method, path, body=payload, headers=headers)
+        response = connection.getresponse()
+        size = len(response.read())
+        return response.status, size, (time.perf_counter() - started) * 1000
+    finally:
+        connection.close()
+
+
+def _children(pid):
+    try:
+        with open("/proc/%d/task/%d/children" % (pid, pid)) as handle:
+            return [int(child) for child in handle.read().split()]
+    except OSError:
+        return []
+
+
+def peak_rss(pid):
+    """Peak resident memory (VmHWM) of ``pid`` and its descendants, in MB (Linux only)."""
+    peaks = []
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending += _children(current)
+        try:
+            with open("/proc/%d/status" % current) as handle:
+                for line in handle:
+                    if line.startswith("VmHWM:"):
+                        peaks.append(int(line.split()[1]) / 1024)
+        except OSError:
+            continue
+    if not peaks:
+        return None
+    return {"max_process_mb": round(max(peaks), 1), "total_mb": round(sum(peaks), 1), "processes": len(peaks)}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not start listening on port %d" % port)
+
+
+SERVER_COMMANDS = {
+    "wsgi": lambda port, workers: [
+        sys.executable, "-m", "gunicorn", "wsgi", "--chdir", SRC_DIR, "--workers", str(workers),
+        "--bind", "127.0.0.1:%d" % port, "--log-level", "warning"],
+    "asgi": lambda port, workers: [
+        sys.executable, "-m", "uvicorn", "asgi:app", "--app-dir", SRC_DIR, "--workers", str(workers),
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+}
+
+
+@contextmanager
+def serve(stack, database_url, workers=2, env=None):
+    """Run the ``wsgi`` or ``asgi`` stack against ``database_url``; yields ``(port, process)``."""
+    port = free_port()
+    process = subprocess.Popen(
+        SERVER_COMMANDS[stack](port, workers),
+        env=dict(os.environ, **dict(env or {}, DATABASE_URL=database_url)),
+        stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        yield port, process
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
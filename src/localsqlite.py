@@ -0,0 +1,31 @@
+"""
+A local SQLite file (WAL) shared by the threads and workers of one host.
+
+Used by the write-behind journal (writebehind.py) and the profile store
+(profiling.py). Each thread gets its own connection, and a worker forked by
+gunicorn opens new ones instead of using the parent's. Connections run in
+autocommit mode (``isolation_level=None``); callers issue ``BEGIN`` themselves
+when they need a transaction.
+"""
+import os
+import sqlite3
+import threading
+
+
+class LocalSQLite:
+    def __init__(self, path, synchronous="NORMAL", timeout=30):
+        self.path = path
+        self.synchronous = synchronous
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def connection(self):
+        # One connection per thread, and never one inherited through fork()
+        connection, pid = getattr(self._local, "connection", (None, None))
+        if connection is None or pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._local.connection = (connection, os.getpid())
+            connection.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL survives a worker crash; use FULL to also survive power loss
+            connection.execute("PRAGMA synchronous=%s" % self.synchronous)
+        return connection
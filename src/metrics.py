@@ -0,0 +1,220 @@
+"""
+Request metrics, SQL timing and logging for the Flask app.
+
+``setup_metrics(app)`` records, per route template (``/people/<int:people_id>``,
+never the raw URL, so label cardinality stays bounded):
+
+* request count by method, route and status,
+* a latency histogram and a response size histogram,
+* SQL statements per request and time spent in the database, measured with
+  ``before/after_cursor_execute`` on every engine (primary and replicas).
+
+They are served at ``/metrics`` in the Prometheus text format. Counters live
+in the worker process: with several gunicorn workers each one reports its
+own, so scrape them through the workers or aggregate with ``sum()``.
+
+Requests slower than ``SLOW_REQUEST_MS`` (default 500) are logged at
+WARNING with their slowest SQL statements. ``LOG_LEVEL`` sets the level of
+the ``starwars`` loggers; it defaults to DEBUG under ``FLASK_DEBUG`` and
+WARNING otherwise, so the per-request debug lines are off in production.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from settings import env_bool, env_int
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+MAX_STATEMENTS_KEPT = 50
+
+log = logging.getLogger("starwars.metrics")
+
+
+def setup_logging():
+    level = os.environ.get("LOG_LEVEL") or ("DEBUG" if env_bool("FLASK_DEBUG") else "WARNING")
+    logger = logging.getLogger("starwars")
+    logger.setLevel(level.upper())
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    return logger
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Thread-safe counters and histograms keyed by label tuples."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.histograms = {}
+        self.db_seconds = {}
+
+    def record(self, method, route, status, seconds, size, queries, db_seconds):
+        with self._lock:
+            key = (method, route, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            labels = (method, route)
+            for name, buckets, value in (("latency", LATENCY_BUCKETS, seconds),
+                                         ("size", SIZE_BUCKETS, size),
+                                         ("queries", QUERY_BUCKETS, queries)):
+                if value is None:
+                    continue
+                histogram = self.histograms.get((name, labels))
+                if histogram is None:
+                    histogram = self.histograms[(name, labels)] = Histogram(buckets)
+                histogram.observe(value)
+            self.db_seconds[labels] = self.db_seconds.get(labels, 0.0) + db_seconds
+
+    def clear(self):
+        with self._lock:
+            self.requests.clear()
+            self.histograms.clear()
+            self.db_seconds.clear()
+
+
+registry = Registry()
+
+HISTOGRAMS = {
+    "latency": ("http_request_duration_seconds", "Request latency in seconds"),
+    "size": ("http_response_size_bytes", "Response body size in bytes (streamed bodies are not counted)"),
+    "queries": ("http_request_sql_queries", "SQL statements executed per request"),
+}
+
+
+def _labels(**labels):
+    return ",".join('%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in labels.items())
+
+
+def render(extra=()):
+    """Prometheus text exposition (format 0.0.4) of ``registry`` plus ``extra`` gauges.
+
+    ``extra`` is a list of ``(metric, help, [(labels, value), ...])``.
+    """
+    lines = ["# HELP http_requests_total Requests handled",
+             "# TYPE http_requests_total counter"]
+    with registry._lock:
+        for (method, route, status), value in sorted(registry.requests.items()):
+            lines.append("http_requests_total{%s} %d" % (_labels(method=method, route=route, status=status), value))
+        for name, (metric, help_text) in HISTOGRAMS.items():
+            lines += ["# HELP %s %s" % (metric, help_text), "# TYPE %s histogram" % metric]
+            for (kind, (method, route)), histogram in sorted(registry.histograms.items()):
+                if kind != name:
+                    continue
+                labels = _labels(method=method, route=route)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (metric, labels, bound, cumulative))
+                lines.append("%s_sum{%s} %r" % (metric, labels, histogram.sum))
+                lines.append("%s_count{%s} %d" % (metric, labels, histogram.count))
+        lines += ["# HELP http_request_db_seconds_total Time spent in SQL statements",
+                  "# TYPE http_request_db_seconds_total counter"]
+        for (method, route), value in sorted(registry.db_seconds.items()):
+            lines.append("http_request_db_seconds_total{%s} %r" % (_labels(method=method, route=route), value))
+    for metric, help_text, samples in extra:
+        lines += ["# HELP %s %s" % (metric, help_text), "# TYPE %s gauge" % metric]
+        for labels, value in samples:
+            lines.append("%s{%s} %r" % (metric, _labels(**labels), value))
+    return "\n".join(lines) + "\n"
+
+
+# The start time lives on the execution context, not the pooled connection: after_cursor_execute
+# does not fire for a statement that raises, and anything left on the connection would leak
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None or not has_request_context() or "sql_count" not in g:
+        return
+    elapsed = time.perf_counter() - started
+    g.sql_count += 1
+    g.sql_seconds += elapsed
+    if len(g.sql_statements) < MAX_STATEMENTS_KEPT:
+        g.sql_statements.append((elapsed, statement))
+
+
+def _log_slow(request_line, route, status, elapsed, state):
+    slowest = sorted(state.sql_statements, key=lambda item: item[0], reverse=True)[:5]
+    log.warning("slow request %s (%s) status=%s %.1fms sql=%d db=%.1fms\n%s",
+                request_line, route, status, elapsed * 1000, state.sql_count, state.sql_seconds * 1000,
+                "\n".join("  %.1fms %s" % (seconds * 1000, " ".join(statement.split()))
+                          for seconds, statement in slowest))
+
+
+def pool_gauges(pools):
+    """Gauges for ``{"primary": pool_stats(...), ...}`` connection pool stats."""
+    gauges = []
+    for name, help_text in (("checkedout", "Connections in use"),
+                            ("checkedin", "Idle connections in the pool"),
+                            ("timeouts", "Checkouts that failed or timed out"),
+                            ("wait_ms_total", "Total milliseconds spent waiting for a connection")):
+        samples = [({"pool": pool}, stats[name]) for pool, stats in pools.items() if name in stats]
+        if samples:
+            gauges.append(("db_pool_%s" % name, help_text, samples))
+    return gauges
+
+
+def metrics_response(extra=()):
+    return Response(render(extra), mimetype="text/plain; version=0.0.4")
+
+
+def setup_metrics(app):
+    """Install the request timing hooks on ``app``."""
+    setup_logging()
+    slow_seconds = env_int("SLOW_REQUEST_MS", 500) / 1000.0
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+        g.sql_seconds = 0.0
+        g.sql_statements = []
+
+    def finish(state, request_line, method, route, status, size):
+        elapsed = time.perf_counter() - state.request_started
+        registry.record(method, route, status, elapsed, size, state.sql_count, state.sql_seconds)
+        log.debug("%s %s %.1fms sql=%d db=%.1fms", request_line, status, elapsed * 1000,
+                  state.sql_count, state.sql_seconds * 1000)
+        if elapsed >= slow_seconds:
+            _log_slow(request_line, route, status, elapsed, state)
+
+    @app.after_request
+    def _record_request(response):
+        if "request_started" not in g:
+            return response
+        args = (g._get_current_object(), "%s %s" % (request.method, request.full_path.rstrip("?")),
+                request.method, request.url_rule.rule if request.url_rule is not None else "<unmatched>",
+                response.status_code)
+        if response.is_streamed:
+            # The body (and its SQL) runs after this hook; record once it has been sent
+            response.call_on_close(lambda: finish(*args, None))
+        else:
+            finish(*args, response.calculate_content_length())
+        return response
@@ -1,15 +1,24 @@
 from flask_sqlalchemy import SQLAlchemy
+from serializers import serializable
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+# RoutingSession envia las lecturas de las vistas @read_only a las replicas (ver replicas.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
+# serialize() se genera a partir de las columnas de la tabla (ver serializers.py)
+# do not serialize the password, its a security breach
+@serializable(exclude=("password", "is_active"))
 class User(db.Model):#(FATHER)
     __tablename__ = "user"
 
     id = db.Column(db.Integer, primary_key=True)
     name= db.Column(db.String(120), unique=False, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(80), unique=False, nullable=False)
+    # Hash codificado (argon2, bcrypt o scrypt), ver passwords.py
+    password = db.Column(db.String(255), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=False)
+    # Los emails se comparan en minusculas (accounts.py); este indice evita recorrer la tabla
+    __table_args__ = (db.Index("ix_user_email_lower", db.func.lower(email)),)
     #Relacion con FavPlanets 
     favPlanets = db.relationship("FavPlanets", backref="user")
     #Relacion con FavCharacters 
@@ -18,18 +27,16 @@ class User(db.Model):#(FATHER)
 #Esto se debe repetir en cada tabla
     def __repr__(self):
         return '<User %r>' % self.name
-
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "email": self.email,
-            # do not serialize the password, its a security breach
-        }
     
 #Aqui debemos crear nuestras tablas para las relaciones
+# Las columnas *_num son copias numericas (indexadas) de los atributos de texto, ver numeric.py
+# favorite_count se mantiene en popularity.py y solo se publica en /planets/popular
+@serializable(exclude=("population_num", "rotation_period_num", "orbital_period_num",
+                       "diameter_num", "gravity_num", "surface_water_num", "favorite_count"))
 class Planets(db.Model): #(FATHER)
     __tablename__ = "planets"
+    # El ranking de /planets/popular se lee de este indice
+    __table_args__ = (db.Index("ix_planets_favorite_count_id", "favorite_count", "id"),)
     # Here we define columns for the table address.
     # Notice that each column is also a normal Python instance attribute.
     id = db.Column(db.Integer, primary_key=True)
@@ -39,9 +46,18 @@ class Planets(db.Model): #(FATHER)
     orbital_period = db.Column(db.String(50), unique=False, nullable=False)
     diameter = db.Column(db.String(50), unique=False, nullable=False)
     gravity = db.Column(db.String(50), unique=False, nullable=False)
-    terrain = db.Column(db.String(50), unique=False, nullable=False)
+    terrain = db.Column(db.String(50), unique=False, nullable=False, index=True)
     surface_water = db.Column(db.String(50), unique=False, nullable=False)
-    climate = db.Column(db.String(50), unique=False, nullable=False)
+    climate = db.Column(db.String(50), unique=False, nullable=False, index=True)
+    # Copias numericas para filtrar y ordenar en SQL (NULL cuando el valor es "unknown")
+    population_num = db.Column(db.BigInteger, nullable=True, index=True)
+    rotation_period_num = db.Column(db.Float, nullable=True, index=True)
+    orbital_period_num = db.Column(db.Float, nullable=True, index=True)
+    diameter_num = db.Column(db.Float, nullable=True, index=True)
+    gravity_num = db.Column(db.Float, nullable=True, index=True)
+    surface_water_num = db.Column(db.Float, nullable=True, index=True)
+    # Numero de usuarios que tienen el planeta como favorito
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     #Relacion con el FavPlanets (Father)
     favPlanets = db.relationship("FavPlanets", backref="planets")
@@ -49,24 +65,13 @@ class Planets(db.Model): #(FATHER)
     def __repr__(self):
         return '<Planets %r>' % self.name
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "name": self.name,
-            "created": self.created,
-            "populations": self.populations,
-            "rotation_period": self.rotation_period,
-            "orbital_period": self.orbital_period,
-            "diameter": self.diameter,
-            "gravity": self.gravity,
-            "terrain": self.terrain,
-            "surface_water": self.surface_water,
-            "climate": self.climate,
-        }
-
 class FavPlanets(db.Model):
     __tablename__ = "favPlanets"
-  
+    # Un planeta solo puede ser favorito una vez por usuario; el indice tambien sirve las busquedas por user_id
+    # planets_id tiene su propio indice para recontar los favoritos de un planeta
+    __table_args__ = (db.Index("ix_favPlanets_user_id_planets_id", "user_id", "planets_id", unique=True),
+                      db.Index("ix_favPlanets_planets_id", "planets_id"))
+
     id = db.Column(db.Integer, primary_key=True)
     #Relacion con la tabla User
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
@@ -82,44 +87,39 @@ class FavPlanets(db.Model):
             "planets": self.planets.serialize(),
         }
 
+@serializable(exclude=("height_num", "mass_num", "favorite_count"))
 class Characters(db.Model): #(Father)
     __tablename__ = "characters"
+    __table_args__ = (db.Index("ix_characters_favorite_count_id", "favorite_count", "id"),)
     # Here we define columns for the table address.
     # Notice that each column is also a normal Python instance attribute.
     id = db.Column(db.Integer, primary_key=True)
     full_name = db.Column(db.String(50), unique=True, nullable=False)
     birth_year = db.Column(db.String(50), unique=False, nullable=False)
-    species = db.Column(db.String(50), unique=False, nullable=False)
+    species = db.Column(db.String(50), unique=False, nullable=False, index=True)
     height = db.Column(db.String(50), unique=False, nullable=False)
     mass = db.Column(db.String(50), unique=False, nullable=False)
-    gender = db.Column(db.String(50), unique=False, nullable=False)
+    gender = db.Column(db.String(50), unique=False, nullable=False, index=True)
     hair_color = db.Column(db.String(50), unique=False, nullable=False)
     skin_color = db.Column(db.String(50), unique=False, nullable=False)
-    homeworld = db.Column(db.String(50), unique=False, nullable=False)
+    homeworld = db.Column(db.String(50), unique=False, nullable=False, index=True)
+    # Copias numericas para filtrar y ordenar en SQL (NULL cuando el valor es "unknown")
+    height_num = db.Column(db.Float, nullable=True, index=True)
+    mass_num = db.Column(db.Float, nullable=True, index=True)
+    # Numero de usuarios que tienen el personaje como favorito
+    favorite_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     
     #Relacion con FavCharacters 
     favCharacters = db.relationship("FavCharacters", backref="characters")
 
     def __repr__(self):
         return '<Characters %r>' % self.full_name
-
-    def serialize(self):
-        return {
-            "id": self.id,
-            "full_name": self.full_name,
-            "birth_year": self.birth_year,
-            "species": self.species,
-            "height": self.height,
-            "mass": self.mass,
-            "gender": self.gender,
-            "hair_color": self.hair_color,
-            "skin_color": self.skin_color,
-            "homeworld": self.homeworld,
-            "created": self.created,
-        }
     
 class FavCharacters(db.Model):
     __tablename__ = "favCharacters"
+    # Un personaje solo puede ser favorito una vez por usuario; el indice tambien sirve las busquedas por user_id
+    __table_args__ = (db.Index("ix_favCharacters_user_id_characters_id", "user_id", "characters_id", unique=True),
+                      db.Index("ix_favCharacters_characters_id", "characters_id"))
 
     id = db.Column(db.Integer, primary_key=True)
     #Relacion con la tabla User
@@ -131,6 +131,15 @@ class FavCharacters(db.Model):
 
     def serialize(self):
         return {
-            "character": self.character.serialize()
+            "characters": self.characters.serialize(),
         }
-    
\ No newline at end of file
+    
+class CollectionVersion(db.Model):
+    # Contador de version por tabla, se incrementa en cada flush que la modifica (ver versioning.py)
+    __tablename__ = "collection_version"
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return '<CollectionVersion %r>' % self.name
@@ -0,0 +1,190 @@
+"""
+Content negotiation and response compression.
+
+Formats, picked from the ``Accept`` header (JSON when nothing else matches):
+
+    application/json       the default
+    application/x-ndjson   one JSON document per line, for incremental parsing
+    application/msgpack    MessagePack, when the ``msgpack`` package is installed
+
+Bodies of at least ``COMPRESS_MIN_SIZE`` bytes (default 1024) are compressed
+with brotli (when the ``brotli`` package is installed) or gzip, following
+``Accept-Encoding``. ``Representations`` keeps every (format, encoding)
+variant of a payload it has produced, so cached payloads are encoded and
+compressed once, not on every hit. Streamed bodies are compressed chunk by
+chunk. ``setup_compression`` also compresses the remaining JSON responses.
+"""
+import gzip
+import os
+import zlib
+from flask import Response, request, stream_with_context
+from serializers import dumps, loads
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+FORMATS = {"json": "application/json", "ndjson": "application/x-ndjson"}
+if msgpack is not None:
+    FORMATS["msgpack"] = "application/msgpack"
+_MIMETYPE_FORMATS = {mimetype: fmt for fmt, mimetype in FORMATS.items()}
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))
+COMPRESSIBLE = {"application/json", "application/x-ndjson", "application/msgpack", "text/html", "text/plain"}
+
+
+def response_format():
+    """The format to answer the current request with."""
+    best = request.accept_mimetypes.best_match(list(_MIMETYPE_FORMATS), default="application/json")
+    return _MIMETYPE_FORMATS[best]
+
+
+def accepted_encoding():
+    """``"br"``, ``"gzip"`` or None, from the request's ``Accept-Encoding``."""
+    return pick_encoding(request.accept_encodings)
+
+
+def pick_encoding(accepted):
+    """``"br"``, ``"gzip"`` or None from a parsed ``Accept-Encoding`` (shared with asgi.py)."""
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def encode(data, fmt):
+    if fmt == "ndjson":
+        if isinstance(data, list):
+            return b"".join(dumps(item) + b"\n" for item in data)
+        return dumps(data) + b"\n"
+    if fmt == "msgpack":
+        return msgpack.packb(data)
+    return dumps(data)
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class Representations:
+    """A payload and the encoded/compressed variants built from it so far."""
+
+    def __init__(self, data=None):
+        self._data = data
+        self._variants = {}
+
+    @classmethod
+    def from_json(cls, body):
+        """Start from an already encoded JSON body; it is decoded only for other formats."""
+        representations = cls()
+        representations._variants[("json", None)] = (body, None)
+        return representations
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = loads(self._variants[("json", None)][0])
+        return self._data
+
+    def body(self, fmt, encoding=None):
+        """``(bytes, encoding actually applied)``; small bodies stay uncompressed."""
+        key = (fmt, encoding)
+        variant = self._variants.get(key)
+        if variant is None:
+            if encoding is None:
+                variant = (encode(self.data, fmt), None)
+            else:
+                plain, _ = self.body(fmt)
+                variant = (compress(plain, encoding), encoding) if len(plain) >= COMPRESS_MIN_SIZE else (plain, None)
+            self._variants[key] = variant
+        return variant
+
+
+def payload_response(payload):
+    """Respond with ``payload`` (data or ``Representations``) in the negotiated format and encoding."""
+    if not isinstance(payload, Representations):
+        payload = Representations(payload)
+    fmt = response_format()
+    body, encoding = payload.body(fmt, accepted_encoding())
+    response = Response(body, mimetype=FORMATS[fmt])
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.update(("Accept", "Accept-Encoding"))
+    return response
+
+
+def chunk_compressor(encoding):
+    """``(feed, flush, finish)`` functions compressing a stream chunk by chunk."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _compress_chunks(chunks, encoding):
+    feed, flush, finish = chunk_compressor(encoding)
+    for chunk in chunks:
+        # Flush per chunk so the client can start decoding right away
+        yield feed(chunk) + flush()
+    yield finish()
+
+
+def _stream_chunks(batches, fmt):
+    if fmt == "json":
+        yield b"["
+        first = True
+        for items in batches:
+            if items:
+                chunk = dumps(items)[1:-1]
+                yield chunk if first else b"," + chunk
+                first = False
+        yield b"]"
+    else:
+        # NDJSON lines / a sequence of MessagePack maps, one per row
+        for items in batches:
+            yield b"".join(encode(item, fmt) for item in items) if fmt == "msgpack" else encode(items, fmt)
+
+
+def stream_response(batches):
+    """Stream lists of rows in the negotiated format, compressed on the fly when accepted."""
+    fmt = response_format()
+    return chunked_response(_stream_chunks(batches, fmt), fmt)
+
+
+def chunked_response(chunks, fmt):
+    """Stream already encoded ``chunks`` of format ``fmt``, compressed on the fly when accepted."""
+    encoding = accepted_encoding()
+    response = Response(stream_with_context(_compress_chunks(chunks, encoding) if encoding else chunks),
+                        mimetype=FORMATS[fmt])
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.update(("Accept", "Accept-Encoding"))
+    return response
+
+
+def setup_compression(app):
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code != 200 or response.is_streamed or response.direct_passthrough
+                or "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = accepted_encoding()
+        body = response.get_data()
+        if encoding is None or len(body) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
@@ -0,0 +1,62 @@
+"""
+Numeric shadow columns for the text attributes of Planets and Characters.
+
+SWAPI stores every physical attribute as text ("1,358", "1 standard",
+"unknown"). Each of them gets an indexed numeric ``*_num`` copy so filters
+and sorts run in SQL. The copies are filled by ``fill_shadows`` on the bulk
+ingestion path and, once ``setup_numeric()`` has run, by mapper events for
+ORM writes (API and Flask-Admin).
+"""
+import re
+from sqlalchemy import event
+from models import Planets, Characters
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+
+# table name -> {shadow column: (text column, python type)}
+SHADOWS = {
+    "planets": {
+        "population_num": ("populations", int),
+        "rotation_period_num": ("rotation_period", float),
+        "orbital_period_num": ("orbital_period", float),
+        "diameter_num": ("diameter", float),
+        "gravity_num": ("gravity", float),
+        "surface_water_num": ("surface_water", float),
+    },
+    "characters": {
+        "height_num": ("height", float),
+        "mass_num": ("mass", float),
+    },
+}
+
+
+def parse_number(value, kind=float):
+    """Return the first number in ``value`` ("1,358" -> 1358.0), or None if there is none."""
+    if value is None:
+        return None
+    match = _NUMBER.search(str(value).replace(",", ""))
+    if match is None:
+        return None
+    number = float(match.group())
+    return int(number) if kind is int else number
+
+
+def fill_shadows(table_name, row):
+    """Add the numeric shadow values to a column dict and return it."""
+    for shadow, (source, kind) in SHADOWS[table_name].items():
+        if source in row:
+            row[shadow] = parse_number(row[source], kind)
+    return row
+
+
+def _sync_shadows(mapper, connection, target):
+    for shadow, (source, kind) in SHADOWS[target.__tablename__].items():
+        setattr(target, shadow, parse_number(getattr(target, source), kind))
+
+
+def setup_numeric():
+    """Keep the shadow columns in sync on ORM writes; safe to call more than once."""
+    for model in (Planets, Characters):
+        for name in ("before_insert", "before_update"):
+            if not event.contains(model, name, _sync_shadows):
+                event.listen(model, name, _sync_shadows)
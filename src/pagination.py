@@ -0,0 +1,186 @@
+"""
+Keyset (cursor) pagination and streaming helpers for the list endpoints.
+
+Pages are addressed with ``?after_id=<last id seen>&limit=<n>`` instead of
+OFFSET, so every page is a single index range scan on the primary key no
+matter how deep the client has paged. ``?stream=1`` skips pagination and
+sends the whole table as a chunked JSON array (or NDJSON / MessagePack, see
+negotiation.py) read through a server-side cursor, so worker memory stays
+flat regardless of table size.
+
+With ``?sort=`` the cursor becomes the pair (sort value, id): the next page
+link carries ``after_value`` next to ``after_id`` and unknown (NULL) values
+sort last in both directions.
+
+Rows are read with a Core ``select()`` of the serialized columns, not ORM
+entities, so no identity map or instance state is built for list pages.
+``?fields=id,name`` selects only those columns.
+"""
+import logging
+from flask import request, url_for
+from sqlalchemy import and_, or_, select
+from models import db
+from negotiation import payload_response, stream_response
+from serializers import serializer_for, sparse_fields
+from utils import APIException
+
+log = logging.getLogger("starwars.pagination")
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+STREAM_CHUNK_SIZE = 1000
+
+
+def _int_arg(args, name, default, minimum):
+    raw = args.get(name)
+    if raw is None or raw == "":
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        raise APIException("'%s' must be an integer" % name, status_code=400)
+    if value < minimum:
+        raise APIException("'%s' must be >= %d" % (name, minimum), status_code=400)
+    return value
+
+
+def page_args(args=None):
+    """Read and validate ``after_id``, ``after_value`` and ``limit`` from the query string."""
+    args = request.args if args is None else args
+    after_id = _int_arg(args, "after_id", None, 0)
+    limit = min(_int_arg(args, "limit", DEFAULT_LIMIT, 1), MAX_LIMIT)
+    after_value = args.get("after_value")
+    if after_value in (None, "", "null"):
+        after_value = None
+    else:
+        try:
+            after_value = float(after_value)
+        except ValueError:
+            raise APIException("'after_value' must be a number", status_code=400)
+    return after_id, after_value, limit
+
+
+def wants_stream(args=None):
+    args = request.args if args is None else args
+    return args.get("stream", "").lower() in ("1", "true", "yes")
+
+
+def _ordering(model, sort, dialect_name):
+    if sort is None:
+        return [model.id]
+    column, descending = sort
+    direction = column.desc() if descending else column.asc()
+    if dialect_name == "mysql":
+        # MySQL has no NULLS LAST
+        return [column.is_(None), direction, model.id]
+    return [direction.nulls_last(), model.id]
+
+
+def _after(model, sort, after_id, after_value):
+    if sort is None:
+        return model.id > after_id
+    column, descending = sort
+    if after_value is None:
+        # The cursor is already inside the trailing block of unknown values
+        return and_(column.is_(None), model.id > after_id)
+    beyond = column < after_value if descending else column > after_value
+    return or_(beyond, and_(column == after_value, model.id > after_id), column.is_(None))
+
+
+def base_select(model, criteria=(), sort=None, dialect_name=None, fields=None):
+    """Select the serialized columns (plus the sort column) filtered by ``criteria``."""
+    columns = list(serializer_for(model, fields).columns)
+    if sort is not None:
+        # Appended last so serializer.from_row ignores it
+        columns.append(sort[0])
+    if dialect_name is None:
+        dialect_name = db.session.get_bind().dialect.name
+    return select(*columns).where(*criteria).order_by(*_ordering(model, sort, dialect_name))
+
+
+def page_select(model, after_id, limit, criteria=(), sort=None, after_value=None, dialect_name=None,
+                fields=None):
+    """The statement for one page, fetching one extra row to detect the next page."""
+    stmt = base_select(model, criteria, sort, dialect_name, fields)
+    if after_id is not None:
+        stmt = stmt.where(_after(model, sort, after_id, after_value))
+    return stmt.limit(limit + 1)
+
+
+def page_result(model, rows, limit, sort=None, fields=None):
+    """Turn the rows of ``page_select`` into ``(items, cursor)``; ``cursor`` is None on the last page."""
+    serializer = serializer_for(model, fields)
+    items = [serializer.from_row(row) for row in rows[:limit]]
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        return items, (last.id, last[-1] if sort is not None else None)
+    return items, None
+
+
+def keyset_page(model, after_id, limit, criteria=(), sort=None, after_value=None, fields=None):
+    """Return ``(items, cursor)`` for one page; ``cursor`` is None on the last page.
+
+    One extra row is fetched to know whether another page exists without
+    running a COUNT(*). The cursor is ``(after_id, after_value)``.
+    """
+    stmt = page_select(model, after_id, limit, criteria, sort, after_value, fields=fields)
+    return page_result(model, db.session.execute(stmt).all(), limit, sort, fields)
+
+
+def stream_batches(model, criteria=(), sort=None, chunk_size=STREAM_CHUNK_SIZE, fields=None, expand=None):
+    """Yield the whole (filtered) table as lists of serialized rows, one chunk at a time."""
+    serializer = serializer_for(model, fields)
+    stmt = base_select(model, criteria, sort, fields=fields)
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        items = [serializer.from_row(row) for row in rows]
+        if expand is not None:
+            expand(items)
+        yield items
+
+
+def next_page_args(args, cursor, limit, sort):
+    """Query arguments of the page after ``cursor``."""
+    next_args = dict(args.to_dict(), after_id=cursor[0], limit=limit)
+    if sort is not None:
+        next_args["after_value"] = "null" if cursor[1] is None else repr(cursor[1])
+    return next_args
+
+
+def expand_args(allowed, args=None):
+    """Validated ``?expand=a,b`` names, a subset of ``allowed``."""
+    args = request.args if args is None else args
+    names = {name.strip() for name in args.get("expand", "").split(",") if name.strip()}
+    unknown = names - set(allowed)
+    if unknown:
+        raise APIException("Cannot expand '%s' (use one of: %s)"
+                           % ("', '".join(sorted(unknown)), ", ".join(allowed)), status_code=400)
+    return names
+
+
+def list_response(model, criteria=(), sort=None, expand=None):
+    """Build the response for a paginated (or streamed) list endpoint.
+
+    ``?fields=`` narrows the selected columns. ``expand(items)`` runs once per
+    page (or per streamed chunk) to embed related rows with batched queries.
+    """
+    fields = sparse_fields(model)
+    if wants_stream():
+        return stream_response(stream_batches(model, criteria, sort, fields=fields, expand=expand))
+
+    after_id, after_value, limit = page_args()
+    items, cursor = keyset_page(model, after_id, limit, criteria, sort, after_value, fields)
+    if expand is not None:
+        expand(items)
+    log.debug("%s: %d rows after_id=%s limit=%d", model.__tablename__, len(items), after_id, limit)
+    return set_next_link(payload_response(items), cursor, limit, sort)
+
+
+def set_next_link(response, cursor, limit, sort=None):
+    """Add the ``Link: rel="next"`` and ``X-Next-Cursor`` headers unless this is the last page."""
+    if cursor is not None:
+        next_url = url_for(request.endpoint, _external=True,
+                           **next_page_args(request.args, cursor, limit, sort))
+        response.headers["Link"] = '<%s>; rel="next"' % next_url
+        response.headers["X-Next-Cursor"] = str(cursor[0])
+    return response
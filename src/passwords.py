@@ -0,0 +1,168 @@
+"""
+Password hashing, kept off the request threads' CPU budget.
+
+Schemes, picked with ``PASSWORD_HASHER`` (default: the first installed):
+
+    argon2   argon2-cffi, argon2id; cost = time_cost (default 3)
+    bcrypt   bcrypt; cost = log2 rounds (default 12)
+    scrypt   hashlib.scrypt, always available; cost = log2 N (default 15)
+
+``PASSWORD_HASH_COST`` overrides the default cost of the scheme. Every
+scheme stores a self-describing string (``$argon2id$...``, ``$2b$...``,
+``scrypt$...``), so the scheme or cost can change without touching the
+existing hashes, and ``verify_password`` also accepts the plain text
+passwords stored before hashing existed.
+
+``hash_in_pool`` runs the hash in a thread pool shared by the worker. The
+three libraries release the GIL while they hash, so other requests keep
+running. At most ``PASSWORD_HASH_WORKERS`` hashes run at once and at most
+``PASSWORD_HASH_QUEUE`` wait; beyond that, or when a hash takes longer than
+``HASH_TIMEOUT`` seconds, the request gets a 503 instead of piling up. ``hash_many`` spreads bulk imports over a process pool, one
+process per core.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from utils import APIException
+
+try:
+    import argon2
+except ImportError:  # pragma: no cover - optional dependency
+    argon2 = None
+
+try:
+    import bcrypt
+except ImportError:  # pragma: no cover - optional dependency
+    bcrypt = None
+
+DEFAULT_COSTS = {"argon2": 3, "bcrypt": 12, "scrypt": 15}
+SCRYPT_R = 8
+SCRYPT_P = 1
+HASH_TIMEOUT = 30
+
+
+def available_schemes():
+    return [scheme for scheme, module in (("argon2", argon2), ("bcrypt", bcrypt), ("scrypt", hashlib))
+            if module is not None]
+
+
+def default_scheme():
+    scheme = os.environ.get("PASSWORD_HASHER") or available_schemes()[0]
+    if scheme not in available_schemes():
+        raise ValueError("PASSWORD_HASHER=%s is not available (installed: %s)"
+                         % (scheme, ", ".join(available_schemes())))
+    return scheme
+
+
+def default_cost(scheme):
+    cost = os.environ.get("PASSWORD_HASH_COST")
+    return int(cost) if cost else DEFAULT_COSTS[scheme]
+
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii").rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def _scrypt(password, salt, log_n, r, p):
+    n = 1 << log_n
+    # hashlib needs maxmem above 128 * N * r bytes
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt, n=n, r=r, p=p, dklen=32,
+                          maxmem=256 * n * r + (1 << 20))
+
+
+def hash_password(password, scheme=None, cost=None):
+    """The encoded hash of ``password``; runs in the calling thread."""
+    scheme = scheme or default_scheme()
+    cost = cost or default_cost(scheme)
+    if scheme == "argon2":
+        return argon2.PasswordHasher(time_cost=cost).hash(password)
+    if scheme == "bcrypt":
+        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=cost)).decode("ascii")
+    if scheme == "scrypt":
+        salt = os.urandom(16)
+        return "scrypt$%d$%d$%d$%s$%s" % (cost, SCRYPT_R, SCRYPT_P, _b64(salt),
+                                          _b64(_scrypt(password, salt, cost, SCRYPT_R, SCRYPT_P)))
+    raise ValueError("Unknown password scheme %r" % scheme)
+
+
+def verify_password(password, encoded):
+    """Check ``password`` against a stored hash (or a legacy plain text value)."""
+    if encoded.startswith("$argon2"):
+        try:
+            return argon2.PasswordHasher().verify(encoded, password)
+        except argon2.exceptions.VerificationError:
+            return False
+    if encoded.startswith(("$2a$", "$2b$", "$2y$")):
+        return bcrypt.checkpw(password.encode("utf-8"), encoded.encode("ascii"))
+    if encoded.startswith("scrypt$"):
+        _, log_n, r, p, salt, expected = encoded.split("$")
+        return hmac.compare_digest(_scrypt(password, _unb64(salt), int(log_n), int(r), int(p)), _unb64(expected))
+    return hmac.compare_digest(password.encode("utf-8"), encoded.encode("utf-8"))
+
+
+class HashPool:
+    """A bounded thread pool for hashing during requests."""
+
+    def __init__(self, workers, queue):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def hash(self, password, scheme=None, cost=None):
+        if not self._slots.acquire(blocking=False):
+            raise APIException("Too many registrations in progress, retry shortly", status_code=503,
+                               headers={"Retry-After": "1"})
+        try:
+            future = self._executor.submit(hash_password, password, scheme, cost)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the hash is done, not until the request stops waiting for it
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(HASH_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise APIException("Password hashing is overloaded, retry shortly", status_code=503,
+                               headers={"Retry-After": "1"})
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def hash_in_pool(password):
+    """``hash_password`` in the worker's bounded pool; 503 when it is saturated."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = int(os.environ.get("PASSWORD_HASH_WORKERS") or os.cpu_count() or 1)
+                _pool = HashPool(workers, int(os.environ.get("PASSWORD_HASH_QUEUE", 4 * workers)))
+    return _pool.hash(password)
+
+
+def _hash_chunk(args):
+    passwords, scheme, cost = args
+    return [hash_password(password, scheme, cost) for password in passwords]
+
+
+def hash_many(passwords, scheme=None, cost=None, executor=None, chunk_size=16):
+    """Hash ``passwords`` in order, spread over ``executor`` (a ``ProcessPoolExecutor``) when given."""
+    scheme = scheme or default_scheme()
+    cost = cost or default_cost(scheme)
+    chunks = [(passwords[i:i + chunk_size], scheme, cost) for i in range(0, len(passwords), chunk_size)]
+    results = executor.map(_hash_chunk, chunks) if executor is not None else map(_hash_chunk, chunks)
+    return [encoded for hashed in results for encoded in hashed]
+
+
+def process_pool(processes=None):
+    """A process pool for ``hash_many``; ``None`` (hash inline) for a single process."""
+    return ProcessPoolExecutor(max_workers=processes) if processes != 1 else None
@@ -0,0 +1,160 @@
+"""
+Denormalized ``favorite_count`` on planets and characters, and the
+``/planets/popular`` and ``/people/popular`` leaderboards.
+
+Counts change in the same transaction as the favorites themselves:
+
+* ORM writes (the DELETE handlers, Flask-Admin create/edit/delete of
+  favorites) go through the mapper events below.
+* The bulk Core statements in favorites.py call ``adjust`` with the ids they
+  inserted or deleted; when the rowcount shows a concurrent request got
+  there first they ``recount`` those ids instead.
+
+``reconcile`` recomputes every count in id ranges and reports how many rows
+were off; run it periodically with ``flask favorites-reconcile``.
+
+A leaderboard is an index range scan on ``(favorite_count, id)`` read
+backwards, cached per favorites version for ``POPULAR_CACHE_TTL`` seconds.
+"""
+import os
+from flask import request
+from sqlalchemy import event, func, inspect, select, update
+from models import db, Planets, Characters, FavPlanets, FavCharacters
+from cache import LRUTTLCache
+from serializers import serializer_for
+from utils import APIException
+from versioning import bump, current_versions
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+RECONCILE_BATCH_SIZE = 10000
+
+# favorites model -> (catalog model, foreign key)
+COUNTED = {
+    FavPlanets: (Planets, "planets_id"),
+    FavCharacters: (Characters, "characters_id"),
+}
+
+_leaderboards = {}
+
+
+def adjust(model, ids, delta):
+    """Add ``delta`` to the favorite_count of ``ids`` (one statement)."""
+    ids = [i for i in ids if i is not None]
+    if ids:
+        db.session.execute(update(model).where(model.id.in_(ids))
+                           .values(favorite_count=model.favorite_count + delta)
+                           .execution_options(synchronize_session=False))
+
+
+def _count_subquery(model, fav_model, fk):
+    fav_column = getattr(fav_model, fk)
+    return select(func.count(fav_column)).where(fav_column == model.id).scalar_subquery()
+
+
+def recount(fav_model, ids):
+    """Set the favorite_count of ``ids`` from the favorites table."""
+    model, fk = COUNTED[fav_model]
+    if ids:
+        db.session.execute(update(model).where(model.id.in_(ids))
+                           .values(favorite_count=_count_subquery(model, fav_model, fk))
+                           .execution_options(synchronize_session=False))
+
+
+def apply_change(fav_model, ids, rowcount, delta):
+    """Count ``ids`` as added (+1) or removed (-1), or recount them if ``rowcount`` disagrees."""
+    if rowcount == len(ids):
+        adjust(COUNTED[fav_model][0], ids, delta)
+    else:
+        recount(fav_model, ids)
+
+
+def _on_insert(mapper, connection, target):
+    model, fk = COUNTED[type(target)]
+    _execute_adjust(connection, model, getattr(target, fk), 1)
+
+
+def _on_delete(mapper, connection, target):
+    model, fk = COUNTED[type(target)]
+    _execute_adjust(connection, model, getattr(target, fk), -1)
+
+
+def _on_update(mapper, connection, target):
+    model, fk = COUNTED[type(target)]
+    history = inspect(target).attrs[fk].history
+    if history.has_changes():
+        for old in history.deleted:
+            _execute_adjust(connection, model, old, -1)
+        for new in history.added:
+            _execute_adjust(connection, model, new, 1)
+
+
+def _execute_adjust(connection, model, item_id, delta):
+    if item_id is not None:
+        connection.execute(update(model.__table__).where(model.__table__.c.id == item_id)
+                           .values(favorite_count=model.__table__.c.favorite_count + delta))
+
+
+for _fav_model in COUNTED:
+    event.listen(_fav_model, "after_insert", _on_insert)
+    event.listen(_fav_model, "after_delete", _on_delete)
+    event.listen(_fav_model, "after_update", _on_update)
+
+
+def reconcile(connection, batch_size=RECONCILE_BATCH_SIZE):
+    """Fix every drifted favorite_count; returns ``{table: rows corrected}``."""
+    corrected = {}
+    for fav_model, (model, fk) in COUNTED.items():
+        table = model.__table__
+        actual = _count_subquery(model, fav_model, fk)
+        fixed = 0
+        last_id = 0
+        max_id = connection.execute(select(func.max(table.c.id))).scalar() or 0
+        while last_id < max_id:
+            fixed += connection.execute(
+                update(table).where(table.c.id > last_id, table.c.id <= last_id + batch_size,
+                                    table.c.favorite_count != actual)
+                .values(favorite_count=actual)).rowcount
+            last_id += batch_size
+        if fixed:
+            bump(connection, [table.name])
+        corrected[table.name] = fixed
+    return corrected
+
+
+def _leaderboard_cache(model):
+    cache = _leaderboards.get(model)
+    if cache is None:
+        cache = _leaderboards[model] = LRUTTLCache(
+            "popular-%s" % model.__tablename__, maxsize=4,
+            ttl=float(os.environ.get("POPULAR_CACHE_TTL", 30)))
+    return cache
+
+
+def top(model, fav_model):
+    """The ``MAX_LIMIT`` most favorited rows of ``model``, with their counts."""
+    tables = (model.__tablename__, fav_model.__tablename__)
+    key = tuple(current_versions(tables))
+    cache = _leaderboard_cache(model)
+    items = cache.get(key)
+    if items is None:
+        serializer = serializer_for(model)
+        rows = db.session.execute(
+            select(*serializer.columns, model.favorite_count)
+            .where(model.favorite_count > 0)
+            .order_by(model.favorite_count.desc(), model.id.desc())
+            .limit(MAX_LIMIT)).all()
+        items = [dict(serializer.from_row(row), favorite_count=row[-1]) for row in rows]
+        cache.set(key, items)
+    return items
+
+
+def popular_response(model, fav_model):
+    """``?limit=`` (1..100) most favorited rows, most favorited first."""
+    try:
+        limit = int(request.args.get("limit", DEFAULT_LIMIT))
+    except ValueError:
+        raise APIException("'limit' must be an integer", status_code=400)
+    if not 1 <= limit <= MAX_LIMIT:
+        raise APIException("'limit' must be between 1 and %d" % MAX_LIMIT, status_code=400)
+    return top(model, fav_model)[:limit]
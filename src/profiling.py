@@ -0,0 +1,356 @@
+"""
+Per-request profiling: every SQL statement with its timing, EXPLAIN of the
+slow ones and a profile of the Python side, kept in a ring buffer that the
+admin shows under "Profiles" (see admin.py).
+
+Off unless ``PROFILING`` is set. Then a request is profiled when
+
+* it sends ``X-Profile: 1`` with the ``X-Internal-Token`` of
+  ``INTERNAL_TOKEN``, as for ``/metrics``. Profiles include EXPLAIN plans,
+  so without ``INTERNAL_TOKEN`` the header is ignored unless
+  ``PROFILE_HEADER_WITHOUT_TOKEN`` is set (local development only), or
+* it is picked by ``PROFILE_SAMPLE_RATE`` (0.0 - 1.0, default 0).
+
+The response carries ``X-Profile-Id``. Statements come from
+``before/after_cursor_execute`` on every engine, so replica reads are
+included. After the response is built, the SELECTs that took at least
+``PROFILE_EXPLAIN_MS`` (default 10) are explained on the engine that ran
+them: ``EXPLAIN ANALYZE`` on PostgreSQL (it runs the query again, inside a
+transaction that is rolled back), ``EXPLAIN QUERY PLAN`` on SQLite and
+``EXPLAIN`` on MySQL. The Python side is profiled with pyinstrument when it
+is installed, cProfile otherwise; for a streamed response that covers the
+view, and the SQL of the body is still captured.
+
+``PROFILE_STORE`` keeps the last ``PROFILE_BUFFER_SIZE`` (default 100)
+profiles:
+
+    memory                     in the worker (default)
+    sqlite:////path/to/file    a local SQLite file shared by the workers of
+                               the host; needed to see the profiles of API
+                               workers from an ``APP_ROLE=admin`` worker
+"""
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from localsqlite import LocalSQLite
+from serializers import dumps, loads
+from settings import env_bool, env_int
+
+try:
+    from pyinstrument import Profiler as Pyinstrument
+except ImportError:  # pragma: no cover - optional dependency
+    Pyinstrument = None
+
+MAX_STATEMENTS = 500
+MAX_EXPLAINS = 10
+TOP_FUNCTIONS = 30
+EXPLAIN_PREFIXES = {
+    "postgresql": "EXPLAIN (ANALYZE, BUFFERS) ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "mysql": "EXPLAIN ",
+}
+
+
+class MemoryStore:
+    """The last ``size`` profiles of this worker."""
+
+    def __init__(self, size):
+        self.size = size
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles[profile["id"]] = profile
+            while len(self._profiles) > self.size:
+                self._profiles.popitem(last=False)
+
+    def recent(self):
+        """Newest first."""
+        with self._lock:
+            return list(reversed(self._profiles.values()))
+
+    def get(self, profile_id):
+        return self._profiles.get(profile_id)
+
+    def clear(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+class SQLiteStore:
+    """The last ``size`` profiles of every worker of the host, in a local SQLite file."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS profiles (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT NOT NULL UNIQUE,
+            data TEXT NOT NULL);
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._connection = LocalSQLite(path).connection
+        self._connection().executescript(self.SCHEMA)
+
+    def add(self, profile):
+        connection = self._connection()
+        seq = connection.execute("INSERT INTO profiles (id, data) VALUES (?, ?)",
+                                 (profile["id"], dumps(profile).decode("utf-8"))).lastrowid
+        connection.execute("DELETE FROM profiles WHERE seq <= ?", (seq - self.size,))
+
+    def recent(self):
+        return [loads(data) for data, in self._connection().execute(
+            "SELECT data FROM profiles ORDER BY seq DESC LIMIT ?", (self.size,))]
+
+    def get(self, profile_id):
+        row = self._connection().execute("SELECT data FROM profiles WHERE id = ?", (profile_id,)).fetchone()
+        return loads(row[0]) if row is not None else None
+
+    def clear(self):
+        self._connection().execute("DELETE FROM profiles")
+
+
+def store_from_url(url, size):
+    if url == "memory":
+        return MemoryStore(size)
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):], size)
+    raise ValueError("PROFILE_STORE must be 'memory' or sqlite:///<path>, not %r" % url)
+
+
+# --- SQL capture --------------------------------------------------------------
+
+def _active():
+    if not has_request_context():
+        return None
+    state = g.get("profile")
+    return state if state is not None and not state["done"] else None
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, like metrics.py: nothing is left behind when a statement fails
+    if _active() is not None and context is not None:
+        context._profile_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    state = _active()
+    started = getattr(context, "_profile_started", None)
+    if state is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    state["sql_count"] += 1
+    state["sql_seconds"] += elapsed
+    if len(state["statements"]) < MAX_STATEMENTS:
+        state["statements"].append({
+            "ms": round(elapsed * 1000, 3),
+            "sql": statement,
+            "parameters": None if executemany else parameters,
+            "executemany": executemany,
+            "rows": cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None,
+            "engine": conn.engine,
+        })
+
+
+def _explain_rows(dialect, rows):
+    if dialect == "sqlite":
+        # (id, parent, notused, detail): indent each step under its parent
+        depth = {0: -1}
+        lines = []
+        for step_id, parent, _, detail in rows:
+            depth[step_id] = depth.get(parent, -1) + 1
+            lines.append("  " * depth[step_id] + detail)
+        return lines
+    if dialect == "postgresql":
+        return [row[0] for row in rows]
+    return [", ".join("%s=%s" % item for item in row._mapping.items()) for row in rows]
+
+
+def explain(engine, statement, parameters):
+    """The plan of ``statement`` as text lines, or None when the backend has no EXPLAIN here."""
+    prefix = EXPLAIN_PREFIXES.get(engine.dialect.name)
+    if prefix is None:
+        return None
+    if isinstance(parameters, list):
+        parameters = tuple(parameters)
+    with engine.connect() as connection:
+        try:
+            rows = connection.exec_driver_sql(prefix + statement, parameters or ()).fetchall()
+        finally:
+            connection.rollback()
+    return _explain_rows(engine.dialect.name, rows)
+
+
+def _explainable(statement):
+    # EXPLAIN ANALYZE executes the statement: never explain writes (a WITH may hide one too)
+    return statement.lstrip()[:6].upper() == "SELECT"
+
+
+# --- Python profile -----------------------------------------------------------
+
+def _start_python():
+    if Pyinstrument is not None:
+        profiler = Pyinstrument(async_mode="disabled")
+        profiler.start()
+        return profiler
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already active on this thread
+        return None
+    return profiler
+
+
+def _python_summary(profiler):
+    if profiler is None:
+        return None
+    if Pyinstrument is not None and isinstance(profiler, Pyinstrument):
+        profiler.stop()
+        return {"profiler": "pyinstrument", "text": profiler.output_text(unicode=False, color=False)}
+    profiler.disable()
+    stats = pstats.Stats(profiler, stream=io.StringIO())
+    top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+    return {"profiler": "cProfile", "functions": [{
+        "function": "%s:%d(%s)" % (os.path.basename(filename), line, name) if line else name,
+        "calls": calls,
+        "own_ms": round(own * 1000, 3),
+        "cumulative_ms": round(cumulative * 1000, 3),
+    } for (filename, line, name), (_, calls, own, cumulative, _) in top]}
+
+
+# --- Hooks --------------------------------------------------------------------
+
+class RequestProfiler:
+    def __init__(self, store, sample_rate, explain_ms, header_without_token=False):
+        self.store = store
+        self.sample_rate = sample_rate
+        self.explain_ms = explain_ms
+        self.header_without_token = header_without_token
+
+    def requested(self):
+        """Whether the request asks for a profile with ``X-Profile`` and is allowed to."""
+        if request.headers.get("X-Profile", "") in ("", "0"):
+            return False
+        token = os.environ.get("INTERNAL_TOKEN")
+        if token:
+            return request.headers.get("X-Internal-Token") == token
+        return self.header_without_token
+
+    def wanted(self):
+        # Flask-Admin (blueprint endpoints) and static files are never profiled
+        if request.endpoint is None or request.endpoint == "static" or "." in request.endpoint:
+            return False
+        if self.requested():
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        return {
+            "id": uuid.uuid4().hex[:16],
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "route": request.url_rule.rule,
+            "sampled": not self.requested(),
+            "started": time.perf_counter(),
+            "sql_count": 0,
+            "sql_seconds": 0.0,
+            "statements": [],
+            "done": False,
+            "python": _start_python(),
+        }
+
+    def finish(self, state, status):
+        state["done"] = True
+        statements = state.pop("statements")
+        slow = sorted((s for s in statements if s["ms"] >= self.explain_ms and _explainable(s["sql"])),
+                      key=lambda s: s["ms"], reverse=True)[:MAX_EXPLAINS]
+        for statement in slow:
+            try:
+                statement["explain"] = explain(statement["engine"], statement["sql"], statement["parameters"])
+            except Exception as error:
+                statement["explain"] = ["EXPLAIN failed: %s" % error]
+        for statement in statements:
+            statement["engine"] = statement["engine"].url.render_as_string(hide_password=True)
+            statement["parameters"] = None if statement["parameters"] is None else repr(statement["parameters"])
+        self.store.add({
+            "id": state["id"],
+            "created": state["created"],
+            "method": state["method"],
+            "path": state["path"],
+            "route": state["route"],
+            "status": status,
+            "sampled": state["sampled"],
+            "duration_ms": round(state["duration"] * 1000, 3),
+            "sql_count": state["sql_count"],
+            "sql_ms": round(state["sql_seconds"] * 1000, 3),
+            "explained": len(slow),
+            "statements": statements,
+            "python": state["python_summary"],
+        })
+
+
+def profile_store():
+    """The store of profiles, or None when profiling is off."""
+    profiler = current_app.extensions.get("profiler")
+    return profiler.store if profiler is not None else None
+
+
+def setup_profiling(app):
+    """Install the profiling hooks when ``PROFILING`` is set.
+
+    Call it before ``setup_metrics`` so that the EXPLAIN statements run after
+    the request has been measured.
+    """
+    if not env_bool("PROFILING"):
+        return
+    profiler = app.extensions["profiler"] = RequestProfiler(
+        store_from_url(os.environ.get("PROFILE_STORE") or "memory", env_int("PROFILE_BUFFER_SIZE", 100)),
+        sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE") or 0),
+        explain_ms=float(os.environ.get("PROFILE_EXPLAIN_MS") or 10),
+        header_without_token=env_bool("PROFILE_HEADER_WITHOUT_TOKEN"))
+
+    @app.before_request
+    def _start_profile():
+        if profiler.wanted():
+            g.profile = profiler.start()
+
+    @app.after_request
+    def _finish_profile(response):
+        state = g.get("profile")
+        if state is None:
+            return response
+        state["python_summary"] = _python_summary(state.pop("python"))
+        response.headers["X-Profile-Id"] = state["id"]
+        if response.is_streamed:
+            # The body (and its SQL) runs after this hook; store the profile once it has been sent
+            def on_close():
+                state["duration"] = time.perf_counter() - state["started"]
+                profiler.finish(state, response.status_code)
+            response.call_on_close(on_close)
+        else:
+            state["duration"] = time.perf_counter() - state["started"]
+            profiler.finish(state, response.status_code)
+        return response
+
+    @app.teardown_request
+    def _stop_python_profile(error):
+        # after_request did not run (the request failed before it): do not leave the profiler on
+        state = g.get("profile")
+        if state is not None and state.get("python") is not None:
+            _python_summary(state.pop("python"))
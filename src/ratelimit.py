@@ -0,0 +1,151 @@
+"""
+Token-bucket rate limiting per client and endpoint.
+
+Every (client address, endpoint) pair owns a bucket holding up to ``burst``
+tokens that refills at ``rate`` tokens per second; each request takes one.
+An empty bucket answers 429 through ``APIException`` with ``Retry-After``.
+Successful responses carry ``X-RateLimit-Limit`` and
+``X-RateLimit-Remaining``.
+
+Limiting is off until ``RATELIMIT_RATE`` is set. ``RATELIMIT_BURST``
+defaults to twice the rate. ``app.config["RATELIMITS"]`` overrides the
+default per endpoint with ``(rate, burst)``, or ``None`` to exempt it.
+
+Buckets live in the worker (``memory://``, the default) or in Redis when
+``RATELIMIT_STORAGE_URL`` is a ``redis://`` URL, so every worker and host
+shares them. Behind a proxy, wrap the app in werkzeug's ``ProxyFix`` so
+``request.remote_addr`` is the client's address.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, request
+from utils import APIException
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+# Endpoints never limited: monitoring, health checks (the sitemap) and static files
+EXEMPT = ("static", "sitemap", "route_index", "prometheus_metrics", "connection_pool_stats",
+          "catalog_cache_stats")
+
+
+class MemoryBackend:
+    """Buckets of this worker, the ``max_keys`` most recently used ones."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Take one token; returns ``(allowed, tokens left, seconds until one is available)``."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                # An evicted client simply starts again with a full bucket
+                self._buckets.popitem(last=False)
+        return allowed, tokens, 0.0 if allowed else (1 - tokens) / rate
+
+
+# KEYS[1] bucket; ARGV rate, burst. Uses the server clock so every host agrees.
+_TAKE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """Buckets shared by every worker through Redis (one script call per request)."""
+
+    def __init__(self, url, prefix="ratelimit:"):
+        if redis is None:
+            raise RuntimeError("RATELIMIT_STORAGE_URL=%s needs the 'redis' package" % url)
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+
+    def take(self, key, rate, burst):
+        allowed, tokens = self._take(keys=[self.prefix + key], args=[rate, burst])
+        tokens = float(tokens)
+        return bool(allowed), tokens, 0.0 if allowed else (1 - tokens) / rate
+
+
+BACKENDS = {"memory": lambda url: MemoryBackend(int(os.environ.get("RATELIMIT_MAX_KEYS", 100000))),
+            "redis": RedisBackend, "rediss": RedisBackend}
+
+
+def backend_from_url(url):
+    scheme = url.split("://", 1)[0]
+    if scheme not in BACKENDS:
+        raise ValueError("Unknown RATELIMIT_STORAGE_URL scheme '%s' (use: %s)" % (scheme, ", ".join(BACKENDS)))
+    return BACKENDS[scheme](url)
+
+
+def limit_for(endpoint):
+    """``(rate, burst)`` for ``endpoint``, or None when it is not limited."""
+    limits = current_app.config.get("RATELIMITS", {})
+    if endpoint in limits:
+        return limits[endpoint]
+    # Blueprint endpoints ("admin.index", Flask-Admin views) are not part of the API
+    if endpoint is None or endpoint in EXEMPT or "." in endpoint:
+        return None
+    return current_app.config.get("RATELIMIT_DEFAULT")
+
+
+def setup_rate_limit(app):
+    """Install the limiter when ``RATELIMIT_RATE`` (or ``app.config["RATELIMIT_DEFAULT"]``) is set."""
+    rate = os.environ.get("RATELIMIT_RATE")
+    if rate:
+        rate = float(rate)
+        app.config.setdefault("RATELIMIT_DEFAULT", (rate, float(os.environ.get("RATELIMIT_BURST") or 2 * rate)))
+    app.config.setdefault("RATELIMITS", {})
+    if app.config.get("RATELIMIT_DEFAULT") is None and not app.config["RATELIMITS"]:
+        return
+    backend = backend_from_url(os.environ.get("RATELIMIT_STORAGE_URL", "memory://"))
+
+    @app.before_request
+    def _take_token():
+        limit = limit_for(request.endpoint)
+        if limit is None:
+            return
+        rate, burst = limit
+        allowed, remaining, retry_after = backend.take(
+            "%s|%s" % (request.remote_addr, request.endpoint), rate, burst)
+        g.rate_limit = (burst, int(remaining))
+        if not allowed:
+            raise APIException("Too many requests, retry in %d seconds" % math.ceil(retry_after),
+                               status_code=429, payload={"retry_after": math.ceil(retry_after)},
+                               headers={"Retry-After": str(math.ceil(retry_after))})
+
+    @app.after_request
+    def _rate_limit_headers(response):
+        if "rate_limit" in g:
+            burst, remaining = g.rate_limit
+            response.headers["X-RateLimit-Limit"] = "%g" % burst
+            response.headers["X-RateLimit-Remaining"] = str(remaining)
+        return response
@@ -0,0 +1,174 @@
+"""
+Read-replica routing for the Flask app.
+
+Set ``DATABASE_REPLICA_URLS`` (comma separated) to enable it. Views
+decorated with ``read_only()`` run their SELECTs on a replica picked round
+robin among the healthy ones; flushes, DML and every other view use the
+primary (``DATABASE_URL``). A replica whose health check (``SELECT 1``, at
+most every ``DB_REPLICA_CHECK_INTERVAL`` seconds) fails is skipped for
+``DB_REPLICA_RETRY_AFTER`` seconds. When no replica is healthy, reads go to
+the primary.
+
+Read-your-writes: ``mark_write(user_id)`` pins that user's reads to the
+primary for ``DB_REPLICA_STICKY_SECONDS`` inside this worker, and sets a
+cookie so the same client is also pinned on other workers.
+"""
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+from sqlalchemy.sql import Select
+from settings import engine_options, env_int, pool_stats
+
+STICKY_COOKIE = "db_primary_until"
+
+
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.down_until = 0.0
+        self.checked_at = 0.0
+
+    def healthy(self, now, check_interval, retry_after):
+        if now < self.down_until:
+            return False
+        if now - self.checked_at >= check_interval:
+            self.checked_at = now
+            try:
+                with self.engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+            except Exception:
+                self.down_until = now + retry_after
+                return False
+        return True
+
+
+class ReplicaRouter:
+    def __init__(self, urls, check_interval=5, retry_after=30, sticky_seconds=5):
+        self.replicas = [Replica(create_engine(url, **engine_options(url))) for url in urls]
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.sticky_seconds = sticky_seconds
+        self._order = itertools.cycle(range(len(self.replicas)))
+        self._lock = threading.Lock()
+        self._sticky_users = {}
+
+    def pick(self):
+        """Next healthy replica engine, or None to use the primary."""
+        now = time.monotonic()
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[next(self._order)]
+            if replica.healthy(now, self.check_interval, self.retry_after):
+                return replica.engine
+        return None
+
+    def mark_write(self, user_id):
+        until = time.time() + self.sticky_seconds
+        if user_id is not None:
+            with self._lock:
+                self._sticky_users[user_id] = until
+                if len(self._sticky_users) > 10000:
+                    now = time.time()
+                    self._sticky_users = {k: v for k, v in self._sticky_users.items() if v > now}
+        return until
+
+    def is_sticky(self, user_id):
+        return user_id is not None and self._sticky_users.get(user_id, 0) > time.time()
+
+    def stats(self):
+        now = time.monotonic()
+        return [dict(pool_stats(replica.engine), url=replica.engine.url.render_as_string(hide_password=True),
+                     down=now < replica.down_until) for replica in self.replicas]
+
+
+def _router():
+    if has_app_context():
+        return current_app.extensions.get("replicas")
+    return None
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends reads of ``read_only`` views to replicas."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and (clause is None or isinstance(clause, Select)):
+            router = _router()
+            if router is not None and g.get("db_read_only"):
+                # One replica per request, so every read sees the same snapshot
+                if "db_replica" not in g:
+                    g.db_replica = router.pick()
+                if g.db_replica is not None:
+                    return g.db_replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(user_arg=None):
+    """Mark a view as safe to serve from a replica.
+
+    ``user_arg`` names the view argument holding a user id, so reads of a
+    user who has just written stay on the primary.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            router = _router()
+            if router is not None:
+                sticky_cookie = request.cookies.get(STICKY_COOKIE, "")
+                pinned = (sticky_cookie.replace(".", "", 1).isdigit() and float(sticky_cookie) > time.time()) \
+                    or router.is_sticky(kwargs.get(user_arg))
+                g.db_read_only = not pinned
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def on_primary():
+    """Run the enclosed reads on the primary even inside a ``read_only`` view.
+
+    For data that outlives the request (process-wide caches): a lagging
+    replica would put an old row back after the invalidation of a write.
+    """
+    read_only_before = g.get("db_read_only", False)
+    g.db_read_only = False
+    try:
+        yield
+    finally:
+        g.db_read_only = read_only_before
+
+
+def mark_write(user_id=None):
+    """Record a write so the next reads of ``user_id`` (and this client) hit the primary."""
+    router = _router()
+    if router is not None:
+        g.db_sticky_until = router.mark_write(user_id)
+
+
+def replica_stats():
+    router = _router()
+    return router.stats() if router is not None else []
+
+
+def setup_replicas(app):
+    urls = [url.strip() for url in app.config.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+    if not urls:
+        return
+    app.extensions["replicas"] = ReplicaRouter(
+        urls,
+        check_interval=env_int("DB_REPLICA_CHECK_INTERVAL", 5),
+        retry_after=env_int("DB_REPLICA_RETRY_AFTER", 30),
+        sticky_seconds=env_int("DB_REPLICA_STICKY_SECONDS", 5),
+    )
+
+    @app.after_request
+    def set_sticky_cookie(response):
+        until = g.get("db_sticky_until")
+        if until is not None:
+            response.set_cookie(STICKY_COOKIE, "%.3f" % until,
+                                max_age=max(1, int(until - time.time()) + 1), httponly=True, samesite="Lax")
+        return response
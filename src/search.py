@@ -0,0 +1,229 @@
+"""
+Ranked full-text / prefix search over characters and planets.
+
+Three backends, picked from the database in use:
+
+* PostgreSQL: ``to_tsvector('simple', ...)`` expressions backed by GIN
+  indexes (see migration c7f2e5a1b9d3), ranked with ``ts_rank``.
+* SQLite: an FTS5 table ``catalog_search`` kept in sync by triggers, ranked
+  with ``bm25``. Its rowid encodes the source row (``id * 2 + kind``) so the
+  triggers can update it without a scan.
+* Anything else: a ``LIKE '%term%'`` scan, correct but not indexed.
+
+Every query token is treated as a prefix (``luk sky`` finds "Luke
+Skywalker"), which is what autocomplete needs.
+"""
+import re
+import time
+import weakref
+from flask import request
+from sqlalchemy import literal, literal_column, func, or_, select, text, union_all
+from models import db, Planets, Characters
+from serializers import serializer_for
+from utils import APIException
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_OFFSET = 1000
+
+# kind -> (model, searchable columns, name column); the FTS rowid uses the position in this tuple
+KINDS = ("people", "planets")
+SEARCHABLE = {
+    "people": (Characters, (Characters.full_name, Characters.species, Characters.homeworld)),
+    "planets": (Planets, (Planets.name, Planets.terrain, Planets.climate)),
+}
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+BACKEND_RECHECK_SECONDS = 60
+# engine -> (backend name, when it was looked up)
+_backends = weakref.WeakKeyDictionary()
+
+# The PostgreSQL GIN indexes (as created by migration c7f2e5a1b9d3): index name -> (table, document expression)
+POSTGRES_INDEXES = {
+    "ix_%s_search" % model.__tablename__: (model.__tablename__, " || ' ' || ".join(c.key for c in columns))
+    for model, columns in SEARCHABLE.values()
+}
+
+# The SQLite FTS5 index, as created by migration c7f2e5a1b9d3; rowid = id * 2 + (0 people, 1 planets)
+SQLITE_FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS catalog_search USING fts5(
+        name, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')""",
+    """CREATE TRIGGER IF NOT EXISTS characters_search_ai AFTER INSERT ON characters BEGIN
+        INSERT INTO catalog_search (rowid, name, body)
+        VALUES (new.id * 2, new.full_name, new.species || ' ' || new.homeworld);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS characters_search_au AFTER UPDATE OF full_name, species, homeworld ON characters BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id * 2;
+        INSERT INTO catalog_search (rowid, name, body)
+        VALUES (new.id * 2, new.full_name, new.species || ' ' || new.homeworld);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS characters_search_ad AFTER DELETE ON characters BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id * 2;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS planets_search_ai AFTER INSERT ON planets BEGIN
+        INSERT INTO catalog_search (rowid, name, body)
+        VALUES (new.id * 2 + 1, new.name, new.terrain || ' ' || new.climate);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS planets_search_au AFTER UPDATE OF name, terrain, climate ON planets BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id * 2 + 1;
+        INSERT INTO catalog_search (rowid, name, body)
+        VALUES (new.id * 2 + 1, new.name, new.terrain || ' ' || new.climate);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS planets_search_ad AFTER DELETE ON planets BEGIN
+        DELETE FROM catalog_search WHERE rowid = old.id * 2 + 1;
+    END""",
+)
+
+SQLITE_FTS_REBUILD = (
+    "DELETE FROM catalog_search",
+    """INSERT INTO catalog_search (rowid, name, body)
+        SELECT id * 2, full_name, species || ' ' || homeworld FROM characters""",
+    """INSERT INTO catalog_search (rowid, name, body)
+        SELECT id * 2 + 1, name, terrain || ' ' || climate FROM planets""",
+    "INSERT INTO catalog_search (catalog_search) VALUES ('optimize')",
+)
+
+
+def ensure_sqlite_index(connection, rebuild=False):
+    """Create the FTS5 table and triggers if missing; ``rebuild`` re-reads every row."""
+    for statement in SQLITE_FTS_DDL:
+        connection.exec_driver_sql(statement)
+    _backends.pop(connection.engine, None)
+    if rebuild:
+        for statement in SQLITE_FTS_REBUILD:
+            connection.exec_driver_sql(statement)
+
+
+def tokens(q):
+    return _TOKEN.findall(q.lower())[:8]
+
+
+def backend_name(connection):
+    """The search backend of ``connection``'s database, looked up once per engine.
+
+    A missing FTS5 table is looked for again every ``BACKEND_RECHECK_SECONDS``,
+    so workers pick up an index created later by ``flask search-reindex``.
+    """
+    cached = _backends.get(connection.engine)
+    if cached is not None and (cached[0] != "like" or time.monotonic() - cached[1] < BACKEND_RECHECK_SECONDS):
+        return cached[0]
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        backend = "postgresql"
+    elif dialect == "sqlite" and connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'catalog_search'").first():
+        backend = "fts5"
+    else:
+        backend = "like"
+    _backends[connection.engine] = (backend, time.monotonic())
+    return backend
+
+
+def _document(columns):
+    doc = columns[0]
+    for column in columns[1:]:
+        doc = doc.op("||")(literal_column("' '")).op("||")(column)
+    return func.to_tsvector(literal_column("'simple'::regconfig"), doc)
+
+
+def _postgres_hits(connection, words, kinds, limit, offset):
+    tsquery = func.to_tsquery(literal_column("'simple'::regconfig"),
+                              " & ".join("%s:*" % w for w in words))
+    parts = []
+    for kind in kinds:
+        model, columns = SEARCHABLE[kind]
+        document = _document(columns)
+        parts.append(select(literal(kind).label("kind"), model.id.label("ref_id"),
+                            func.ts_rank(document, tsquery).label("score"))
+                     .where(document.op("@@")(tsquery)))
+    hits = union_all(*parts).subquery()
+    stmt = select(hits).order_by(hits.c.score.desc(), hits.c.kind, hits.c.ref_id).limit(limit).offset(offset)
+    return [(row.kind, row.ref_id, float(row.score)) for row in connection.execute(stmt)]
+
+
+def _fts5_hits(connection, words, kinds, limit, offset):
+    match = " ".join('"%s"*' % w for w in words)
+    kind_filter = ""
+    if len(kinds) == 1:
+        kind_filter = "AND rowid %% 2 = %d" % KINDS.index(kinds[0])
+    rows = connection.execute(text(
+        "SELECT rowid, bm25(catalog_search, 10.0, 1.0) AS score FROM catalog_search "
+        "WHERE catalog_search MATCH :match " + kind_filter +
+        " ORDER BY score, rowid LIMIT :limit OFFSET :offset"),
+        {"match": match, "limit": limit, "offset": offset})
+    # bm25 is lower-is-better; flip it so every backend returns higher-is-better
+    return [(KINDS[rowid % 2], rowid // 2, -float(score)) for rowid, score in rows]
+
+
+def _like_hits(connection, words, kinds, limit, offset):
+    parts = []
+    for kind in kinds:
+        model, columns = SEARCHABLE[kind]
+        criteria = [or_(*[column.ilike("%%%s%%" % w) for column in columns]) for w in words]
+        parts.append(select(literal(kind).label("kind"), model.id.label("ref_id")).where(*criteria))
+    hits = union_all(*parts).subquery()
+    stmt = select(hits).order_by(hits.c.kind, hits.c.ref_id).limit(limit).offset(offset)
+    return [(row.kind, row.ref_id, 0.0) for row in connection.execute(stmt)]
+
+
+BACKENDS = {
+    "postgresql": _postgres_hits,
+    "fts5": _fts5_hits,
+    "like": _like_hits,
+}
+
+
+def search(connection, q, kinds=KINDS, limit=DEFAULT_LIMIT, offset=0):
+    """Return ``(backend, [(kind, id, score), ...])`` best match first."""
+    words = tokens(q)
+    if not words:
+        return None, []
+    backend = backend_name(connection)
+    return backend, BACKENDS[backend](connection, words, kinds, limit, offset)
+
+
+def _hydrate(connection, hits):
+    """Load the serialized rows for ``hits`` with one IN query per kind."""
+    rows = {}
+    for kind in KINDS:
+        ids = [ref_id for hit_kind, ref_id, _ in hits if hit_kind == kind]
+        if ids:
+            model, _ = SEARCHABLE[kind]
+            serializer = serializer_for(model)
+            for row in connection.execute(select(*serializer.columns).where(model.id.in_(ids))):
+                rows[(kind, row.id)] = serializer.from_row(row)
+    return rows
+
+
+def search_response():
+    """Build the ``/search`` payload from ``?q=&type=&page=&limit=``."""
+    q = request.args.get("q", "").strip()
+    if not tokens(q):
+        raise APIException("'q' is required", status_code=400)
+    kind = request.args.get("type")
+    if kind is not None and kind not in KINDS:
+        raise APIException("'type' must be one of: %s" % ", ".join(KINDS), status_code=400)
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+        limit = min(max(1, int(request.args.get("limit", DEFAULT_LIMIT))), MAX_LIMIT)
+    except ValueError:
+        raise APIException("'page' and 'limit' must be integers", status_code=400)
+    offset = (page - 1) * limit
+    if offset > MAX_OFFSET:
+        raise APIException("Results are limited to the first %d matches" % MAX_OFFSET, status_code=400)
+
+    connection = db.session.connection()
+    backend, hits = search(connection, q, (kind,) if kind else KINDS, limit + 1, offset)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    rows = _hydrate(connection, hits)
+    return {
+        "query": q,
+        "backend": backend,
+        "page": page,
+        "limit": limit,
+        "next_page": page + 1 if has_more else None,
+        "results": [{"type": hit_kind, "id": ref_id, "score": score, "item": rows.get((hit_kind, ref_id))}
+                    for hit_kind, ref_id, score in hits],
+    }
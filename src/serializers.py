@@ -0,0 +1,113 @@
+"""
+Column-driven serializers and the JSON encoder used for responses.
+
+``serializable`` reads a model's ``__table__`` once and installs a
+``serialize()`` method that copies the selected columns with a single
+``attrgetter`` call. The same column list drives the Core ``select()`` used
+by the list endpoints, which returns plain tuples and skips the ORM identity
+map. ``?fields=`` narrows both to a cached subset of the columns. Encoding
+goes through orjson when it is installed and falls back to the
+standard library otherwise.
+"""
+import json
+from operator import attrgetter
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from utils import APIException
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+_registry = {}
+
+
+class _Serializer:
+    def __init__(self, columns):
+        self.columns = columns
+        self.keys = tuple(c.key for c in self.columns)
+        self._get = attrgetter(*self.keys)
+        self._subsets = {}
+
+    def from_object(self, obj):
+        values = self._get(obj)
+        if len(self.keys) == 1:
+            values = (values,)
+        return dict(zip(self.keys, values))
+
+    def from_row(self, row):
+        return dict(zip(self.keys, row))
+
+    def only(self, fields):
+        """Serializer for a subset of the columns; ``id`` is always kept (cursors need it)."""
+        wanted = frozenset(fields) | {"id"}
+        subset = self._subsets.get(wanted)
+        if subset is None:
+            subset = self._subsets[wanted] = _Serializer([c for c in self.columns if c.key in wanted])
+        return subset
+
+
+def serializable(exclude=()):
+    """Class decorator: register ``model`` and generate its ``serialize()``."""
+    def decorator(model):
+        serializer = _Serializer([c for c in model.__table__.columns if c.key not in set(exclude)])
+        _registry[model] = serializer
+
+        def serialize(self):
+            return serializer.from_object(self)
+
+        model.serialize = serialize
+        return model
+    return decorator
+
+
+def serializer_for(model, fields=None):
+    serializer = _registry[model]
+    return serializer.only(fields) if fields else serializer
+
+
+def sparse_fields(model, args=None):
+    """Validated ``?fields=id,name`` for ``model``, or None for every column."""
+    args = request.args if args is None else args
+    raw = args.get("fields")
+    if not raw:
+        return None
+    fields = tuple(dict.fromkeys(f.strip() for f in raw.split(",") if f.strip()))
+    keys = _registry[model].keys
+    unknown = [f for f in fields if f not in keys]
+    if unknown:
+        raise APIException("Unknown field(s): %s (use: %s)" % (", ".join(unknown), ", ".join(keys)),
+                           status_code=400)
+    return fields
+
+
+def _fallback(obj):
+    return DefaultJSONProvider.default(obj)
+
+
+def dumps(obj):
+    """Encode ``obj`` to JSON bytes with the fastest available encoder."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_fallback, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_fallback, separators=(",", ":")).encode("utf-8")
+
+
+def loads(body):
+    """Decode JSON ``bytes`` with the fastest available decoder."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that routes ``jsonify`` through ``dumps``."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
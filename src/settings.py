@@ -0,0 +1,188 @@
+"""
+Database settings read from the environment.
+
+``engine_options`` turns the variables below into ``SQLALCHEMY_ENGINE_OPTIONS``
+with per-worker defaults sized so that ``WEB_CONCURRENCY`` gunicorn workers
+stay inside ``DB_MAX_CONNECTIONS``:
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW   connections kept / allowed on top, per worker
+    DB_MAX_CONNECTIONS              connection budget shared by all workers
+    DB_POOL_TIMEOUT                 seconds to wait for a free connection
+    DB_POOL_RECYCLE                 seconds before a connection is replaced
+    DB_POOL_PRE_PING                test connections on checkout (default on)
+    DB_STATEMENT_TIMEOUT_MS         per-statement timeout (PostgreSQL, MySQL)
+    DB_PREPARED_STATEMENT_CACHE     driver prepared statement cache size
+    DB_PGBOUNCER                    PgBouncer transaction pooling mode
+
+In PgBouncer transaction mode the server connection changes between
+transactions, so startup parameters and session ``SET``s are not used:
+the statement timeout is applied with ``SET LOCAL`` at the start of every
+transaction and prepared statement caches are turned off.
+
+``APP_ROLE`` (``app_role``) picks what a worker registers: ``api`` leaves out
+Flask-Admin and the swagger spec, ``admin`` serves them next to the API but
+always reads the database (no snapshot, no rate limit), ``all`` does both.
+"""
+import os
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+DEFAULT_DATABASE_URL = "sqlite:////tmp/test.db"
+APP_ROLES = ("api", "admin", "all")
+
+
+def env_int(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_bool(name, default=False):
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def app_role():
+    role = (os.environ.get("APP_ROLE") or "all").strip().lower()
+    if role not in APP_ROLES:
+        raise ValueError("APP_ROLE must be one of %s, not %r" % (", ".join(APP_ROLES), role))
+    return role
+
+
+def database_uri():
+    url = os.getenv("DATABASE_URL")
+    if url is None:
+        return DEFAULT_DATABASE_URL
+    return url.replace("postgres://", "postgresql://", 1)
+
+
+class _TimedPoolMixin:
+    """Records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._wait_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._wait_lock:
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _pool_sizes():
+    pool_size = env_int("DB_POOL_SIZE")
+    max_overflow = env_int("DB_MAX_OVERFLOW")
+    budget = env_int("DB_MAX_CONNECTIONS")
+    workers = max(1, env_int("WEB_CONCURRENCY", 1))
+    if budget is not None:
+        per_worker = max(1, budget // workers)
+        if pool_size is None:
+            pool_size = max(1, per_worker * 2 // 3)
+        if max_overflow is None:
+            max_overflow = max(0, per_worker - pool_size)
+    # One connection per thread plus a little headroom for streamed responses
+    threads = max(1, env_int("GUNICORN_THREADS", env_int("THREADS", 1)))
+    return (pool_size if pool_size is not None else threads + 1,
+            max_overflow if max_overflow is not None else threads)
+
+
+def engine_options(url=None, is_async=False):
+    """Build ``create_engine`` keyword arguments for ``url`` from the environment."""
+    url = make_url(url or database_uri())
+    backend = url.get_backend_name()
+    options = {"pool_pre_ping": env_bool("DB_POOL_PRE_PING", True)}
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+
+    pool_size, max_overflow = _pool_sizes()
+    options.update({
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": env_int("DB_POOL_TIMEOUT", 10),
+        "pool_recycle": env_int("DB_POOL_RECYCLE", 1800),
+        "pool_use_lifo": True,
+    })
+
+    connect_args = {}
+    pgbouncer = env_bool("DB_PGBOUNCER")
+    statement_timeout = env_int("DB_STATEMENT_TIMEOUT_MS")
+    cache_size = env_int("DB_PREPARED_STATEMENT_CACHE")
+    driver = url.get_driver_name()
+    if backend == "postgresql":
+        if statement_timeout and not pgbouncer and driver in ("psycopg2", "psycopg"):
+            connect_args["options"] = "-c statement_timeout=%d" % statement_timeout
+        if statement_timeout and not pgbouncer and driver == "asyncpg":
+            connect_args["server_settings"] = {"statement_timeout": str(statement_timeout)}
+        if driver == "asyncpg":
+            size = 0 if pgbouncer else cache_size
+            if size is not None:
+                connect_args["statement_cache_size"] = size
+                connect_args["prepared_statement_cache_size"] = size
+        elif driver == "psycopg":
+            if pgbouncer or cache_size == 0:
+                connect_args["prepare_threshold"] = None
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+def setup_engine_events(engine):
+    """Per-connection/per-transaction settings that cannot go in the URL."""
+    statement_timeout = env_int("DB_STATEMENT_TIMEOUT_MS")
+    if not statement_timeout:
+        return
+    backend = engine.dialect.name
+    if backend == "postgresql" and env_bool("DB_PGBOUNCER"):
+        @event.listens_for(engine, "begin")
+        def _set_local_timeout(connection):
+            connection.exec_driver_sql("SET LOCAL statement_timeout = %d" % statement_timeout)
+    elif backend == "mysql":
+        @event.listens_for(engine, "connect")
+        def _set_session_timeout(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SET SESSION max_execution_time = %d" % statement_timeout)
+            cursor.close()
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    if isinstance(pool, _TimedPoolMixin):
+        stats.update({
+            "checkouts": pool.checkouts,
+            "timeouts": pool.timeouts,
+            "wait_ms_total": round(pool.wait_seconds_total * 1000, 3),
+            "wait_ms_avg": round(pool.wait_seconds_total * 1000 / pool.checkouts, 3) if pool.checkouts else 0.0,
+            "wait_ms_max": round(pool.wait_seconds_max * 1000, 3),
+        })
+    return stats
@@ -0,0 +1,120 @@
+"""
+The sitemap (``/``) and the JSON route index (``/routes``), built once.
+
+Flask refuses new routes after the first request, so ``app.url_map`` is
+final once the app module has been imported. ``setup_route_index`` renders
+both documents right away, and ``route_document`` serves them from memory
+with a strong ETag. Compressed variants are built on first use and kept as
+well. A document is rebuilt only for a different ``SCRIPT_NAME``, since it
+holds absolute paths.
+
+Each entry of the route index lists the rule, its methods, the typed path
+parameters and how responses may be cached. That information comes from
+the ``conditional`` decorator (ETag source tables and Cache-Control) and
+``app.config["CACHE_CONTROL"]``.
+"""
+import hashlib
+import re
+import threading
+from flask import current_app, request
+from negotiation import COMPRESS_MIN_SIZE, accepted_encoding, compress
+from serializers import dumps
+from utils import generate_sitemap
+from versioning import cache_control_for
+
+CACHE_CONTROL = "public, max-age=300"
+# Views that return route_document(); their ETag comes from the document body
+DOCUMENT_ENDPOINTS = ("sitemap", "route_index")
+_PARAM = re.compile(r"<(?:(\w+)(?:\([^>]*\))?:)?(\w+)>")
+
+
+def route_index(app):
+    """Every API rule (not static files or blueprints such as Flask-Admin), sorted by path."""
+    routes = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: (rule.rule, rule.endpoint)):
+        if rule.endpoint == "static" or "." in rule.endpoint:
+            continue
+        entry = {
+            "rule": rule.rule,
+            "endpoint": rule.endpoint,
+            "methods": sorted(rule.methods - {"HEAD", "OPTIONS"}),
+            "params": [{"name": name, "type": converter or "string"}
+                       for converter, name in _PARAM.findall(rule.rule)],
+        }
+        conditional = getattr(app.view_functions[rule.endpoint], "conditional", None)
+        if rule.endpoint in DOCUMENT_ENDPOINTS:
+            conditional = {"tables": [], "expand": [], "cache_control": CACHE_CONTROL}
+        if conditional is not None:
+            entry["cache"] = {
+                "etag": "tables" if conditional["tables"] else "body",
+                "tables": conditional["tables"],
+                "expand": conditional["expand"],
+                "cache_control": cache_control_for(rule.endpoint, conditional["cache_control"]),
+            }
+        else:
+            entry["cache"] = None
+        routes.append(entry)
+    return routes
+
+
+class _Document:
+    """Encoded bytes of a document, plus its compressed variants as they are requested."""
+
+    def __init__(self, body, mimetype):
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self._bodies = {None: body}
+
+    def body(self, encoding):
+        if encoding is None or len(self._bodies[None]) < COMPRESS_MIN_SIZE:
+            return self._bodies[None], None
+        variant = self._bodies.get(encoding)
+        if variant is None:
+            variant = self._bodies[encoding] = compress(self._bodies[None], encoding)
+        return variant, encoding
+
+
+class RouteDocuments:
+    """``{(kind, script_root): _Document}`` for one app."""
+
+    BUILDERS = {
+        "sitemap": lambda app: (generate_sitemap(app).encode("utf-8"), "text/html"),
+        "routes": lambda app: (dumps({"routes": route_index(app)}), "application/json"),
+    }
+
+    def __init__(self, app):
+        self.app = app
+        self._documents = {}
+        self._lock = threading.Lock()
+
+    def get(self, kind):
+        key = (kind, request.script_root)
+        document = self._documents.get(key)
+        if document is None:
+            with self._lock:
+                document = self._documents.get(key)
+                if document is None:
+                    document = self._documents[key] = _Document(*self.BUILDERS[kind](self.app))
+        return document
+
+
+def route_document(kind):
+    """Serve the cached ``"sitemap"`` or ``"routes"`` document, 304 on a matching ETag."""
+    document = current_app.extensions["route_documents"].get(kind)
+    encoding = accepted_encoding()
+    body, applied = document.body(encoding)
+    response = current_app.response_class(body, mimetype=document.mimetype)
+    if applied is not None:
+        response.headers["Content-Encoding"] = applied
+    response.vary.add("Accept-Encoding")
+    response.set_etag("%s-%s" % (document.etag, applied or "identity"))
+    response.headers["Cache-Control"] = cache_control_for(request.endpoint, CACHE_CONTROL)
+    return response.make_conditional(request)
+
+
+def setup_route_index(app):
+    """Build the documents now; call once every route is registered."""
+    documents = app.extensions["route_documents"] = RouteDocuments(app)
+    with app.test_request_context("/"):
+        for kind in RouteDocuments.BUILDERS:
+            documents.get(kind)
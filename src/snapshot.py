@@ -0,0 +1,314 @@
+"""
+Read-only snapshot of the catalog (planets and characters) served from mmap.
+
+``flask export-snapshot`` writes every catalog row, already encoded as JSON,
+into one offset-indexed file::
+
+    b"SWSNAP\\x00\\x01"  magic + format version
+    uint32             length of the JSON header
+    header             {"version", "created", "tables": {name: {...}}}
+    per table          int64 ids[rows]       sorted, for binary search
+                       uint64 offsets[rows+1] into the table's data
+                       data                   '{row},{row},...,' in id order
+
+Offsets are relative to the first 8-byte boundary after the header. The
+version is a hash of the rows, so re-exporting an unchanged catalog keeps
+every ETag. The file is written next to its destination and renamed over
+it, so readers see either the old or the new snapshot, never half of one.
+
+When ``SNAPSHOT_PATH`` is set, ``from_snapshot`` answers the plain catalog
+GETs (``?after_id``, ``?limit``, ``?stream`` only; filters, sorting and
+``?fields=`` still go to the database) from the mapped file: no query, no
+serializer, and the pages live in the OS page cache shared by every gunicorn
+worker instead of each worker's heap. Each worker checks the file at most
+every ``SNAPSHOT_CHECK_INTERVAL`` seconds (default 1) and maps the new one
+when it has been replaced. Writes made after the export (Flask-Admin edits,
+``flask ingest``) are not visible until the next export.
+"""
+import array
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from functools import wraps
+from flask import current_app, request
+from sqlalchemy import select
+from models import Planets, Characters
+from negotiation import Representations, accepted_encoding, chunked_response, payload_response, response_format
+from pagination import STREAM_CHUNK_SIZE, page_args, set_next_link, wants_stream
+from serializers import dumps, serializer_for
+from utils import APIException
+from versioning import DEFAULT_CACHE_CONTROL, cache_control_for, representation_key, versions_select
+
+MAGIC = b"SWSNAP\x00\x01"
+MODELS = (Planets, Characters)
+# Query arguments the snapshot can answer; anything else falls back to the database
+SNAPSHOT_ARGS = frozenset(("after_id", "limit", "stream"))
+
+log = logging.getLogger("starwars.snapshot")
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def _native(values):
+    # The file is little-endian; convert in place on big-endian hosts
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def _export_table(connection, model, out, chunk_size):
+    serializer = serializer_for(model)
+    ids = array.array("q")
+    offsets = array.array("Q", [0])
+    digest = hashlib.sha1()
+    result = connection.execution_options(yield_per=chunk_size).execute(
+        select(*serializer.columns).order_by(model.id))
+    for rows in result.partitions():
+        encoded = [dumps(serializer.from_row(row)) + b"," for row in rows]
+        position = offsets[-1]
+        for row, body in zip(rows, encoded):
+            ids.append(row.id)
+            position += len(body)
+            offsets.append(position)
+        chunk = b"".join(encoded)
+        out.write(chunk)
+        digest.update(chunk)
+    return ids, offsets, digest.hexdigest()
+
+
+def export_snapshot(connection, path, chunk_size=STREAM_CHUNK_SIZE):
+    """Write the catalog to ``path`` atomically; returns the header that was written."""
+    tables = {}
+    sections = []
+    digest = hashlib.sha1()
+    try:
+        for model in MODELS:
+            data = tempfile.TemporaryFile()
+            sections.append(data)
+            ids, offsets, table_digest = _export_table(connection, model, data, chunk_size)
+            digest.update(table_digest.encode("ascii"))
+            tables[model.__tablename__] = {
+                "model": model.__name__,
+                "columns": list(serializer_for(model).keys),
+                "rows": len(ids),
+                "ids": ids,
+                "offsets": offsets,
+            }
+
+        # Lay the sections out relative to the end of the header
+        position = 0
+        for info in tables.values():
+            info["ids_at"] = position
+            position += 8 * len(info["ids"])
+            info["offsets_at"] = position
+            position += 8 * len(info["offsets"])
+            info["data_at"] = position
+            info["data_size"] = info["offsets"][-1]
+            position = _align(position + info["data_size"])
+        header = {
+            "version": digest.hexdigest(),
+            "created": time.time(),
+            "source_versions": dict(connection.execute(versions_select(list(tables))).all()),
+            "tables": {name: {key: value for key, value in info.items() if key not in ("ids", "offsets")}
+                       for name, info in tables.items()},
+        }
+        encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(MAGIC + struct.pack("<I", len(encoded)) + encoded)
+                out.write(b"\0" * (_align(out.tell()) - out.tell()))
+                for info, data in zip(tables.values(), sections):
+                    _native(info["ids"]).tofile(out)
+                    _native(info["offsets"]).tofile(out)
+                    data.seek(0)
+                    while True:
+                        block = data.read(1 << 20)
+                        if not block:
+                            break
+                        out.write(block)
+                    out.write(b"\0" * (_align(info["data_size"]) - info["data_size"]))
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    finally:
+        for data in sections:
+            data.close()
+    return header
+
+
+class SnapshotTable:
+    """The rows of one table inside a mapped snapshot."""
+
+    def __init__(self, buffer, base, info):
+        self.name = info["model"]
+        self.columns = tuple(info["columns"])
+        self.rows = info["rows"]
+        self.ids = buffer[base + info["ids_at"]:base + info["ids_at"] + 8 * self.rows].cast("q")
+        self.offsets = buffer[base + info["offsets_at"]:base + info["offsets_at"] + 8 * (self.rows + 1)].cast("Q")
+        self.data = buffer[base + info["data_at"]:base + info["data_at"] + info["data_size"]]
+
+    def _rows_json(self, start, end):
+        # Rows are stored comma-terminated; drop the last comma
+        return bytes(self.data[self.offsets[start]:self.offsets[end] - 1]) if end > start else b""
+
+    def get(self, entity_id):
+        """The JSON bytes of one row, or None."""
+        index = bisect_left(self.ids, entity_id)
+        if index == self.rows or self.ids[index] != entity_id:
+            return None
+        return self._rows_json(index, index + 1)
+
+    def page(self, after_id, limit):
+        """``(JSON array bytes, cursor)``, like ``pagination.keyset_page``."""
+        start = bisect_right(self.ids, after_id) if after_id is not None else 0
+        end = min(start + limit, self.rows)
+        cursor = (self.ids[end - 1], None) if end < self.rows else None
+        return b"[" + self._rows_json(start, end) + b"]", cursor
+
+    def stream(self, chunk_size=STREAM_CHUNK_SIZE):
+        """The whole table as a JSON array, in chunks of ``chunk_size`` rows."""
+        yield b"["
+        for start in range(0, self.rows, chunk_size):
+            chunk = self._rows_json(start, min(start + chunk_size, self.rows))
+            yield chunk if start == 0 else b"," + chunk
+        yield b"]"
+
+
+class Snapshot:
+    """A snapshot file mapped read-only; pages are shared through the page cache."""
+
+    def __init__(self, path):
+        with open(path, "rb") as handle:
+            self.stat = os.fstat(handle.fileno())
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._map)
+        if bytes(buffer[:len(MAGIC)]) != MAGIC:
+            raise ValueError("%s is not a catalog snapshot (or was written by another format version)" % path)
+        (length,) = struct.unpack_from("<I", buffer, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(bytes(buffer[start:start + length]))
+        self.version = self.header["version"]
+        base = _align(start + length)
+        self.tables = {name: SnapshotTable(buffer, base, info) for name, info in self.header["tables"].items()}
+
+    def table(self, model):
+        """The snapshot of ``model``, or None if it is missing or its columns changed since the export."""
+        table = self.tables.get(model.__tablename__)
+        if table is None or table.columns != serializer_for(model).keys:
+            return None
+        return table
+
+
+class SnapshotLoader:
+    """Maps the snapshot at ``path`` and remaps it when the file is replaced."""
+
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self.snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = now
+                self._reload()
+            finally:
+                self._lock.release()
+        return self.snapshot
+
+    def _reload(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self.snapshot is not None:
+                log.warning("snapshot %s removed, serving from the database", self.path)
+            self.snapshot = None
+            return
+        current = self.snapshot
+        if current is not None and (current.stat.st_ino, current.stat.st_mtime_ns, current.stat.st_size) == (
+                stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            return
+        try:
+            snapshot = Snapshot(self.path)
+        except (OSError, ValueError, KeyError) as error:
+            log.warning("cannot map snapshot %s: %s", self.path, error)
+            return
+        # In-flight requests keep the old mapping alive until they finish
+        self.snapshot = snapshot
+        log.info("serving snapshot %s version %s", self.path, snapshot.version)
+
+
+def current_snapshot():
+    loader = current_app.extensions.get("snapshot")
+    return loader.current() if loader is not None else None
+
+
+def _snapshot_response(table, entity_id):
+    if entity_id is not None:
+        body = table.get(entity_id)
+        if body is None:
+            raise APIException("%s not found" % table.name, status_code=404)
+        return payload_response(Representations.from_json(body))
+    if wants_stream():
+        return chunked_response(table.stream(), "json")
+    after_id, _, limit = page_args()
+    body, cursor = table.page(after_id, limit)
+    return set_next_link(payload_response(Representations.from_json(body)), cursor, limit)
+
+
+def from_snapshot(model, id_arg=None, cache_control=DEFAULT_CACHE_CONTROL):
+    """Answer a catalog GET from the mapped snapshot when there is one.
+
+    Put it above ``read_only``/``conditional``: when the snapshot answers,
+    neither runs and the database is never touched. ``id_arg`` names the
+    view argument holding the primary key of detail routes.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            snapshot = current_snapshot()
+            table = snapshot.table(model) if snapshot is not None else None
+            if table is None or not SNAPSHOT_ARGS.issuperset(request.args):
+                return view(*args, **kwargs)
+            if wants_stream() and response_format() != "json":
+                return view(*args, **kwargs)
+            etag = hashlib.sha1("|".join((snapshot.version, request.full_path, representation_key(
+                response_format(), accepted_encoding()))).encode("utf-8")).hexdigest()
+            if etag in request.if_none_match:
+                response = current_app.response_class(status=304)
+            else:
+                response = _snapshot_response(table, kwargs.get(id_arg) if id_arg else None)
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+            response.headers["Cache-Control"] = cache_control_for(request.endpoint, cache_control)
+            response.headers["X-Snapshot-Version"] = snapshot.version
+            return response
+        return wrapper
+    return decorator
+
+
+def setup_snapshot(app):
+    """Serve the catalog from ``app.config["SNAPSHOT_PATH"]`` when it is set."""
+    path = app.config.get("SNAPSHOT_PATH")
+    if path:
+        app.extensions["snapshot"] = SnapshotLoader(
+            path, float(app.config.get("SNAPSHOT_CHECK_INTERVAL", 1)))
@@ -3,12 +3,13 @@ from flask import jsonify, url_for
 class APIException(Exception):
     status_code = 400
 
-    def __init__(self, message, status_code=None, payload=None):
+    def __init__(self, message, status_code=None, payload=None, headers=None):
         Exception.__init__(self)
         self.message = message
         if status_code is not None:
             self.status_code = status_code
         self.payload = payload
+        self.headers = headers
 
     def to_dict(self):
         rv = dict(self.payload or ())
@@ -21,7 +22,8 @@ def has_no_empty_params(rule):
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    # Flask-Admin is only registered for APP_ROLE admin/all
+    links = ['/admin/'] if 'admin' in app.blueprints else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters
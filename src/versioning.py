@@ -0,0 +1,129 @@
+"""
+Per-table version counters and conditional GET (ETag / If-None-Match).
+
+Every flush that adds, changes or deletes rows bumps the counter of the
+tables involved in ``collection_version`` inside the same transaction. That
+covers the API handlers and the Flask-Admin views, and keeps every worker in
+agreement. GET handlers decorated with ``conditional`` derive a strong ETag
+from those counters plus the request URL, so a matching ``If-None-Match``
+is answered with 304 after a single primary-key lookup, before the ORM or
+the serializer run.
+"""
+import hashlib
+from functools import wraps
+from flask import current_app, g, make_response, request
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+from models import db, CollectionVersion
+from negotiation import accepted_encoding, response_format
+
+DEFAULT_CACHE_CONTROL = "no-cache"
+
+_versions = CollectionVersion.__table__
+
+
+def bump(connection, tables):
+    """Increment the version of each table name in ``tables``."""
+    for name in tables:
+        result = connection.execute(
+            update(_versions).where(_versions.c.name == name).values(version=_versions.c.version + 1))
+        if result.rowcount == 0:
+            connection.execute(insert(_versions).values(name=name, version=1))
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_flushed_tables(session, flush_context):
+    tables = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__table__", None)
+        if table is not None and table is not _versions:
+            tables.add(table.name)
+    if tables:
+        bump(session.connection(), sorted(tables))
+
+
+def versions_select(tables):
+    return select(_versions.c.name, _versions.c.version).where(_versions.c.name.in_(tables))
+
+
+def versions_from_rows(tables, rows):
+    found = dict(rows)
+    return [(name, found.get(name, 0)) for name in tables]
+
+
+def current_versions(tables):
+    return versions_from_rows(tables, db.session.execute(versions_select(tables)).all())
+
+
+def make_etag(full_path, accept, versions):
+    parts = [full_path, accept]
+    parts.extend("%s=%d" % pair for pair in versions)
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def representation_key(fmt, encoding):
+    """The part of an ETag naming the representation served: format and content encoding.
+
+    Used by the Flask views, the snapshot and asgi.py alike, so a client
+    moved between stacks keeps getting 304s for the same bytes.
+    """
+    return "%s;%s" % (fmt, encoding or "identity")
+
+
+def table_version(name):
+    """Version of table ``name`` as read for this request's ETag (read now if it was not)."""
+    versions = g.get("table_versions") or {}
+    if name not in versions:
+        versions.update(current_versions([name]))
+        g.table_versions = versions
+    return versions[name]
+
+
+def compute_etag(tables):
+    versions = current_versions(tables)
+    # Kept for the view, so what it serves from a cache matches the ETag (table_version)
+    g.table_versions = dict(versions)
+    # A gzip body must not match a br one, nor NDJSON a JSON one
+    return make_etag(request.full_path, representation_key(response_format(), accepted_encoding()), versions)
+
+
+def cache_control_for(endpoint, default):
+    return current_app.config.get("CACHE_CONTROL", {}).get(endpoint, default)
+
+
+def conditional(*tables, cache_control=DEFAULT_CACHE_CONTROL, expand=None):
+    """Add a strong ETag to a GET view and answer If-None-Match with 304.
+
+    ``tables`` lists every table the response is built from; views that do
+    not read the database get an ETag hashed from their body instead.
+    ``expand`` maps ``?expand=`` names to the extra tables they read. The
+    Cache-Control header defaults to ``cache_control`` and can be overridden
+    per endpoint through ``app.config["CACHE_CONTROL"]``.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            names = tables
+            if expand:
+                names = tuple(dict.fromkeys(tables + tuple(
+                    table for name in request.args.get("expand", "").split(",")
+                    for table in expand.get(name.strip(), ()))))
+            etag = compute_etag(names) if names else None
+            header = cache_control_for(request.endpoint, cache_control)
+            if etag is not None and etag in request.if_none_match:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            if etag is not None and response.status_code in (200, 304):
+                response.set_etag(etag)
+            elif etag is None and response.status_code == 200:
+                digest = hashlib.sha1(response.get_data()).hexdigest()
+                response.set_etag("%s-%s" % (digest, accepted_encoding() or "identity"))
+                response.make_conditional(request)
+            response.headers["Cache-Control"] = header
+            return response
+        # Read by the route index (sitemap.py)
+        wrapper.conditional = {"tables": list(tables), "expand": sorted(expand or ()),
+                               "cache_control": cache_control}
+        return wrapper
+    return decorator
@@ -0,0 +1,327 @@
+"""
+Optional write-behind queue for the single favorite endpoints.
+
+With ``FAVORITES_WRITE_BEHIND`` set, ``POST /favorite/...`` validates the
+user and the planet/character, ``DELETE /favorite/...`` looks the favorite
+up, and both put the change in a journal and answer without committing.
+A background thread per worker flushes the journal every
+``WRITE_BEHIND_INTERVAL_MS`` (default 200) or as soon as
+``WRITE_BEHIND_BATCH`` (default 1000) changes are waiting. Each flush is one
+transaction per batch (see ``favorites.apply_pairs``).
+
+Changes are coalesced per (kind, user, item): only the last one counts, and
+when it leaves the pair as it was when it was first queued (add then
+delete, delete then add) nothing is written at all.
+
+Journals:
+
+    memory                     a list in the worker; lost if the worker dies
+    sqlite:////path/to/file    a local SQLite file (WAL) shared by the
+                               workers of the host; survives restarts
+
+Reads stay consistent: ``flush_pending`` applies the pending changes (of one
+user, or all of them) before ``/users/favorites/<id>``, ``/users?expand=``
+and the batch endpoint run, and pins that user's reads to the primary. With
+the memory journal that covers changes queued in the same worker; the
+SQLite journal covers every worker on the host. The counts behind
+``/planets/popular`` and ``/people/popular`` lag by at most one interval.
+"""
+import atexit
+import logging
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from flask import current_app, jsonify, request
+from sqlalchemy import select
+from models import db, User
+from favorites import FAVORITE_KINDS, apply_pairs
+from localsqlite import LocalSQLite
+from replicas import mark_write
+from utils import APIException
+
+log = logging.getLogger("starwars.writebehind")
+
+
+class MemoryJournal:
+    """Pending changes of this worker, in order."""
+
+    def __init__(self):
+        self._ops = []
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def append(self, kind, user_id, item_id, existed, present):
+        with self._lock:
+            self._seq += 1
+            self._ops.append((self._seq, kind, user_id, item_id, existed, present))
+
+    def last(self, kind, user_id, item_id):
+        """The pending state of a pair (True/False), or None when nothing is queued for it."""
+        with self._lock:
+            for _, op_kind, op_user, op_item, _, present in reversed(self._ops):
+                if (op_kind, op_user, op_item) == (kind, user_id, item_id):
+                    return present
+        return None
+
+    def __len__(self):
+        return len(self._ops)
+
+    def take(self, user_id=None, limit=None):
+        with self._lock:
+            ops = [op for op in self._ops if user_id is None or op[2] == user_id][:limit]
+        return ops
+
+    def ack(self, ops):
+        done = {op[0] for op in ops}
+        with self._lock:
+            self._ops = [op for op in self._ops if op[0] not in done]
+
+
+class SQLiteJournal:
+    """Pending changes in a local SQLite file, shared by the workers of one host."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS favorite_ops (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL, user_id INTEGER NOT NULL, item_id INTEGER NOT NULL,
+            existed INTEGER NOT NULL, present INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS ix_favorite_ops_pair ON favorite_ops (kind, user_id, item_id);
+        CREATE INDEX IF NOT EXISTS ix_favorite_ops_user ON favorite_ops (user_id);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = LocalSQLite(path).connection
+        self._connection().executescript(self.SCHEMA)
+
+    def append(self, kind, user_id, item_id, existed, present):
+        self._connection().execute(
+            "INSERT INTO favorite_ops (kind, user_id, item_id, existed, present) VALUES (?, ?, ?, ?, ?)",
+            (kind, user_id, item_id, int(existed), int(present)))
+
+    def last(self, kind, user_id, item_id):
+        row = self._connection().execute(
+            "SELECT present FROM favorite_ops WHERE kind = ? AND user_id = ? AND item_id = ? "
+            "ORDER BY seq DESC LIMIT 1", (kind, user_id, item_id)).fetchone()
+        return bool(row[0]) if row is not None else None
+
+    def __len__(self):
+        return self._connection().execute("SELECT count(*) FROM favorite_ops").fetchone()[0]
+
+    def take(self, user_id=None, limit=None):
+        sql = "SELECT seq, kind, user_id, item_id, existed, present FROM favorite_ops"
+        params = []
+        if user_id is not None:
+            sql += " WHERE user_id = ?"
+            params.append(user_id)
+        sql += " ORDER BY seq LIMIT ?"
+        params.append(-1 if limit is None else limit)
+        return [(seq, kind, user, item, bool(existed), bool(present))
+                for seq, kind, user, item, existed, present in self._connection().execute(sql, params)]
+
+    def ack(self, ops):
+        connection = self._connection()
+        connection.executemany("DELETE FROM favorite_ops WHERE seq = ?", [(op[0],) for op in ops])
+
+    @contextmanager
+    def flush_lock(self):
+        """Serializes flushes across the workers of the host (``BEGIN IMMEDIATE``)."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+def coalesce(ops):
+    """``{kind: (added pairs, removed pairs)}`` and the number of cancelled pairs from ``ops`` in order."""
+    final = {}
+    for _, kind, user_id, item_id, existed, present in ops:
+        key = (kind, user_id, item_id)
+        first = final.get(key)
+        final[key] = (first[0] if first is not None else existed, present)
+    changes = {kind: ([], []) for kind in FAVORITE_KINDS}
+    cancelled = 0
+    for (kind, user_id, item_id), (existed, present) in final.items():
+        if existed == present:
+            cancelled += 1
+            continue
+        changes[kind][0 if present else 1].append((user_id, item_id))
+    return changes, cancelled
+
+
+class WriteBehind:
+    def __init__(self, app, journal, interval, batch_size):
+        self.app = app
+        self.journal = journal
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.flushed = 0
+        self.cancelled = 0
+        self.failures = 0
+
+    def enqueue(self, kind, user_id, item_id, existed, present):
+        self.journal.append(kind, user_id, item_id, existed, present)
+        self._ensure_thread()
+        if len(self.journal) >= self.batch_size:
+            self._wake.set()
+
+    def state(self, kind, user_id, item_id, existed):
+        """Whether the pair is a favorite once the queued changes are applied."""
+        pending = self.journal.last(kind, user_id, item_id)
+        return existed if pending is None else pending
+
+    def flush(self, user_id=None):
+        """Apply the pending changes (of ``user_id`` only, if given) and commit; returns how many."""
+        applied = 0
+        with self._lock:
+            while True:
+                lock = getattr(self.journal, "flush_lock", None)
+                with lock() if lock is not None else nullcontext():
+                    ops = self.journal.take(user_id, self.batch_size)
+                    if not ops:
+                        return applied
+                    changes, cancelled = coalesce(ops)
+                    try:
+                        for kind, (added, removed) in changes.items():
+                            apply_pairs(kind, added, removed)
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        self.failures += 1
+                        raise
+                    self.journal.ack(ops)
+                applied += len(ops)
+                self.flushed += len(ops)
+                self.cancelled += cancelled
+
+    def _ensure_thread(self):
+        # Started lazily so that each forked gunicorn worker gets its own
+        if self._thread is None or self._pid != os.getpid():
+            with self._start_lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    self._thread = threading.Thread(target=self._run, name="favorites-write-behind", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush_in_background()
+
+    def flush_in_background(self):
+        try:
+            with self.app.app_context():
+                self.flush()
+        except Exception:
+            log.exception("write-behind flush failed, retrying in %.1fs", self.interval)
+
+    def stats(self):
+        return {"pending": len(self.journal), "flushed": self.flushed, "cancelled": self.cancelled,
+                "failures": self.failures}
+
+
+def write_behind_gauges():
+    """Gauges for ``/metrics`` (empty when write-behind is off)."""
+    writer = _write_behind()
+    if writer is None:
+        return []
+    stats = writer.stats()
+    return [("favorites_write_behind_%s" % name, help_text, [({}, stats[name])])
+            for name, help_text in (("pending", "Favorite changes waiting in the journal"),
+                                    ("flushed", "Favorite changes flushed by this worker"),
+                                    ("cancelled", "Favorite changes that cancelled out"),
+                                    ("failures", "Failed write-behind flushes"))]
+
+
+def _write_behind():
+    return current_app.extensions.get("write_behind")
+
+
+def write_behind_enabled():
+    return _write_behind() is not None
+
+
+def _in_database(kind, user_id, item_id):
+    _, fav_model, fk = FAVORITE_KINDS[kind]
+    return db.session.execute(select(fav_model.id).where(
+        fav_model.user_id == user_id, getattr(fav_model, fk) == item_id).limit(1)).first() is not None
+
+
+def queue_add(user_id, kind, item_id):
+    """Validate and queue a new favorite; the response mirrors the synchronous endpoint."""
+    model = FAVORITE_KINDS[kind][0]
+    if user_id is None or db.session.get(User, user_id) is None:
+        raise APIException("User not found", status_code=404)
+    if db.session.get(model, item_id) is None:
+        raise APIException("%s not found" % model.__name__, status_code=404)
+    existed = _in_database(kind, user_id, item_id)
+    writer = _write_behind()
+    if writer.state(kind, user_id, item_id, existed):
+        return jsonify({"status": "exists"}), 200
+    writer.enqueue(kind, user_id, item_id, existed, True)
+    mark_write(user_id)
+    return jsonify({"status": "queued"}), 202
+
+
+def queue_remove(user_id, kind, item_id):
+    """Queue the removal of a favorite; 404 when it is already gone once the queue is applied."""
+    existed = _in_database(kind, user_id, item_id)
+    writer = _write_behind()
+    if not writer.state(kind, user_id, item_id, existed):
+        raise APIException("Favorite not found", status_code=404)
+    writer.enqueue(kind, user_id, item_id, existed, False)
+    mark_write(user_id)
+    return jsonify({}), 202
+
+
+def flush_pending(user_arg=None, expand=None):
+    """Apply queued favorite changes before the view runs (all of them without ``user_arg``).
+
+    With ``expand`` only requests asking for ``?expand=<expand>`` flush. Goes
+    above ``read_only``/``conditional`` so the ETag and the replica choice
+    already see the flushed rows.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            writer = _write_behind()
+            wanted = expand is None or expand in (name.strip() for name in request.args.get("expand", "").split(","))
+            if writer is not None and wanted:
+                user_id = kwargs.get(user_arg) if user_arg else None
+                if writer.flush(user_id):
+                    mark_write(user_id)
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def journal_from_url(url):
+    if url == "memory":
+        return MemoryJournal()
+    if url.startswith("sqlite:///"):
+        return SQLiteJournal(url[len("sqlite:///"):])
+    raise ValueError("FAVORITES_WRITE_BEHIND must be 'memory' or sqlite:///<path>, not %r" % url)
+
+
+def setup_write_behind(app):
+    """Enable write-behind when ``FAVORITES_WRITE_BEHIND`` is set."""
+    url = os.environ.get("FAVORITES_WRITE_BEHIND", "")
+    if not url:
+        return
+    writer = app.extensions["write_behind"] = WriteBehind(
+        app, journal_from_url(url),
+        interval=int(os.environ.get("WRITE_BEHIND_INTERVAL_MS", 200)) / 1000.0,
+        batch_size=int(os.environ.get("WRITE_BEHIND_BATCH", 1000)))
+    # Last chance for the memory journal on a clean shutdown
+    atexit.register(writer.flush_in_background)
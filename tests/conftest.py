@@ -0,0 +1,42 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+sys.path.insert(0, SRC)
+
+# The app reads its configuration at import time
+_handle, DATABASE_PATH = tempfile.mkstemp(suffix=".db", prefix="starwars-tests-")
+os.close(_handle)
+os.environ.update({
+    "DATABASE_URL": "sqlite:///" + DATABASE_PATH,
+    "DATABASE_REPLICA_URLS": "",
+    "APP_ROLE": "api",
+    "SNAPSHOT_PATH": "",
+    "RATELIMIT_RATE": "",
+    "FAVORITES_WRITE_BEHIND": "",
+    "PROFILING": "",
+})
+
+
+@pytest.fixture()
+def app():
+    from app import app as flask_app
+    from cache import _caches
+    from models import db
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    # Versions restart with the schema: entries of an earlier test could match them
+    for cache in _caches.values():
+        cache.clear()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
@@ -0,0 +1,31 @@
+from sqlalchemy import select
+
+from models import db, User
+from passwords import verify_password
+
+
+def test_create_user_hashes_the_password(app, client, monkeypatch):
+    monkeypatch.setenv("PASSWORD_HASH_COST", "10")
+    response = client.post("/create/user", json={"name": "Leia", "email": "Leia@Example.com",
+                                                 "password": "alderaan1"})
+    assert response.status_code == 201
+    with app.app_context():
+        user = db.session.execute(select(User).where(User.email == "leia@example.com")).scalar_one()
+        assert user.is_active
+        assert user.password != "alderaan1"
+        assert verify_password("alderaan1", user.password)
+
+
+def test_create_user_rejects_an_existing_email_in_any_case(app, client):
+    with app.app_context():
+        # Stored before emails were lowercased
+        db.session.add(User(name="Han", email="Han@Example.com", password="x", is_active=True))
+        db.session.commit()
+    response = client.post("/create/user", json={"name": "Han", "email": "han@example.com",
+                                                 "password": "falcon123"})
+    assert response.status_code == 409
+
+
+def test_create_user_validates_the_body(client):
+    assert client.post("/create/user", json={"name": "Luke", "email": "luke", "password": "x"}).status_code == 400
+    assert client.post("/create/user", data="not json").status_code == 400
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+import cache as cache_module
+from cache import LRUTTLCache, cache_for
+from models import db, Planets
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_lru_eviction():
+    cache = LRUTTLCache("test", maxsize=2)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"  # 2 is now the least recently used
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert (cache.get(1), cache.get(3)) == ("a", "c")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(clock):
+    cache = LRUTTLCache("test", ttl=10)
+    cache.set(1, "a")
+    clock[0] += 9
+    assert cache.get(1) == "a"
+    clock[0] += 2
+    assert cache.get(1) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_version_mismatch_is_a_miss():
+    cache = LRUTTLCache("test")
+    cache.set(1, "a", version=3)
+    assert cache.get(1, version=3) == "a"
+    assert cache.get(1, version=4) is None
+    assert cache.get(1, version=3) is None
+
+
+def test_single_flight():
+    cache = LRUTTLCache("test")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "row"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_load(1, load)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_load(1, load))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    while cache.stats()["coalesced"] < 4:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert results == ["row"] * 5
+    assert len(calls) == 1
+    assert cache.get(1) == "row"
+
+
+def test_invalidation_while_loading_is_not_cached():
+    cache = LRUTTLCache("test")
+
+    def load():
+        cache.invalidate(1)
+        return "stale"
+
+    assert cache.get_or_load(1, load) == "stale"
+    assert cache.get(1) is None
+
+
+@pytest.fixture()
+def planet(app):
+    with app.app_context():
+        db.session.add(Planets(name="Tatooine", populations="1000", rotation_period="24", orbital_period="300",
+                               diameter="1000", gravity="1 standard", terrain="desert", surface_water="1",
+                               climate="arid"))
+        db.session.commit()
+
+
+def test_orm_update_invalidates(app, client, planet):
+    assert client.get("/planets/1").get_json()["name"] == "Tatooine"
+    assert cache_for(Planets).stats()["size"] == 1
+    with app.app_context():
+        db.session.get(Planets, 1).name = "Tatooine II"
+        db.session.commit()
+    assert cache_for(Planets).stats()["size"] == 0
+    assert client.get("/planets/1").get_json()["name"] == "Tatooine II"
+
+
+def test_orm_delete_invalidates(app, client, planet):
+    assert client.get("/planets/1").status_code == 200
+    assert cache_for(Planets).stats()["size"] == 1
+    with app.app_context():
+        db.session.delete(db.session.get(Planets, 1))
+        db.session.commit()
+    assert cache_for(Planets).stats()["size"] == 0
+    assert client.get("/planets/1").status_code == 404
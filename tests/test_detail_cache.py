@@ -0,0 +1,50 @@
+from sqlalchemy import update
+
+from models import db, Planets
+from versioning import bump
+
+
+def planet(**overrides):
+    fields = dict(name="Tatooine", populations="200000", rotation_period="23", orbital_period="304",
+                  diameter="10465", gravity="1 standard", terrain="desert", surface_water="1", climate="arid")
+    fields.update(overrides)
+    return Planets(**fields)
+
+
+def external_write(app, **values):
+    # Core statements on their own connection: no mapper events, as from another worker or process
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(update(Planets.__table__).where(Planets.__table__.c.id == 1).values(**values))
+            bump(connection, ["planets"])
+
+
+def test_write_from_another_worker_reaches_the_cache(app, client):
+    with app.app_context():
+        db.session.add(planet())
+        db.session.commit()
+    first = client.get("/planets/1")
+    assert first.get_json()["name"] == "Tatooine"
+    assert client.get("/planets/1", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+    external_write(app, name="Tatooine II")
+    response = client.get("/planets/1")
+    assert response.headers["ETag"] != first.headers["ETag"]
+    assert response.get_json()["name"] == "Tatooine II"
+    # The new ETag revalidates the new body, not the one cached before the write
+    revalidated = client.get("/planets/1", headers={"If-None-Match": response.headers["ETag"]})
+    assert revalidated.status_code == 304
+    assert client.get("/planets/1").get_json()["name"] == "Tatooine II"
+
+
+def test_cached_body_is_reused_while_the_version_holds(app, client):
+    from cache import cache_for
+    with app.app_context():
+        db.session.add(planet())
+        db.session.commit()
+    cache = cache_for(Planets)
+    cache.clear()
+    hits = cache.hits
+    assert client.get("/planets/1").status_code == 200
+    assert client.get("/planets/1").status_code == 200
+    assert cache.hits == hits + 1
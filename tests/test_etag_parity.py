@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from models import db, User, Planets, Characters, FavPlanets
+
+pytest.importorskip("aiosqlite")
+
+
+def call_asgi(path, headers):
+    from asgi import app as asgi_app
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query.encode(),
+             "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]}
+    response = {"body": b""}
+
+    async def receive():
+        return {"type": "http.request"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode(): v.decode() for k, v in message["headers"]}
+        else:
+            response["body"] += message.get("body", b"")
+
+    asyncio.run(asgi_app(scope, receive, send))
+    return response
+
+
+@pytest.fixture()
+def catalog(app):
+    with app.app_context():
+        for i in range(1, 61):
+            db.session.add(Planets(name="planet %d" % i, populations="1000", rotation_period="24",
+                                   orbital_period="300", diameter="1000", gravity="1 standard",
+                                   terrain="desert", surface_water="1", climate="arid"))
+            db.session.add(Characters(full_name="character %d" % i, birth_year="19BBY", species="human",
+                                      height="170", mass="70", gender="n/a", hair_color="brown",
+                                      skin_color="fair", homeworld="planet 1"))
+        db.session.add(User(name="user", email="user@example.com", password="x", is_active=True))
+        db.session.flush()
+        db.session.add(FavPlanets(user_id=1, planets_id=1))
+        db.session.commit()
+
+
+@pytest.mark.parametrize("path", ["/people?limit=50", "/people/3", "/planets?limit=50", "/users/favorites/1",
+                                  "/people?stream=1"])
+@pytest.mark.parametrize("headers", [{}, {"Accept-Encoding": "gzip"}])
+def test_flask_and_asgi_serve_the_same_representation(client, catalog, path, headers):
+    flask_response = client.get(path, headers=headers)
+    asgi_response = call_asgi(path, headers)
+    assert flask_response.status_code == asgi_response["status"] == 200
+    assert flask_response.headers["ETag"] == asgi_response["headers"]["etag"]
+    assert flask_response.headers.get("Content-Encoding") == asgi_response["headers"].get("content-encoding")
+    assert flask_response.get_data() == asgi_response["body"]
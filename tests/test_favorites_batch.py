@@ -0,0 +1,40 @@
+import pytest
+
+import favorites as favorites_module
+from models import db, User, Planets, FavPlanets
+
+
+@pytest.fixture()
+def planets(app):
+    with app.app_context():
+        for name in ("Tatooine", "Hoth", "Dagobah"):
+            db.session.add(Planets(name=name, populations="1000", rotation_period="23", orbital_period="304",
+                                   diameter="10465", gravity="1 standard", terrain="desert", surface_water="1",
+                                   climate="arid"))
+        db.session.add(User(name="Luke", email="luke@example.com", password="x", is_active=True))
+        db.session.flush()
+        db.session.add(FavPlanets(user_id=1, planets_id=1))
+        db.session.commit()
+
+
+def counts(app):
+    with app.app_context():
+        return {planet.id: planet.favorite_count for planet in db.session.query(Planets).order_by(Planets.id)}
+
+
+def test_batch_add_statuses(app, client, planets):
+    response = client.post("/users/1/favorites:batch", json={"planets": [1, 2, 99]})
+    assert response.status_code == 200
+    assert response.get_json()["planets"] == [
+        {"id": 1, "status": "exists"}, {"id": 2, "status": "created"}, {"id": 99, "status": "not_found"}]
+    assert counts(app) == {1: 1, 2: 1, 3: 0}
+
+
+def test_batch_add_lost_race(app, client, planets, monkeypatch):
+    # Planet 1 is inserted by a concurrent request after this one checked for existing favorites
+    existing = favorites_module._existing
+    monkeypatch.setattr(favorites_module, "_existing",
+                        lambda column, ids, *criteria: set() if criteria else existing(column, ids))
+    response = client.post("/users/1/favorites:batch", json={"planets": [1, 2]})
+    assert response.get_json()["planets"] == [{"id": 1, "status": "exists"}, {"id": 2, "status": "created"}]
+    assert counts(app) == {1: 1, 2: 1, 3: 0}
@@ -0,0 +1,32 @@
+import pytest
+
+from models import db, User, Planets, Characters, FavPlanets, FavCharacters
+
+
+@pytest.fixture()
+def favorites(app):
+    with app.app_context():
+        db.session.add(Planets(name="Tatooine", populations="200000", rotation_period="23", orbital_period="304",
+                               diameter="10465", gravity="1 standard", terrain="desert", surface_water="1",
+                               climate="arid"))
+        db.session.add(Characters(full_name="Luke Skywalker", birth_year="19BBY", species="human", height="172",
+                                  mass="77", gender="male", hair_color="blond", skin_color="fair",
+                                  homeworld="Tatooine"))
+        db.session.add(User(name="Luke", email="luke@example.com", password="x", is_active=True))
+        db.session.flush()
+        db.session.add(FavPlanets(user_id=1, planets_id=1))
+        db.session.add(FavCharacters(user_id=1, characters_id=1))
+        db.session.commit()
+
+
+@pytest.mark.parametrize("kind", ["planet", "people"])
+def test_delete_favorite(client, favorites, kind):
+    assert client.delete("/favorite/%s/1" % kind).status_code == 200
+    response = client.delete("/favorite/%s/1" % kind)
+    assert response.status_code == 404
+    assert response.get_json() == {"message": "Favorite not found"}
+
+
+@pytest.mark.parametrize("kind", ["planet", "people"])
+def test_delete_missing_favorite(client, kind):
+    assert client.delete("/favorite/%s/999" % kind).status_code == 404
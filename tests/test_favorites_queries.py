@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db, User, Planets, Characters, FavPlanets, FavCharacters
+
+
+@contextmanager
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def seed(favorites_per_user=(0, 5, 50)):
+    items = max(favorites_per_user)
+    for i in range(1, items + 1):
+        db.session.add(Planets(name="planet %d" % i, populations="1000", rotation_period="24",
+                               orbital_period="300", diameter="1000", gravity="1 standard", terrain="desert",
+                               surface_water="1", climate="arid"))
+        db.session.add(Characters(full_name="character %d" % i, birth_year="19BBY", species="human",
+                                  height="170", mass="70", gender="n/a", hair_color="brown", skin_color="fair",
+                                  homeworld="planet 1"))
+    users = []
+    for count in favorites_per_user:
+        user = User(name="user %d" % count, email="user%d@example.com" % count, password="x", is_active=True)
+        db.session.add(user)
+        db.session.flush()
+        for item_id in range(1, count + 1):
+            db.session.add(FavPlanets(user_id=user.id, planets_id=item_id))
+            db.session.add(FavCharacters(user_id=user.id, characters_id=item_id))
+        users.append((count, user.id))
+    db.session.commit()
+    return users
+
+
+def test_user_favorites_query_count_is_constant(app, client):
+    with app.app_context():
+        users = seed()
+        engine = db.engine
+    counts = {}
+    for favorites, user_id in users:
+        with count_statements(engine) as statements:
+            response = client.get("/users/favorites/%d" % user_id)
+        assert response.status_code == 200
+        assert len(response.get_json()["planets"]) == favorites
+        assert len(response.get_json()["characters"]) == favorites
+        counts[favorites] = len(statements)
+    assert counts[0] == counts[5] == counts[50], counts
+
+
+def test_user_favorites_missing_user(app, client):
+    assert client.get("/users/favorites/999").status_code == 404
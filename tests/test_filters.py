@@ -0,0 +1,48 @@
+import pytest
+
+from models import db, Planets
+
+
+@pytest.fixture()
+def planets(app):
+    with app.app_context():
+        for name, terrain, climate in (("Hoth", "tundra, ice caves, mountain ranges", "frozen"),
+                                       ("Tatooine", "desert", "arid"),
+                                       ("Ilum", "ice, rock", "frozen"),
+                                       ("Naboo", "grassy hills, swamps, forests, mountains", "temperate"),
+                                       ("Rodia", "jungles, forests", "hot, tropical")):
+            db.session.add(Planets(name=name, populations="1000", rotation_period="24", orbital_period="300",
+                                   diameter="1000", gravity="1 standard", terrain=terrain, surface_water="1",
+                                   climate=climate))
+        db.session.commit()
+
+
+def names(client, query):
+    response = client.get("/planets?" + query)
+    assert response.status_code == 200
+    return sorted(planet["name"] for planet in response.get_json())
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("terrain=ice", ["Ilum"]),
+    ("terrain=rock", ["Ilum"]),
+    ("terrain=forests", ["Naboo", "Rodia"]),
+    ("terrain=ice caves", ["Hoth"]),
+    ("terrain=Grassy Hills", ["Naboo"]),
+    ("terrain=ice,desert", ["Ilum", "Tatooine"]),
+    ("terrain=ice, rock", ["Ilum"]),
+    ("terrain=mountain", []),
+    ("terrain=%25", []),
+    ("climate=tropical", ["Rodia"]),
+    ("climate=frozen&terrain=rock", ["Ilum"]),
+])
+def test_list_filters_match_elements(client, planets, query, expected):
+    assert names(client, query) == expected
+
+
+def test_shadow_columns_follow_orm_writes(app, planets):
+    with app.app_context():
+        planet = db.session.execute(db.select(Planets).filter_by(name="Ilum")).scalar_one()
+        planet.populations = "1,358"
+        db.session.commit()
+        assert db.session.get(Planets, planet.id).population_num == 1358
@@ -0,0 +1,26 @@
+import time
+
+import pytest
+from flask import g
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from models import db
+
+
+def test_failed_statements_leave_nothing_on_the_pooled_connection(app):
+    with app.test_request_context("/"):
+        app.preprocess_request()
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                db.session.execute(text("SELECT * FROM no_such_table"))
+            db.session.rollback()
+        time.sleep(0.05)
+        started = time.perf_counter()
+        db.session.execute(text("SELECT 1"))
+        elapsed = time.perf_counter() - started
+        # Only the successful statement is counted, timed from its own start
+        assert g.sql_count == 1
+        assert 0 <= g.sql_seconds <= elapsed
+        # The pooled connection outlives the request: per-statement state must not pile up on it
+        assert not db.session.connection().info.get("query_started")
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from models import db, Characters
+
+HEIGHTS = ["170", "170", "unknown", "180", "170", "165", "unknown", "180", "170", "200", "165"]
+
+
+@pytest.fixture()
+def characters(app):
+    with app.app_context():
+        for i, height in enumerate(HEIGHTS, 1):
+            db.session.add(Characters(full_name="character %d" % i, birth_year="19BBY", species="human",
+                                      height=height, mass="70", gender="n/a", hair_color="brown",
+                                      skin_color="fair", homeworld="Tatooine"))
+        db.session.commit()
+
+
+def expected_order(descending):
+    known = [(float(h), i) for i, h in enumerate(HEIGHTS, 1) if h != "unknown"]
+    known.sort(key=lambda pair: (-pair[0] if descending else pair[0], pair[1]))
+    return [i for _, i in known] + [i for i, h in enumerate(HEIGHTS, 1) if h == "unknown"]
+
+
+def walk(client, url):
+    """Ids of every page following the Link headers, and the number of pages."""
+    ids, pages = [], 0
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages += 1
+        page = [item["id"] for item in response.get_json()]
+        ids += page
+        url = response.headers.get("Link", "").partition("<")[2].partition(">")[0]
+        assert ("X-Next-Cursor" in response.headers) == bool(url)
+        if url:
+            assert response.headers["X-Next-Cursor"] == str(page[-1])
+    return ids, pages
+
+
+@pytest.mark.parametrize("sort, descending", [("height", False), ("-height", True)])
+@pytest.mark.parametrize("limit", [1, 2, 3, 4])
+def test_sorted_pages_with_ties(client, characters, sort, descending, limit):
+    ids, pages = walk(client, "/people?sort=%s&limit=%d" % (sort, limit))
+    assert ids == expected_order(descending)
+    assert pages == -(-len(HEIGHTS) // limit)
+
+
+def test_id_pages(client, characters):
+    ids, pages = walk(client, "/people?limit=4")
+    assert ids == list(range(1, len(HEIGHTS) + 1))
+    assert pages == 3
+
+
+def test_last_page_has_no_next_link(client, characters):
+    # Exactly one full page left: no empty page after it
+    response = client.get("/people?after_id=%d&limit=3" % (len(HEIGHTS) - 3))
+    assert len(response.get_json()) == 3
+    assert "Link" not in response.headers
+    assert "X-Next-Cursor" not in response.headers
+
+
+@pytest.mark.parametrize("query", ["stream=1", "stream=1&sort=-height", "stream=1&height_gt=1000",
+                                   "stream=1&fields=id,full_name"])
+def test_stream_is_valid_json(client, characters, query):
+    response = client.get("/people?" + query)
+    assert response.status_code == 200
+    assert response.is_streamed
+    items = json.loads(response.get_data())
+    if "height_gt" in query:
+        assert items == []
+    else:
+        assert len(items) == len(HEIGHTS)
+        if "sort" in query:
+            assert [item["id"] for item in items] == expected_order(True)
+        if "fields" in query:
+            assert set(items[0]) == {"id", "full_name"}
+
+
+def test_stream_spans_several_chunks(app, client):
+    from pagination import STREAM_CHUNK_SIZE
+    rows = STREAM_CHUNK_SIZE * 2 + 7
+    with app.app_context():
+        db.session.execute(db.insert(Characters), [
+            dict(full_name="character %d" % i, birth_year="19BBY", species="human", height="170", mass="70",
+                 gender="n/a", hair_color="brown", skin_color="fair", homeworld="Tatooine")
+            for i in range(rows)])
+        db.session.commit()
+    items = json.loads(client.get("/people?stream=1").get_data())
+    assert [item["id"] for item in items] == list(range(1, rows + 1))
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+import passwords
+from passwords import HashPool, hash_password, verify_password
+from utils import APIException
+
+
+@pytest.fixture()
+def slow_hash(monkeypatch):
+    """hash_password blocks until the returned event is set; requests wait at most 50 ms."""
+    gate = threading.Event()
+
+    def slow(password, scheme=None, cost=None):
+        gate.wait(5)
+        return "hashed-" + password
+
+    monkeypatch.setattr(passwords, "hash_password", slow)
+    monkeypatch.setattr(passwords, "HASH_TIMEOUT", 0.05)
+    yield gate
+    gate.set()
+
+
+def hash_when_free(pool, password, attempts=100):
+    for _ in range(attempts):
+        try:
+            return pool.hash(password)
+        except APIException:
+            time.sleep(0.01)
+    raise AssertionError("the pool never freed its slot")
+
+
+def test_scrypt_round_trip():
+    encoded = hash_password("alderaan1", "scrypt", 10)
+    assert encoded.startswith("scrypt$10$")
+    assert verify_password("alderaan1", encoded)
+    assert not verify_password("alderaan2", encoded)
+    # Plain text values stored before hashing existed
+    assert verify_password("legacy", "legacy")
+
+
+def test_timeout_is_a_503(slow_hash):
+    pool = HashPool(workers=1, queue=0)
+    with pytest.raises(APIException) as error:
+        pool.hash("alderaan1")
+    assert error.value.status_code == 503
+    assert error.value.headers == {"Retry-After": "1"}
+
+
+def test_slot_is_held_until_the_hash_finishes(slow_hash):
+    pool = HashPool(workers=1, queue=0)
+    with pytest.raises(APIException):
+        pool.hash("first")
+    # The first hash still runs: its slot is not free for another one
+    with pytest.raises(APIException) as error:
+        pool.hash("second")
+    assert "Too many" in error.value.message
+    slow_hash.set()
+    assert hash_when_free(pool, "third") == "hashed-third"
+
+
+def test_timed_out_hash_still_queued_is_cancelled(slow_hash):
+    pool = HashPool(workers=1, queue=1)
+    with pytest.raises(APIException):
+        pool.hash("running")
+    with pytest.raises(APIException):
+        pool.hash("queued")
+    # The queued hash never started: its slot is free again, the running one's is not
+    with pytest.raises(APIException) as error:
+        pool.hash("third")
+    assert "overloaded" in error.value.message
+    with pytest.raises(APIException) as error:
+        pool.hash("fourth")
+    assert "overloaded" in error.value.message
+
+
+def test_registration_gets_503_with_retry_after(client, monkeypatch, slow_hash):
+    monkeypatch.setattr(passwords, "_pool", HashPool(workers=1, queue=0))
+    response = client.post("/create/user", json={"name": "Leia", "email": "leia@example.com",
+                                                 "password": "alderaan1"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+import localsqlite
+from localsqlite import LocalSQLite
+from profiling import MemoryStore, RequestProfiler, SQLiteStore
+
+
+@pytest.mark.parametrize("token, headers, without_token, expected", [
+    (None, {}, False, False),
+    (None, {"X-Profile": "1"}, False, False),
+    (None, {"X-Profile": "1"}, True, True),
+    ("secret", {"X-Profile": "1"}, True, False),
+    ("secret", {"X-Profile": "1", "X-Internal-Token": "wrong"}, False, False),
+    ("secret", {"X-Profile": "1", "X-Internal-Token": "secret"}, False, True),
+    ("secret", {"X-Profile": "0", "X-Internal-Token": "secret"}, False, False),
+])
+def test_profile_header_needs_the_token(app, monkeypatch, token, headers, without_token, expected):
+    if token is None:
+        monkeypatch.delenv("INTERNAL_TOKEN", raising=False)
+    else:
+        monkeypatch.setenv("INTERNAL_TOKEN", token)
+    profiler = RequestProfiler(MemoryStore(10), sample_rate=0, explain_ms=10, header_without_token=without_token)
+    with app.test_request_context("/people", headers=headers):
+        assert profiler.wanted() is expected
+
+
+def test_sqlite_store_is_shared_by_threads(tmp_path):
+    store = SQLiteStore(str(tmp_path / "profiles.db"), size=3)
+    threads = [threading.Thread(target=store.add, args=({"id": "p%d" % i, "n": i},)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(store.recent()) == 3
+    # Another store on the same file (another worker) sees them
+    other = SQLiteStore(str(tmp_path / "profiles.db"), size=3)
+    assert [profile["id"] for profile in other.recent()] == [profile["id"] for profile in store.recent()]
+
+
+def test_local_sqlite_connection_per_thread_and_process(tmp_path, monkeypatch):
+    local = LocalSQLite(str(tmp_path / "local.db"))
+    connection = local.connection()
+    assert local.connection() is connection
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    other = []
+    thread = threading.Thread(target=lambda: other.append(local.connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not connection
+    # A forked worker never reuses its parent's connection
+    pid = localsqlite.os.getpid()
+    monkeypatch.setattr(localsqlite.os, "getpid", lambda: pid + 1)
+    assert local.connection() is not connection
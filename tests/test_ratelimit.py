@@ -0,0 +1,92 @@
+import pytest
+from flask import Flask, jsonify
+
+import ratelimit
+from ratelimit import MemoryBackend, setup_rate_limit
+from utils import APIException
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture()
+def limited(monkeypatch, clock):
+    """A small app with the limiter installed: 1 token/s, bursts of 2, /free exempt."""
+    monkeypatch.setenv("RATELIMIT_RATE", "1")
+    monkeypatch.setenv("RATELIMIT_BURST", "2")
+    monkeypatch.delenv("RATELIMIT_STORAGE_URL", raising=False)
+    app = Flask(__name__)
+    app.config["RATELIMITS"] = {"free": None, "strict": (0.5, 1)}
+
+    @app.errorhandler(APIException)
+    def handle_invalid_usage(error):
+        return jsonify(error.to_dict()), error.status_code, error.headers or {}
+
+    for name in ("limited", "free", "strict"):
+        app.add_url_rule("/" + name, name, lambda: jsonify({}))
+    setup_rate_limit(app)
+    return app.test_client()
+
+
+def test_bucket_refills(clock):
+    backend = MemoryBackend()
+    assert backend.take("k", 1, 2)[:2] == (True, 1)
+    assert backend.take("k", 1, 2)[:2] == (True, 0)
+    assert backend.take("k", 1, 2) == (False, 0, 1.0)
+    clock[0] += 0.5
+    assert backend.take("k", 1, 2) == (False, 0.5, 0.5)
+    clock[0] += 0.5
+    assert backend.take("k", 1, 2)[0]
+
+
+def test_least_recently_used_buckets_are_dropped(clock):
+    backend = MemoryBackend(max_keys=2)
+    for key in ("a", "b", "a", "c"):
+        backend.take(key, 1, 1)
+    # "b" was evicted and starts again with a full bucket; "a" was not
+    assert not backend.take("a", 1, 1)[0]
+    assert backend.take("b", 1, 1)[0]
+
+
+def test_429_with_retry_after(limited, clock):
+    first = limited.get("/limited")
+    assert first.status_code == 200
+    assert (first.headers["X-RateLimit-Limit"], first.headers["X-RateLimit-Remaining"]) == ("2", "1")
+    assert limited.get("/limited").headers["X-RateLimit-Remaining"] == "0"
+    response = limited.get("/limited")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert response.get_json()["retry_after"] == 1
+    clock[0] += 1
+    assert limited.get("/limited").status_code == 200
+
+
+def test_per_endpoint_limits(limited, clock):
+    for _ in range(5):
+        assert limited.get("/free").status_code == 200
+    assert "X-RateLimit-Limit" not in limited.get("/free").headers
+    assert limited.get("/strict").status_code == 200
+    response = limited.get("/strict")
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "2"
+    # Buckets are per endpoint: /limited still has its own
+    assert limited.get("/limited").status_code == 200
+
+
+def test_buckets_are_per_client(limited):
+    for _ in range(2):
+        limited.get("/limited")
+    assert limited.get("/limited").status_code == 429
+    assert limited.get("/limited", environ_base={"REMOTE_ADDR": "10.0.0.2"}).status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/cache/stats", "/internal/pool", "/metrics"])
+def test_internal_endpoints_need_the_token(client, monkeypatch, path):
+    monkeypatch.setenv("INTERNAL_TOKEN", "secret")
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={"X-Internal-Token": "wrong"}).status_code == 403
+    assert client.get(path, headers={"X-Internal-Token": "secret"}).status_code == 200
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db, User, Planets, FavPlanets
+from replicas import STICKY_COOKIE, ReplicaRouter
+
+
+def add_catalog(session, planet_name):
+    session.add(Planets(name=planet_name, populations="1000", rotation_period="24", orbital_period="300",
+                        diameter="1000", gravity="1 standard", terrain="desert", surface_water="1", climate="arid"))
+    session.add(User(name="Luke", email="luke@example.com", password="x", is_active=True))
+    session.commit()
+
+
+@pytest.fixture()
+def primary(app):
+    with app.app_context():
+        add_catalog(db.session, "primary planet")
+
+
+def use_replica(app, url, **options):
+    app.extensions["replicas"] = ReplicaRouter([url], **options)
+    return app.extensions["replicas"]
+
+
+@pytest.fixture()
+def replica(app, primary, tmp_path):
+    # A second SQLite file standing in for a replica that has the same ids but other data
+    url = "sqlite:///" + str(tmp_path / "replica.db")
+    engine = create_engine(url)
+    db.metadata.create_all(engine)
+    with Session(engine) as session:
+        add_catalog(session, "replica planet")
+    engine.dispose()
+    router = use_replica(app, url, check_interval=0)
+    yield router
+    del app.extensions["replicas"]
+    for replica in router.replicas:
+        replica.engine.dispose()
+
+
+def planet_names(client, **kwargs):
+    return [planet["name"] for planet in client.get("/planets", **kwargs).get_json()]
+
+
+def favorite_ids(client):
+    return [favorite["planets"]["id"] for favorite in client.get("/users/favorites/1").get_json()["planets"]]
+
+
+def test_reads_go_to_the_replica(client, replica):
+    assert planet_names(client) == ["replica planet"]
+
+
+def test_writes_go_to_the_primary(app, client, replica):
+    assert client.post("/favorite/planet/1", json={"id_user": 1}).get_json() == {"status": "created"}
+    with app.app_context():
+        assert db.session.query(FavPlanets).count() == 1
+    engine = replica.replicas[0].engine
+    with Session(engine) as session:
+        assert session.query(FavPlanets).count() == 0
+
+
+def test_reads_after_a_write_stay_on_the_primary(client, replica):
+    assert favorite_ids(client) == []
+    client.post("/favorite/planet/1", json={"id_user": 1})
+    # The replica has not seen the write; the writer's reads are pinned to the primary
+    assert favorite_ids(client) == [1]
+    assert planet_names(client) == ["replica planet"]
+
+
+def test_sticky_window_ends(client, app, replica):
+    replica.sticky_seconds = 0.05
+    client.post("/favorite/planet/1", json={"id_user": 1})
+    assert favorite_ids(client) == [1]
+    time.sleep(0.1)
+    assert favorite_ids(client) == []
+
+
+def test_sticky_cookie_pins_other_workers(client, replica):
+    client.set_cookie(STICKY_COOKIE, "%.3f" % (time.time() + 5))
+    assert planet_names(client) == ["primary planet"]
+    client.set_cookie(STICKY_COOKIE, "%.3f" % (time.time() - 5))
+    assert planet_names(client) == ["replica planet"]
+
+
+def test_failed_replica_falls_back_to_the_primary(app, client, primary, tmp_path):
+    router = use_replica(app, "sqlite:///" + str(tmp_path / "missing" / "replica.db"), check_interval=0)
+    try:
+        assert planet_names(client) == ["primary planet"]
+        assert router.stats()[0]["down"]
+    finally:
+        del app.extensions["replicas"]
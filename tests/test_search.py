@@ -0,0 +1,30 @@
+from sqlalchemy import event
+
+from models import db, Characters
+import search
+
+
+def test_backend_is_looked_up_once_per_engine(app, client):
+    with app.app_context():
+        db.session.add(Characters(full_name="Luke Skywalker", birth_year="19BBY", species="human", height="172",
+                                  mass="77", gender="male", hair_color="blond", skin_color="fair",
+                                  homeworld="Tatooine"))
+        db.session.commit()
+        engine = db.engine
+        with engine.begin() as connection:
+            search.ensure_sqlite_index(connection, rebuild=True)
+    lookups = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if "sqlite_master" in statement:
+            lookups.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for _ in range(3):
+            response = client.get("/search?q=luk")
+            assert response.status_code == 200
+            assert response.get_json()["backend"] == "fts5"
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    assert len(lookups) == 1
@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from models import db, Planets, Characters
+from snapshot import SnapshotLoader, export_snapshot
+
+
+@pytest.fixture()
+def catalog(app):
+    with app.app_context():
+        for i in range(1, 8):
+            db.session.add(Planets(name="planet %d" % i, populations="%d000" % i, rotation_period="24",
+                                   orbital_period="300", diameter="1000", gravity="1 standard",
+                                   terrain=("desert", "ice, rock")[i % 2], surface_water="1", climate="arid"))
+            db.session.add(Characters(full_name="character %d" % i, birth_year="19BBY", species="human",
+                                      height="170", mass="70", gender="n/a", hair_color="brown",
+                                      skin_color="fair", homeworld="planet 1"))
+        db.session.commit()
+
+
+def export(app, path):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            # Small chunks, so the rows of a table span several of them
+            return export_snapshot(connection, str(path), chunk_size=3)
+
+
+@pytest.fixture()
+def snapshot_path(app, catalog, tmp_path):
+    path = tmp_path / "catalog.snapshot"
+    export(app, path)
+    app.extensions["snapshot"] = SnapshotLoader(str(path), check_interval=0)
+    yield path
+    del app.extensions["snapshot"]
+
+
+def from_database(app, client, url):
+    loader = app.extensions.pop("snapshot", None)
+    try:
+        return client.get(url)
+    finally:
+        if loader is not None:
+            app.extensions["snapshot"] = loader
+
+
+def test_round_trip(app, client, snapshot_path):
+    for url in ("/planets/3", "/people/7", "/planets?limit=100", "/people?after_id=2&limit=3"):
+        response = client.get(url)
+        assert "X-Snapshot-Version" in response.headers
+        assert response.get_json() == from_database(app, client, url).get_json()
+    assert client.get("/planets/99").status_code == 404
+
+
+def test_pages_follow_the_next_link(client, snapshot_path):
+    ids, url = [], "/planets?limit=3"
+    while url:
+        response = client.get(url)
+        assert "X-Snapshot-Version" in response.headers
+        ids += [planet["id"] for planet in response.get_json()]
+        url = response.headers.get("Link", "").partition("<")[2].partition(">")[0]
+    assert ids == list(range(1, 8))
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_stream_is_valid_json(app, client, snapshot_path):
+    response = client.get("/people?stream=1")
+    assert "X-Snapshot-Version" in response.headers
+    assert json.loads(response.get_data()) == from_database(app, client, "/people?limit=100").get_json()
+
+
+@pytest.mark.parametrize("url", ["/planets?terrain=ice", "/planets?sort=-population", "/planets/3?fields=id,name",
+                                 "/people?stream=1&species=human"])
+def test_other_arguments_fall_back_to_the_database(app, client, snapshot_path, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert "X-Snapshot-Version" not in response.headers
+    assert response.get_data() == from_database(app, client, url).get_data()
+
+
+def test_unchanged_catalog_keeps_the_version(app, snapshot_path):
+    version = app.extensions["snapshot"].current().version
+    assert export(app, snapshot_path)["version"] == version
+
+
+def test_replaced_file_is_remapped(app, client, snapshot_path):
+    first = client.get("/planets/1")
+    old = app.extensions["snapshot"].current()
+    with app.app_context():
+        db.session.get(Planets, 1).name = "Tatooine"
+        db.session.commit()
+    # The snapshot is only as fresh as its last export
+    assert client.get("/planets/1").get_json()["name"] == "planet 1"
+    export(app, snapshot_path)
+    response = client.get("/planets/1")
+    assert response.get_json()["name"] == "Tatooine"
+    assert response.headers["X-Snapshot-Version"] != first.headers["X-Snapshot-Version"]
+    assert response.headers["ETag"] != first.headers["ETag"]
+    # A request still holding the old mapping keeps reading it after the rename
+    assert json.loads(old.table(Planets).get(1))["name"] == "planet 1"
@@ -0,0 +1,98 @@
+import pytest
+
+from models import db, User, Planets, FavPlanets
+from utils import APIException
+from writebehind import WriteBehind, coalesce, journal_from_url, queue_add, queue_remove
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def writer(request, app, tmp_path):
+    url = "memory" if request.param == "memory" else "sqlite:///" + str(tmp_path / "journal.db")
+    # A long interval: the tests flush explicitly, the background thread stays asleep
+    writer = app.extensions["write_behind"] = WriteBehind(app, journal_from_url(url), interval=3600,
+                                                          batch_size=1000)
+    yield writer
+    del app.extensions["write_behind"]
+
+
+@pytest.fixture()
+def favorites(app):
+    with app.app_context():
+        for name in ("Tatooine", "Hoth"):
+            db.session.add(Planets(name=name, populations="1000", rotation_period="24", orbital_period="300",
+                                   diameter="1000", gravity="1 standard", terrain="desert", surface_water="1",
+                                   climate="arid"))
+        db.session.add(User(name="Luke", email="luke@example.com", password="x", is_active=True))
+        db.session.flush()
+        db.session.add(FavPlanets(user_id=1, planets_id=1))
+        db.session.commit()
+
+
+def planet_ids(client):
+    return [favorite["planets"]["id"] for favorite in client.get("/users/favorites/1").get_json()["planets"]]
+
+
+def favorite_counts(app):
+    with app.app_context():
+        return {planet.id: planet.favorite_count for planet in db.session.query(Planets).order_by(Planets.id)}
+
+
+def test_coalesce_keeps_the_last_change_per_pair():
+    ops = [
+        (1, "planets", 1, 2, False, True),   # add then delete: cancelled
+        (2, "planets", 1, 2, False, False),
+        (3, "planets", 1, 1, True, False),   # delete then add: cancelled
+        (4, "planets", 1, 1, False, True),
+        (5, "characters", 1, 3, False, True),
+        (6, "characters", 1, 3, True, True),  # repeated add: one insert
+        (7, "characters", 2, 3, True, False),
+    ]
+    changes, cancelled = coalesce(ops)
+    assert cancelled == 2
+    assert changes == {"planets": ([], []), "characters": ([(1, 3)], [(2, 3)])}
+
+
+def test_add_then_delete_cancels_out(app, writer, favorites):
+    with app.test_request_context():
+        assert queue_add(1, "planets", 2)[1] == 202
+        assert queue_remove(1, "planets", 2)[1] == 202
+        assert writer.flush() == 2
+    assert writer.cancelled == 1
+    assert favorite_counts(app) == {1: 1, 2: 0}
+
+
+def test_delete_then_add_cancels_out(app, client, writer, favorites):
+    assert client.delete("/favorite/planet/1").status_code == 202
+    assert client.post("/favorite/planet/1", json={"id_user": 1}).status_code == 202
+    assert planet_ids(client) == [1]
+    assert writer.cancelled == 1
+    assert favorite_counts(app) == {1: 1, 2: 0}
+
+
+def test_repeated_delete_is_a_404(app, client, writer, favorites):
+    assert client.delete("/favorite/planet/1").status_code == 202
+    response = client.delete("/favorite/planet/1")
+    assert response.status_code == 404
+    assert response.get_json() == {"message": "Favorite not found"}
+    assert len(writer.journal) == 1
+
+
+def test_delete_of_a_missing_pair_is_a_404(app, writer, favorites):
+    with app.test_request_context():
+        with pytest.raises(APIException) as error:
+            queue_remove(1, "planets", 2)
+        assert error.value.status_code == 404
+        queue_add(1, "planets", 2)
+        assert queue_add(1, "planets", 2)[0].get_json() == {"status": "exists"}
+    assert len(writer.journal) == 1
+
+
+def test_reads_flush_the_users_pending_changes(app, client, writer, favorites):
+    assert client.post("/favorite/planet/2", json={"id_user": 1}).status_code == 202
+    assert len(writer.journal) == 1
+    assert planet_ids(client) == [1, 2]
+    assert len(writer.journal) == 0
+    assert favorite_counts(app) == {1: 1, 2: 1}
+    assert client.delete("/favorite/planet/1").status_code == 202
+    assert planet_ids(client) == [2]
+    assert favorite_counts(app) == {1: 0, 2: 1}